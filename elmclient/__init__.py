@@ -15,6 +15,8 @@ from ._ccm import *
 from ._rm import *
 from ._gcm import *
 from ._qm import *
+from .metrics import *
+from .httpcache import *
 from .__meta__ import *
 
 __app__ = __meta__.app
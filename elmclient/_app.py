@@ -5,6 +5,7 @@
 
 
 import logging
+import threading
 import urllib
 
 import requests.exceptions
@@ -26,6 +27,8 @@ class _App( httpops.HttpOperations_Mixin ):
     project_class = None
     artifact_formats = [] # For RR
     reportablerest_baseurl = "publish"
+    # the app's rootservices document, relative to the app - it is retrieved on first use of rootservices_xml
+    rootservices_reluri = 'rootservices'
 
     def __init__(self, server, contextroot, jts=None):
         super().__init__()
@@ -41,6 +44,31 @@ class _App( httpops.HttpOperations_Mixin ):
         self.iid=None # app has a dummy (empty) iid
         self.hooks = []
         self.default_query_resource = None
+        self._rootservices_xml = None
+        self._rootservices_lock = threading.Lock()
+
+    # the rootservices are only retrieved when first needed, so creating an app which isn't used doesn't cost a request
+    @property
+    def rootservices_xml(self):
+        if self._rootservices_xml is None:
+            with self._rootservices_lock:
+                if self._rootservices_xml is None:
+                    logger.info( f"Retrieving rootservices for {self.contextroot}" )
+                    self._rootservices_xml = self.execute_get_xml(self.reluri(self.rootservices_reluri))
+                    self._rootservices_loaded()
+        return self._rootservices_xml
+
+    @rootservices_xml.setter
+    def rootservices_xml(self, value):
+        self._rootservices_xml = value
+
+    # called once after the rootservices have been retrieved - subclasses can override this to get information from them
+    def _rootservices_loaded(self):
+        pass
+
+    # retrieve the rootservices now if they haven't been already
+    def load_rootservices(self):
+        return self.rootservices_xml
 
     def retrieve_cm_service_provider_xml(self):
         cm_service_provider_uri = rdfxml.xmlrdf_get_resource_uri(self.rootservices_xml,
@@ -6,10 +6,8 @@
 
 import logging
 
-import anytree
 import lxml.etree as ET
 import requests
-import tqdm
 
 from . import _app
 from . import _project
@@ -23,6 +21,9 @@ from . import utils
 
 logger = logging.getLogger(__name__)
 
+# the progress bar module is only loaded when first used
+tqdm = utils.lazy_import('tqdm')
+
 #################################################################################################
 
 class _CCMProject(_project._Project):
@@ -259,7 +260,6 @@ class _CCMApp(_app._App, _typesystem.No_Type_System_Mixin):
 
     def __init__(self, server, contextroot, jts=None):
         super().__init__(server, contextroot, jts=jts)
-        self.rootservices_xml = self.execute_get_xml(self.reluri('rootservices'))
         self.serviceproviders = 'oslc_cm:cmServiceProviders'
         self.reportablerestbase = self.contextroot+'/rpt/repository'
 
@@ -18,7 +18,6 @@ import logging
 
 import requests
 import lxml.etree as ET
-import tqdm
 
 from . import _app
 from . import _project
@@ -30,6 +29,9 @@ from . import utils
 
 logger = logging.getLogger(__name__)
 
+# the progress bar module is only loaded when first used
+tqdm = utils.lazy_import('tqdm')
+
 #################################################################################################
 
 # hook to adapt OSLC query parameters needed for GC - no orderBy, prefixes must NOT include dcterms
@@ -112,6 +114,14 @@ class _GCMProject(_project._Project):
             self._components[cu]['component'] = c
         return (ncomps, nconfs)
 
+    # the services.xml listing the shapes to load, in the current configuration
+    def _get_types_services_xml(self):
+        if self.local_config:
+            # get the configuration-specific services.xml
+            return self.get_services_xml(force=True,headers={'configuration.Context': self.local_config, 'net.jazz.jfs.owning-context': None})
+        # No config - get the services.xml
+        return self.get_services_xml(force=True)
+
     # load the typesystem using the OSLC shape resources
     def _load_types(self,force=False):
         logger.debug( f"load type {self=} {force=}" )
@@ -122,12 +132,7 @@ class _GCMProject(_project._Project):
 
         self.clear_typesystem()
 
-        if self.local_config:
-            # get the configuration-specific services.xml
-            sx = self.get_services_xml(force=True,headers={'configuration.Context': self.local_config, 'net.jazz.jfs.owning-context': None})
-        else:
-            # No config - get the services.xml
-            sx = self.get_services_xml(force=True)
+        sx = self._get_types_services_xml()
         if sx:
             shapes_to_load = rdfxml.xml_find_elements(sx, './/oslc:resourceShape')
 
@@ -386,7 +391,6 @@ class GCMApp(_app._App, oslcqueryapi._OSLCOperations_Mixin, _typesystem.Type_Sys
     def __init__(self, server, contextroot, jts=None):
         super().__init__(server, contextroot, jts=jts)
 
-        self.rootservices_xml = self.execute_get_xml(self.reluri('rootservices'))
         self.serviceproviders = 'gc:globalConfigServiceProviders'
         self.default_query_resource = 'oslc_config:Configuration'
         # load all projects and components?
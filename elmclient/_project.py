@@ -16,6 +16,11 @@ from . import utils
 
 logger = logging.getLogger(__name__)
 
+# prewarm follows references from the resource shapes to other type resources (enumerations, value shapes) this many levels deep
+PREWARM_DEPTH = 3
+# the elements in type resources which reference other type resources that are loaded with the type system
+PREWARM_TYPE_REFERENCES = [ 'oslc:range', 'oslc:valueShape', 'oslc:allowedValues', 'oslc:allowedValue' ]
+
 
 #################################################################################################
 
@@ -213,6 +218,43 @@ class _Project(oslcqueryapi._OSLCOperations_Mixin, _typesystem.Type_System_Mixin
         logger.info( f"{self=}" )
         raise Exception( "This must be implemented by the app-specific project class!" )
 
+    # the services.xml listing the shapes to load - app-specific project classes override this if it depends on the configuration
+    def _get_types_services_xml(self):
+        return self.get_services_xml()
+
+    # populate the caches for this project in each of configs (names or uris, default the current configuration) so later
+    # queries don't have to wait for the server. Requests are made with up to max_workers at once
+    # components is only used by apps where a project has components - see _rm._RMProject.prewarm()
+    def prewarm(self, *, max_workers=httpops.BULK_MAX_WORKERS, components=None, configs=None):
+        for config in configs or [None]:
+            if config is not None:
+                self.set_local_config(config)
+            self._prewarm(max_workers)
+
+    # the resource shapes, then the ranges/value shapes/allowed values they reference, are fetched level by level,
+    # then the type system is loaded (which will be almost entirely from the cache)
+    def _prewarm(self, max_workers):
+        logger.info( f"Prewarming {self.name} {self.local_config=}" )
+        sx = self._get_types_services_xml()
+        if sx is not None:
+            uris = [ rdfxml.xmlrdf_get_resource_uri(el) for el in rdfxml.xml_find_elements(sx, './/oslc:resourceShape') ]
+            done = set()
+            for level in range(PREWARM_DEPTH):
+                # only https uris are retrieved by _get_typeuri_rdf; the fragment isn't sent so is irrelevant
+                uris = { uri.rsplit('#',1)[0] for uri in uris if uri and uri.startswith("https://") } - done
+                if not uris:
+                    break
+                logger.info( f"Prewarming {len(uris)} type URIs at level {level}" )
+                done.update(uris)
+                found = []
+                for uri, result in self.execute_get_rdf_xml_many(sorted(uris), max_workers=max_workers):
+                    if isinstance(result, Exception):
+                        continue
+                    for tag in PREWARM_TYPE_REFERENCES:
+                        found.extend( rdfxml.xmlrdf_get_resource_uri(el) for el in rdfxml.xml_find_elements(result, f'.//{tag}') )
+                uris = [ uri for uri in found if uri is not None and uri.startswith(self.app.baseurl) ]
+        self._load_types(force=True)
+
     def resolve_shape_name_to_uri(self, name, exception_if_not_found=True):
         logger.info( f"resolve_shape_name_to_uri {name=}" )
         result = self.get_shape_uri(name)
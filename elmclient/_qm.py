@@ -9,10 +9,8 @@
 import logging
 import re
 
-import anytree
 import lxml.etree as ET
 import requests
-import tqdm
 
 from . import _app
 from . import _project
@@ -26,6 +24,9 @@ from . import utils
 
 logger = logging.getLogger(__name__)
 
+# the progress bar module is only loaded when first used
+tqdm = utils.lazy_import('tqdm')
+
 #################################################################################################
 
 
@@ -181,6 +182,14 @@ class _QMProject(_project._Project):
                 return cu
         return None
 
+    # the services.xml listing the shapes to load, in the current configuration
+    def _get_types_services_xml(self):
+        if self.local_config:
+            # get the configuration-specific services.xml
+            return self.get_services_xml(force=True,headers={'configuration.Context': self.local_config, 'net.jazz.jfs.owning-context': None})
+        # No config - get the services.xml
+        return self.get_services_xml(force=True)
+
     # load the typesystem using the OSLC shape resources
     def _load_types(self,force=False):
         logger.debug( f"load type {self=} {force=}" )
@@ -191,12 +200,7 @@ class _QMProject(_project._Project):
 
         self.clear_typesystem()
 
-        if self.local_config:
-            # get the configuration-specific services.xml
-            sx = self.get_services_xml(force=True,headers={'configuration.Context': self.local_config, 'net.jazz.jfs.owning-context': None})
-        else:
-            # No config - get the services.xml
-            sx = self.get_services_xml(force=True)
+        sx = self._get_types_services_xml()
         if sx:
             shapes_to_load = rdfxml.xml_find_elements(sx, './/oslc:resourceShape')
 
@@ -380,12 +384,19 @@ class _QMApp(_app._App, oslcqueryapi._OSLCOperations_Mixin, _typesystem.Type_Sys
 
     def __init__(self, server, contextroot, jts=None):
         super().__init__(server, contextroot, jts=jts)
-        self.rootservices_xml = self.execute_get_xml(self.reluri('rootservices'))
         self.serviceproviders = 'oslc_qm_10:qmServiceProviders'
         self.default_query_resource = "oslc_config:Configuration"
 
-        self.version = rdfxml.xmlrdf_get_resource_text(self.rootservices_xml,'.//oslc_rm_10:version')
-        self.majorversion = rdfxml.xmlrdf_get_resource_text(self.rootservices_xml,'.//oslc_rm_10:majorVersion')
+    # the versions are in the rootservices, which are retrieved on first use
+    @property
+    def version(self):
+        return rdfxml.xmlrdf_get_resource_text(self.rootservices_xml,'.//oslc_rm_10:version')
+
+    @property
+    def majorversion(self):
+        return rdfxml.xmlrdf_get_resource_text(self.rootservices_xml,'.//oslc_rm_10:majorVersion')
+
+    def _rootservices_loaded(self):
         logger.info( f"Versions {self.majorversion} {self.version}" )
 
     def _get_headers(self, headers=None):
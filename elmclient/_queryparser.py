@@ -4,8 +4,11 @@
 ##
 
 
+import functools
 import logging
+import os
 import re
+import sys
 
 import lark
 import lxml.etree as ET
@@ -49,6 +52,7 @@ term                : identifier_wc comparison_op value
 inop                : "in"
 
 in_val              : "[" invalue ("," invalue)* "]"
+                    | parameter -> in_parameter
 
 invalue             : value
                     | "*" unsignedinteger -> reqid_to_module_uris
@@ -77,10 +81,14 @@ value              : URI_REF_ESC
                     | urioffoldername
                     | uriofuser
                     | uriofmodule
+                    | parameter
 
 valueidentifier     : ( ( URI_REF_ESC | NAME | "'" SPACYNAME "'" ) ":" )? NAME
                     | "'" SPACYNAME "'"
                     | "~" unsignedinteger -> reqid_to_core_uri
+                    | "~" parameter -> reqid_parameter
+
+parameter           : "?" NAME
 
 unsignedinteger     : /[1-9][0-9]*/
 
@@ -151,6 +159,19 @@ where_expression    : compound_term
 
 """ + _core_oslc_grammar
 
+# a placeholder ?name for a value in a prepared query (see oslcqueryapi.PreparedQuery) - these are left in the query steps by the
+# transformer, which records the property (and operator) each one is used with so that values bound later can be resolved in that context
+class QueryParameter():
+    def __init__(self, name):
+        self.name = name
+        self.identifier = None
+        self.operator = None
+        self.reqid = False # True for ~?name - the value is an id which is turned into the URI of the core artifact
+        self.islist = False # True for in ?name - the value is a list
+
+    def __repr__(self):
+        return f"{'~' if self.reqid else ''}?{self.name}"
+
 # This class will turn a parsed query into a list of steps each (identifier,operation,value) - corresponding to an OSLC query compound_term
 # and these lists are combined with the enhanced operations for logicalor and logicaland
 # the idea is that results from OSLC query compound_terms are pushed on a stack, and the the logicalor and logicaland take the top
@@ -243,6 +264,11 @@ class _ParseTreeToOSLCQuery(lark.visitors.Transformer):
         # check if first elem is a property identifier, and if so see if value(s) are identifiers if so resolve them in context of the first identifier (e.g. for enum values)
         logger.info( f"Term {type(s)} {s}" )
         identifier, op, value = s
+        # parameters are resolved when a value is bound, in the context of this term
+        for val in ( value if isinstance(value, list) else [value] ):
+            if isinstance(val, QueryParameter):
+                val.identifier = identifier
+                val.operator = op
         if s[0] != '*':
             #
             if op == "in":
@@ -443,6 +469,18 @@ class _ParseTreeToOSLCQuery(lark.visitors.Transformer):
         logger.info( f"reqid_to_module_uris {s=} returning {result}" )
         return result
 
+    def parameter(self, s):
+        logger.info( f"parameter {s=}" )
+        return QueryParameter(s[0].value)
+
+    def reqid_parameter(self, s):
+        s[0].reqid = True
+        return s[0]
+
+    def in_parameter(self, s):
+        s[0].islist = True
+        return s[0]
+
     def comparison_op(self, s):
         logger.info( f"comparison_op {s=}" )
         return s[0].value
@@ -615,3 +653,43 @@ class _ParseTreeToOSLCOrderBySelect(lark.visitors.Transformer):
             # a prefixed name is assumed to be usable directly (the prefix has been added to prefixes)
             result = resultname
         return result
+
+##############################################################################################
+# the parsers are built once per process, using LALR rather than the default Earley parser - these grammars are LALR-compatible
+# and (on a corpus of queries, selects and orderbys including invalid ones) give the same parse trees, but LALR parses a typical
+# query about 25x faster. Parse errors are still lark.exceptions.UnexpectedInput, but may be a different subclass
+# name: (grammar, start rule, lark parser)
+PARSERS = {
+    'enhanced':     (_enhanced_oslc3_query_grammar, 'where_expression', 'lalr')
+    ,'basic':       (_basic_oslc3_query_grammar, 'where_expression', 'lalr')
+    ,'select':      (_select_grammar, 'select_terms', 'lalr')
+    ,'orderby':     (_orderby_grammar, 'sort_terms', 'lalr')
+}
+
+# if set, built LALR parsers are saved in this folder so later runs load them (a few ms) rather than building them again
+# (~50ms for the query grammar). A saved parser is only used if the grammar and options are unchanged. Saved parsers are
+# pickles, so loading one can run arbitrary code: the folder is created only readable/writable by the user, and (on posix)
+# isn't used if it's owned by someone else or writable by group/others. Default None doesn't save the parsers
+PARSER_CACHE_FOLDER = None
+
+# True if folder can safely be used to save parsers
+def _is_private_folder(folder):
+    os.makedirs(folder, mode=0o700, exist_ok=True)
+    if os.name != 'posix':
+        return True
+    st = os.stat(folder)
+    return st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+# return the (shared) lark parser for name in PARSERS
+@functools.lru_cache(maxsize=None)
+def get_parser(name):
+    grammar, start, parser = PARSERS[name]
+    if PARSER_CACHE_FOLDER and parser == 'lalr':
+        cachefile = os.path.join(PARSER_CACHE_FOLDER, f"{name}_py{sys.version_info[0]}{sys.version_info[1]}_lark{lark.__version__}.tmp")
+        try:
+            if _is_private_folder(PARSER_CACHE_FOLDER):
+                return lark.Lark(grammar, start=start, parser=parser, debug=False, cache=cachefile)
+            logger.warning( f"Not saving parsers in {PARSER_CACHE_FOLDER} because it can be written by other users" )
+        except OSError as e:
+            logger.info( f"Parser {name} can't be saved to {cachefile} {e}" )
+    return lark.Lark(grammar, start=start, parser=parser, debug=False)
@@ -4,17 +4,17 @@
 ##
 
 
+import functools
 import logging
 import re
 
-import anytree
 import lxml.etree as ET
 import requests
-import tqdm
 
 from . import _app
 from . import _project
 from . import _typesystem
+from . import httpops
 from . import oslcqueryapi
 from . import rdfxml
 from . import server
@@ -24,14 +24,22 @@ from . import utils
 
 logger = logging.getLogger(__name__)
 
+# the progress bar module is only loaded when first used
+tqdm = utils.lazy_import('tqdm')
+
 #################################################################################################
 
-class _Folder(anytree.NodeMixin):
-    def __init__(self, name=None, folderuri=None, parent=None):
-        super().__init__()
-        self.name = name
-        self.folderuri = folderuri
-        self.parent = parent
+# the folder class is created when folders are first loaded, so anytree is only imported if needed
+@functools.lru_cache(maxsize=None)
+def _folder_class():
+    import anytree
+    class _Folder(anytree.NodeMixin):
+        def __init__(self, name=None, folderuri=None, parent=None):
+            super().__init__()
+            self.name = name
+            self.folderuri = folderuri
+            self.parent = parent
+    return _Folder
 
 #################################################################################################
 
@@ -52,6 +60,7 @@ class _RMProject(_project._Project):
         self.is_singlemode = False # this is only true if config enabled is true and single mode is true
         self.gcconfiguri = None
         self.default_query_resource = "oslc_rm:Requirement"
+        self._resource_ids = {} # keyed on resource uri, values are the dcterms:identifier
 
     #
     # load folders until name_or_uri is found (cuts loading short, remembers folders still to load) or until all loaded
@@ -118,11 +127,11 @@ class _RMProject(_project._Project):
 
                 if parent is None:
                     # ROOT folder
-                    thisfolder = _Folder(name=ROOTNAME,folderuri=folderuri)
+                    thisfolder = _folder_class()(name=ROOTNAME,folderuri=folderuri)
                     self._folders[ROOTNAME] = thisfolder
                     logger.debug( f"Adding root {ROOTNAME} {thisfolder}" )
                 else:
-                    thisfolder = _Folder(name=fname,folderuri=folderuri, parent=parent)
+                    thisfolder = _folder_class()(name=fname,folderuri=folderuri, parent=parent)
 
                 # insert the name and its queryuri
                 if fname in self._folders:
@@ -280,35 +289,54 @@ class _RMProject(_project._Project):
                 cru = rdfxml.xmlrdf_get_resource_uri(projcx, 'oslc:creation')
                 crx = self.execute_get_rdf_xml(cru)
 
-                for component_el in rdfxml.xml_find_elements(crx, './/ldp:contains'):
-                    compu = component_el.get("{%s}resource" % rdfxml.RDF_DEFAULT_PREFIX["rdf"])
-                    compx = self.execute_get_rdf_xml(compu)
+                # retrieve all the components concurrently
+                compus = [component_el.get("{%s}resource" % rdfxml.RDF_DEFAULT_PREFIX["rdf"]) for component_el in rdfxml.xml_find_elements(crx, './/ldp:contains')]
+                confsus = {}
+                for compu, compx in self.execute_get_rdf_xml_many(compus, ordered=True):
+                    if isinstance(compx, Exception):
+                        raise compx
                     comptitle = rdfxml.xmlrdf_get_resource_text(compx, './/dcterms:title')
 
                     self._components[compu] = {'name': comptitle, 'configurations': {}}
                     ncomps += 1
-                    confu = rdfxml.xmlrdf_get_resource_uri(compx, './/oslc_config:configurations')
-                    configs_xml = self.execute_get_rdf_xml(confu)
+                    confsus[compu] = rdfxml.xmlrdf_get_resource_uri(compx, './/oslc_config:configurations')
+
+                # retrieve the list of configurations for each component
+                confus = []
+                confsucomps = {confsu: compu for compu, confsu in confsus.items()}
+                for confu, configs_xml in self.execute_get_rdf_xml_many(confsus.values(), ordered=True):
+                    if isinstance(configs_xml, Exception):
+                        raise configs_xml
+                    compu = confsucomps[confu]
                     for confmemberx in rdfxml.xml_find_elements(configs_xml, './/rdfs:member'):
-                        thisconfu = confmemberx.get("{%s}resource" % rdfxml.RDF_DEFAULT_PREFIX["rdf"])
-                        try:
-                            thisconfx = self.execute_get_rdf_xml(thisconfu)
-                            conftitle = rdfxml.xmlrdf_get_resource_text(thisconfx, './/dcterms:title')
-                            conftypeuri = rdfxml.xmlrdf_get_resource_uri(thisconfx, './/rdf:type')
-                            conftype = "Baseline" if "#Baseline" in conftypeuri else "Stream"
-                            created = rdfxml.xmlrdf_get_resource_uri(thisconfx, './/dcterms:created')
-                            self._components[compu]['configurations'][thisconfu] = {'name': conftitle, 'conftype': conftype
-                                                                                    ,'confXml': thisconfx
-                                                                                    ,'created': created
-                                                                                    }
-                            self._configurations[thisconfu] = self._components[compu]['configurations'][thisconfu]
-                            baselines_u = rdfxml.xmlrdf_get_resource_uri(thisconfx, './/oslc_config:baselines')
-                            logger.debug( f"{baselines_u=}" )
-                            if baselines_u is not None:
-                                baselines_x = self.execute_get_rdf_xml(baselines_u)
-                            nconfs += 1
-                        except requests.exceptions.HTTPError as e:
-                            pass
+                        confus.append( ( compu, confmemberx.get("{%s}resource" % rdfxml.RDF_DEFAULT_PREFIX["rdf"]) ) )
+
+                # and retrieve all the configurations - a configuration which can't be retrieved is ignored
+                confcomps = {thisconfu: compu for compu, thisconfu in confus}
+                baselines_us = []
+                for thisconfu, thisconfx in self.execute_get_rdf_xml_many([thisconfu for compu, thisconfu in confus], ordered=True):
+                    if isinstance(thisconfx, requests.exceptions.HTTPError):
+                        continue
+                    elif isinstance(thisconfx, Exception):
+                        raise thisconfx
+                    compu = confcomps[thisconfu]
+                    conftitle = rdfxml.xmlrdf_get_resource_text(thisconfx, './/dcterms:title')
+                    conftypeuri = rdfxml.xmlrdf_get_resource_uri(thisconfx, './/rdf:type')
+                    conftype = "Baseline" if "#Baseline" in conftypeuri else "Stream"
+                    created = rdfxml.xmlrdf_get_resource_uri(thisconfx, './/dcterms:created')
+                    self._components[compu]['configurations'][thisconfu] = {'name': conftitle, 'conftype': conftype
+                                                                            ,'confXml': thisconfx
+                                                                            ,'created': created
+                                                                            }
+                    self._configurations[thisconfu] = self._components[compu]['configurations'][thisconfu]
+                    baselines_u = rdfxml.xmlrdf_get_resource_uri(thisconfx, './/oslc_config:baselines')
+                    logger.debug( f"{baselines_u=}" )
+                    if baselines_u is not None:
+                        baselines_us.append(baselines_u)
+                    nconfs += 1
+                # the baselines are retrieved (to warm the cache) but failures are ignored
+                for baselines_u, baselines_x in self.execute_get_rdf_xml_many(baselines_us):
+                    pass
 
         # now create the "components"
         for cu, cd in self._components.items():
@@ -327,6 +355,14 @@ class _RMProject(_project._Project):
                 return cu
         return None
 
+    # the services.xml listing the shapes to load, in the current configuration
+    def _get_types_services_xml(self):
+        if self.local_config:
+            # get the configuration-specific services.xml
+            return self.get_services_xml(force=True,headers={'Configuration.Context': self.local_config, 'net.jazz.jfs.owning-context': None})
+        # No config - get the services.xml
+        return self.get_services_xml(force=True)
+
     # for RM, load the typesystem using the OSLC shape resources listed for the Requirements and Requirements Collection creation factories
     def _load_types(self,force=False):
         logger.debug( f"load type {self=} {force=}" )
@@ -336,12 +372,7 @@ class _RMProject(_project._Project):
 
         self.clear_typesystem()
 
-        if self.local_config:
-            # get the configuration-specific services.xml
-            sx = self.get_services_xml(force=True,headers={'Configuration.Context': self.local_config, 'net.jazz.jfs.owning-context': None})
-        else:
-            # No config - get the services.xml
-            sx = self.get_services_xml(force=True)
+        sx = self._get_types_services_xml()
         if sx:
             shapes_to_load = rdfxml.xml_find_elements(sx, './/oslc:resourceShape' )
 
@@ -359,6 +390,40 @@ class _RMProject(_project._Project):
 
         return None
 
+    # populate the caches for the project - for an opt-in project (not a component) this is done for each of the components
+    # (names or uris, default all) in each of configs (names or uris, default the initial stream), which also fetches the
+    # component/configuration listings; otherwise as for the other apps
+    def prewarm(self, *, max_workers=httpops.BULK_MAX_WORKERS, components=None, configs=None):
+        if self.is_optin and self.component_project is None:
+            self.load_components_and_configurations()
+            for compuri, compdetail in self._components.items():
+                if components is not None and compuri not in components and compdetail['name'] not in components:
+                    continue
+                c = compdetail['component']
+                for config in configs or [c.initial_stream_name()]:
+                    configuri = c.get_local_config(config)
+                    if configuri is None:
+                        logger.warning( f"Configuration '{config}' not found in component {compdetail['name']} - not prewarmed" )
+                        continue
+                    c.set_local_config(configuri)
+                    c._prewarm(max_workers)
+            return
+        super().prewarm(max_workers=max_workers, configs=configs)
+
+    # as well as the type system, fetch the folder hierarchy a level at a time - load_folders() will then find all of them in the cache
+    def _prewarm(self, max_workers):
+        super()._prewarm(max_workers)
+        qcuri = self.get_query_capability_uri(resource_type='http://jazz.net/ns/rm/navigation#folder')
+        level = [qcuri] if qcuri is not None else []
+        while level:
+            nextlevel = []
+            for queryuri, folderxml in self.execute_get_xml_many(level, max_workers=max_workers):
+                if isinstance(folderxml, Exception):
+                    continue
+                for subel in rdfxml.xml_find_elements(folderxml,'.//rm_nav:subfolders'):
+                    nextlevel.append( rdfxml.xmlrdf_get_resource_uri( subel ) )
+            level = nextlevel
+
     # pick all the attributes from a resource shape definition
     # and for enumerated attributes get all the enumeration values
     def _load_type_from_resource_shape(self, el, supershape=None):
@@ -506,11 +571,22 @@ class _RMProject(_project._Project):
     # for OSLC query, given a resource URI, return the requirement dcterms:identifier
     def resource_id_from_uri(self, uri):
         if self.is_resource_uri(uri):
-            resource_xml = self.execute_get_rdf_xml(reluri=uri)
-            id = rdfxml.xmlrdf_get_resource_text(resource_xml, ".//dcterms:identifier")
-            return id
+            if uri not in self._resource_ids:
+                resource_xml = self.execute_get_rdf_xml(reluri=uri)
+                self._resource_ids[uri] = rdfxml.xmlrdf_get_resource_text(resource_xml, ".//dcterms:identifier")
+            return self._resource_ids[uri]
         raise Exception(f"Bad resource uri {uri}")
 
+    # retrieve the identifiers for many resource uris concurrently, so that resource_id_from_uri doesn't have to retrieve them one at a time
+    # uris which aren't resources or can't be retrieved are ignored here (resource_id_from_uri will handle them as usual)
+    def prefetch_resource_ids(self, uris):
+        touris = [uri for uri in dict.fromkeys(uris) if isinstance(uri,str) and uri not in self._resource_ids and self.is_resource_uri(uri)]
+        if touris:
+            logger.info( f"Prefetching {len(touris)} resource ids" )
+            for uri, resource_xml in self.execute_get_rdf_xml_many(touris):
+                if not isinstance(resource_xml, Exception):
+                    self._resource_ids[uri] = rdfxml.xmlrdf_get_resource_text(resource_xml, ".//dcterms:identifier")
+
     def is_folder_uri(self, uri):
         if uri and uri.startswith(self.app.baseurl) and '/folders/' in uri:
             return True
@@ -647,13 +723,20 @@ class _RMApp(_app._App, _typesystem.No_Type_System_Mixin):
 
     def __init__(self, server, contextroot, jts=None):
         super().__init__(server, contextroot, jts=jts)
-        self.rootservices_xml = self.execute_get_xml(self.reluri('rootservices') )
         self.serviceproviders = 'oslc_rm_10:rmServiceProviders'
-        self.version = rdfxml.xmlrdf_get_resource_text(self.rootservices_xml,'.//oslc_rm_10:version')
-        self.majorversion = rdfxml.xmlrdf_get_resource_text(self.rootservices_xml,'.//oslc_rm_10:majorVersion')
         self.reportablerestbase = self.contextroot+'/publish'
         self.default_query_resource = None # RM doesn't provide any app-level queries
 
+    # the versions are in the rootservices, which are retrieved on first use
+    @property
+    def version(self):
+        return rdfxml.xmlrdf_get_resource_text(self.rootservices_xml,'.//oslc_rm_10:version')
+
+    @property
+    def majorversion(self):
+        return rdfxml.xmlrdf_get_resource_text(self.rootservices_xml,'.//oslc_rm_10:majorVersion')
+
+    def _rootservices_loaded(self):
         logger.info( f"Versions {self.majorversion} {self.version}" )
 
     def _get_headers(self, headers=None):
@@ -0,0 +1,169 @@
+##
+## © Copyright 2021- IBM Inc. All rights reserved
+# SPDX-License-Identifier: MIT
+##
+
+#
+# Administer the response cache used by oslcquery and the other examples - invalidate, stats and prune need --cachebackend sqlite
+# e.g. to refresh the data for one stream while keeping the (expensive to fetch) type system data for everything else:
+#   cacheadmin invalidate --config https://jazz.ibm.com:9443/rm/cm/stream/_abc123
+# or to refresh all the type system data:
+#   cacheadmin invalidate --typesystem
+# or before running a batch of queries, fetch everything needed for the type system/folders/configurations of some projects:
+#   cacheadmin prewarm -J https://jazz.ibm.com:9443 -U ibm -P PROMPT -A rm -p "rm_gc_p1" -p "rm_gc_p2" -j 16
+# NOTE cached responses are specific to the user so prewarm as the user who will run the queries
+# to see what's in the cache, by app or by url pattern, and remove old entries:
+#   cacheadmin stats --groupby pattern
+#   cacheadmin prune --maxage 30 --maxsize 1000
+#
+
+import argparse
+import getpass
+import json
+import logging
+import os
+import sys
+
+from elmclient import httpcache
+from elmclient import httpops
+from elmclient import server
+
+logger = logging.getLogger(__name__)
+
+# url patterns used by --typesystem to match type/shape resources in all the apps
+TYPESYSTEM_PATTERNS = [ "*/types/*", "*/shape*", "*/shapes/*" ]
+
+def open_cache(args):
+    filename = os.path.join(args.cachefolder, httpcache.SQLITE_CACHE_FILE)
+    if not os.path.isfile(filename):
+        raise Exception( f"There is no sqlite cache {filename} - the cache is only created when using --cachebackend sqlite" )
+    return httpcache.SQLiteCache(filename, maxsize=None)
+
+def do_invalidate(args):
+    cache = open_cache(args)
+    patterns = list(args.urlpattern)
+    if args.typesystem:
+        patterns.extend(TYPESYSTEM_PATTERNS)
+    criteria = {'server': args.server, 'user': args.user, 'config': args.config, 'app': args.app, 'url': args.url, 'urlprefix': args.urlprefix}
+    if not patterns and all( v is None for v in criteria.values() ) and not args.all:
+        raise Exception( "Specify what to invalidate, or --all to remove everything" )
+    if patterns:
+        count = sum( cache.invalidate(urlpattern=pattern, **criteria) for pattern in patterns )
+    else:
+        count = cache.invalidate(**criteria)
+    print( f"Removed {count} cached responses" )
+
+def do_stats(args):
+    cache = open_cache(args)
+    staleafter = args.staleafter*86400 if args.staleafter is not None else None
+    details = cache.inspect(groupby=args.groupby, top=args.top, staleafter=staleafter)
+    if args.json:
+        print( json.dumps(details, indent=2) )
+        return
+    stats = cache.get_stats()
+    totals = details['totals']
+    print( f"Cache {stats['filename']}" )
+    print( f"{totals['entries']} entries {mb(totals['size'])} (uncompressed {mb(totals['rawsize'])} compression ratio {stats['ratio']:.2f})" )
+    print( f"{totals['hits']} hits, hit ratio {totals['hit_ratio']:.2f}, {totals['unused']} entries never reused" )
+    print( "\nAge: " + ", ".join( f"{label} {n}" for label, n in details['ages'].items() ) )
+    if staleafter is not None:
+        print( f"Stale (older than {args.staleafter} days): {details['stale']['entries']} entries {mb(details['stale']['size'])}" )
+    print( f"\nBy {args.groupby}:" )
+    print( f"{'entries':>8} {'size':>10} {'hits':>8} {'ratio':>6} {'unused':>8}  {args.groupby}" )
+    for name, g in details['groups'].items():
+        print( f"{g['entries']:>8} {mb(g['size']):>10} {g['hits']:>8} {g['hit_ratio']:>6.2f} {g['unused']:>8}  {name or '(none)'}" )
+    if details['largest']:
+        print( "\nLargest entries:" )
+        for e in details['largest']:
+            print( f"{mb(e['size']):>10} {e['hits']:>8} hits {e['age_seconds']/86400:>6.1f} days  {e['url']}" )
+
+def do_prune(args):
+    if args.maxage is None and args.maxsize is None:
+        raise Exception( "Specify --maxage and/or --maxsize" )
+    cache = open_cache(args)
+    removed = cache.prune(maxage=args.maxage*86400 if args.maxage is not None else None, maxsize=args.maxsize*1024*1024 if args.maxsize is not None else None, unused=args.unused)
+    print( f"Removed {removed} cached responses, cache is now {mb(cache.get_size())}" )
+
+def mb(size):
+    if size < 1024*1024:
+        return f"{size/1024:.1f}KB"
+    return f"{size/(1024*1024):.1f}MB"
+
+def do_prewarm(args):
+    if args.password == "PROMPT":
+        args.password = getpass.getpass(prompt=f'Password for user {args.username}: ')
+    appstrings = args.appstrings.split(",")
+    theserver = server.JazzTeamServer(args.jazzurl, args.username, args.password, verifysslcerts=args.certs, jtsappstring=f"jts:{args.jts}", cachefolder=args.cachefolder, cachebackend=args.cachebackend, cachemaxsize=args.cachemaxsize*1024*1024, cachecompression=args.cachecompression)
+    # the other apps are created so their rootservices and catalogs are cached
+    apps = [ theserver.find_app(appstring, ok_to_create=True) for appstring in appstrings ]
+    app = apps[0]
+    for projectname in args.projectname:
+        p = app.find_project(projectname)
+        if p is None:
+            raise Exception( f"Project '{projectname}' not found" )
+        print( f"Prewarming project {projectname}" )
+        p.prewarm(max_workers=args.jobs, components=args.component or None, configs=args.configuration or None)
+    print( f"Prewarm finished {theserver.get_metrics().get_stats()['totals']}" )
+    print( f"Cache {theserver.get_cache_stats()}" )
+
+def do_cacheadmin(inputargs=None):
+    inputargs = inputargs or sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description="Administer the response cache - invalidate, stats and prune need the sqlite backend (--cachebackend sqlite)")
+    parser.add_argument('--cachefolder', default=server.CACHE_FOLDER, help=f"The cache folder, default {server.CACHE_FOLDER}")
+    parser.add_argument('-L', '--loglevel', default=None, help="Set logging level to one of DEBUG, INFO, WARNING, ERROR, CRITICAL")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    invalidate = subparsers.add_parser('invalidate', help="Remove cached responses matching all the criteria given")
+    invalidate.add_argument('--server', default=None, help="Server e.g. https://jazz.ibm.com:9443")
+    invalidate.add_argument('--user', default=None, help="User id")
+    invalidate.add_argument('--config', default=None, help="Configuration URI, e.g. a stream - responses retrieved in this configuration")
+    invalidate.add_argument('--app', default=None, help="App context root e.g. rm")
+    invalidate.add_argument('--url', default=None, help="An exact URL")
+    invalidate.add_argument('--urlprefix', default=None, help="URLs starting with this")
+    invalidate.add_argument('--urlpattern', action='append', default=[], help="URLs matching this glob pattern e.g. */types/* - can be specified more than once")
+    invalidate.add_argument('--typesystem', action="store_true", help=f"Type system URLs (matching any of {TYPESYSTEM_PATTERNS})")
+    invalidate.add_argument('--all', action="store_true", help="Remove everything (when no other criteria are given)")
+    invalidate.set_defaults(func=do_invalidate)
+
+    stats = subparsers.add_parser('stats', help="Show the cache size, age of entries, hits and the totals by app or url pattern etc.")
+    stats.add_argument('--groupby', default='app', choices=httpcache.INSPECT_GROUPS, help="How to group the entries, pattern is the url with ids replaced by {id} - default app")
+    stats.add_argument('--top', default=10, type=int, help="Number of largest entries to show, default 10")
+    stats.add_argument('--staleafter', default=server.CACHEDAYS, type=float, help=f"Entries stored more than this many days ago are reported as stale, default {server.CACHEDAYS}")
+    stats.add_argument('--json', action="store_true", help="Output the stats as JSON")
+    stats.set_defaults(func=do_stats)
+
+    prune = subparsers.add_parser('prune', help="Remove old entries and/or reduce the size of the cache")
+    prune.add_argument('--maxage', default=None, type=float, help="Remove entries stored more than this many days ago")
+    prune.add_argument('--unused', action="store_true", help="With --maxage, only remove entries which have never been reused")
+    prune.add_argument('--maxsize', default=None, type=int, help="Remove the least-recently used entries until the cache is no bigger than this many MB")
+    prune.set_defaults(func=do_prune)
+
+    prewarm = subparsers.add_parser('prewarm', help="Populate the cache for projects (and their components/configurations) by fetching their type system, folders and configurations")
+    prewarm.add_argument("-J", "--jazzurl", default=os.environ.get("QUERY_JAZZURL","https://jazz.ibm.com:9443"), help="jazz server url (without the /jts!) - default from environment variable QUERY_JAZZURL")
+    prewarm.add_argument("-U", "--username", default=os.environ.get("QUERY_USER","ibm"), help="user id - default from environment variable QUERY_USER - NOTE cached responses are only used for the same user")
+    prewarm.add_argument("-P", "--password", default=os.environ.get("QUERY_PASSWORD","ibm"), help="user password - default from environment variable QUERY_PASSWORD - set to PROMPT to be asked for password at runtime")
+    prewarm.add_argument("--jts", default=os.environ.get("QUERY_JTS","jts"), help="The jts context root - default from environment variable QUERY_JTS")
+    prewarm.add_argument('-A', '--appstrings', default=os.environ.get("QUERY_APPSTRINGS","rm"), help="A comma-separated list of apps, the projects are in the first one e.g. rm,gc - default from environment variable QUERY_APPSTRINGS")
+    prewarm.add_argument('-p', '--projectname', action='append', required=True, help="A project to prewarm - can be specified more than once")
+    prewarm.add_argument('-C', '--component', action='append', default=[], help="For opt-in projects, a component to prewarm (default all) - can be specified more than once")
+    prewarm.add_argument('-F', '--configuration', action='append', default=[], help="A configuration name or URI to prewarm (default for each component its initial stream) - can be specified more than once")
+    prewarm.add_argument('-j', '--jobs', default=httpops.BULK_MAX_WORKERS, type=int, help=f"Maximum number of concurrent requests to the server, default {httpops.BULK_MAX_WORKERS}")
+    prewarm.add_argument('-T', '--certs', action="store_true", help="Verify SSL certificates")
+    prewarm.add_argument('--cachebackend', default=server.CACHE_BACKEND, choices=['file','sqlite'], help=f"The cache backend - must be the same as used by the queries which follow - default {server.CACHE_BACKEND}")
+    prewarm.add_argument('--cachemaxsize', default=server.CACHE_MAX_SIZE//(1024*1024), type=int, help=f"With --cachebackend sqlite, the maximum size of the cache in MB, default {server.CACHE_MAX_SIZE//(1024*1024)}")
+    prewarm.add_argument('--cachecompression', default=server.CACHE_COMPRESSION, choices=httpcache.COMPRESSION_CODECS, help="Compress cached responses using zlib or zstd - default no compression")
+    prewarm.set_defaults(func=do_prewarm)
+
+    args = parser.parse_args(inputargs)
+
+    if args.loglevel:
+        logging.basicConfig(level=getattr(logging, args.loglevel.upper()))
+
+    args.func(args)
+
+def main():
+    do_cacheadmin(sys.argv[1:])
+
+if __name__ == '__main__':
+    main()
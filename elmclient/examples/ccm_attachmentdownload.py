@@ -7,6 +7,7 @@
 # example of using the elmclient package to download a work item attachment
 
 import logging
+import os
 
 import lxml.etree as ET
 
@@ -63,8 +64,8 @@ for attachment in rdfxml.xml_find_elements( xmlresult, './/rtc_cm:com.ibm.team.w
     filename = rdfxml.xmlrdf_get_resource_text( attachment_info, './/dcterms:title' )
     print( f"{filename=}" )
     # download it, using Referer set to the URI (addresses a security measure built-in to ccm)
-    attachment_binary = ccmapp.server.execute_get_binary(download_u, cacheable=False, headers={'OSLC-Core-Version': '2.0', 'Referer':download_u})
-    print( f"{len(attachment_binary.content)}" )
-    # open( filename,"wb" ).write( attachment_binary )
+    # the attachment is streamed to the file so it isn't held in memory
+    ccmapp.server.execute_download(download_u, filename, headers={'OSLC-Core-Version': '2.0', 'Referer':download_u}, progress=True)
+    print( f"Saved {os.path.getsize(filename)} bytes to {filename}" )
 
 print( "Finished" )
@@ -0,0 +1,99 @@
+##
+## © Copyright 2021- IBM Inc. All rights reserved
+# SPDX-License-Identifier: MIT
+##
+
+#
+# Measure how long it takes to import elmclient, using python -X importtime in fresh processes
+# This is tracked so changes which make every command slower to start are noticed, e.g.
+#   python -m elmclient.examples.importtime
+#   python -m elmclient.examples.importtime --json --save importtime.json
+#   python -m elmclient.examples.importtime --baseline importtime.json --maxregression 20
+# exit code is 1 if the import is more than --maxregression percent slower than the baseline, or if any of LAZY_MODULES
+# are loaded by the import (these are slow to import and elmclient only loads them when they're first used)
+#
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# modules which importing elmclient shouldn't load
+LAZY_MODULES = ['anytree', 'asyncio', 'colorama', 'cryptography', 'lark', 'requests_toolbelt', 'termios', 'tqdm', 'tty', 'elmclient._queryparser']
+
+# run one import in a new python process, returning a dictionary of module name to (self microseconds, cumulative microseconds)
+def measure_once(module):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception( f"Importing {module} failed {result.stderr}" )
+    times = {}
+    for line in result.stderr.splitlines():
+        # lines are like "import time:       372 |     176302 |   elmclient.server"
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        selftime, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(selftime), int(cumulative))
+    return times
+
+def measure(module, runs, top):
+    allruns = [measure_once(module) for i in range(runs)]
+    totals = [run[module][1] for run in allruns]
+    # the breakdown is from the fastest run, which has least noise from the rest of the system
+    best = allruns[totals.index(min(totals))]
+    largest = sorted( ( (name, t[0], t[1]) for name, t in best.items() if name != module ), key=lambda x: x[1], reverse=True )[:top]
+    return {
+        'module': module
+        ,'python': sys.version.split()[0]
+        ,'runs': runs
+        ,'min_ms': min(totals)/1000
+        ,'median_ms': statistics.median(totals)/1000
+        ,'modules_loaded': len(best)
+        ,'lazy_modules_loaded': [name for name in LAZY_MODULES if name in best]
+        ,'largest_self_ms': [ {'module': name, 'self_ms': selftime/1000, 'cumulative_ms': cumulative/1000} for name, selftime, cumulative in largest ]
+    }
+
+def do_importtime(inputargs=None):
+    inputargs = inputargs or sys.argv[1:]
+    parser = argparse.ArgumentParser(description="Measure the time to import elmclient (or another module) using python -X importtime")
+    parser.add_argument('-m', '--module', default='elmclient', help="The module to import, default elmclient")
+    parser.add_argument('-n', '--runs', default=5, type=int, help="Number of runs, each in a new process, default 5")
+    parser.add_argument('-t', '--top', default=10, type=int, help="Number of modules with the largest import time to show, default 10")
+    parser.add_argument('--json', action="store_true", help="Output the results as JSON")
+    parser.add_argument('--save', default=None, help="Save the results as JSON to this file, e.g. to use as a baseline")
+    parser.add_argument('--baseline', default=None, help="A JSON file saved by a previous run to compare the median time with")
+    parser.add_argument('--maxregression', default=None, type=float, help="With --baseline, fail if the median is more than this percentage slower than the baseline")
+    args = parser.parse_args(inputargs)
+
+    results = measure(args.module, max(1, args.runs), args.top)
+    failed = bool(results['lazy_modules_loaded'])
+
+    if args.baseline:
+        baseline = json.load(open(args.baseline))
+        results['baseline_median_ms'] = baseline['median_ms']
+        results['change_percent'] = 100.0*(results['median_ms']-baseline['median_ms'])/baseline['median_ms']
+        if args.maxregression is not None and results['change_percent'] > args.maxregression:
+            failed = True
+
+    if args.save:
+        json.dump(results, open(args.save, 'w'), indent=2)
+
+    if args.json:
+        print( json.dumps(results, indent=2) )
+    else:
+        print( f"import {results['module']} (python {results['python']}): median {results['median_ms']:.1f}ms min {results['min_ms']:.1f}ms over {results['runs']} runs, {results['modules_loaded']} modules loaded" )
+        if 'change_percent' in results:
+            print( f"Baseline median {results['baseline_median_ms']:.1f}ms change {results['change_percent']:+.1f}%" )
+        if results['lazy_modules_loaded']:
+            print( f"Modules which should only be loaded when used were imported: {', '.join(results['lazy_modules_loaded'])}" )
+        print( f"\n{'self ms':>8} {'cumul ms':>9}  module" )
+        for m in results['largest_self_ms']:
+            print( f"{m['self_ms']:>8.1f} {m['cumulative_ms']:>9.1f}  {m['module']}" )
+
+    return 1 if failed else 0
+
+def main():
+    sys.exit(do_importtime(sys.argv[1:]))
+
+if __name__ == '__main__':
+    main()
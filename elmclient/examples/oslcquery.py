@@ -5,6 +5,7 @@
 
 
 import argparse
+import atexit
 import csv
 import getpass
 import json
@@ -18,12 +19,12 @@ import time
 import urllib3
 import webbrowser
 
-import cryptography
-import cryptography.fernet
 import lxml.etree as ET
 import requests
 import urllib.parse
 
+from elmclient import httpcache
+from elmclient import httpops
 from elmclient import rdfxml
 from elmclient import server
 from elmclient import utils
@@ -102,7 +103,19 @@ def do_oslc_query(inputargs=None):
     parser.add_argument('--compareresults', default=None, help="TESTING UNFINISHED: saved CSV file to compare results with")
     parser.add_argument('--pagesize', default=200, type=int, help="Page size for OSLC query (default 200)")
     parser.add_argument('--typesystemreport', default=None, help="Load the specified project/configuration and then produce a simple HTML type system report of resource shapes/properties/enumerations to this file" )
+    parser.add_argument('--xmljobs', default=8, type=int, help="Number of concurrent GETs used to retrieve the artifacts for -X/--xmloutputfile (default 8)" )
+    parser.add_argument('--adaptive', action="store_true", help="Adapt the number of concurrent GETs (up to --xmljobs or --pagejobs) to the server's latency and overload responses" )
+    parser.add_argument('--pagejobs', default=1, type=int, help="Number of pages of query results to retrieve concurrently (default 1, i.e. one page at a time) - only used when the server gives the total number of results and a known form of next page URL, and there's no --delaybetweenpages" )
+    parser.add_argument('--tracesample', default=1, type=int, help="When logging at TRACE level, only WIRE trace one in this number of requests (default 1 traces every request)" )
+    parser.add_argument('--traceslow', default=None, type=float, help="When logging at TRACE level, only WIRE trace requests which take at least this many seconds" )
+    parser.add_argument('--ratelimit', default=None, type=float, help="Maximum requests per second to the server (across all apps) - default no limit" )
+    parser.add_argument('--burst', default=None, type=int, help="With --ratelimit, the number of requests which can be sent at once after being idle - default same as --ratelimit" )
+    parser.add_argument('--metrics', default=None, help="Save request metrics (latency per endpoint, bytes, retries, logins, cache hits) to this file when finished - Prometheus text format if the name ends .prom, otherwise JSON" )
     parser.add_argument('--cachedays', default=1,type=int, help="The number of days for caching received data, default 1. To disable caching use -WW. To keep using a non-default cache period you must specify this value every time" )
+    parser.add_argument('--revalidate', nargs='?', const=server.REVALIDATE_AFTER, default=None, type=int, metavar='SECONDS', help=f"Revalidate cached responses older than SECONDS (default {server.REVALIDATE_AFTER}) with the server using conditional requests, so cached data is never stale but unchanged data isn't transferred again. Otherwise cached data is used for --cachedays without checking" )
+    parser.add_argument('--cachebackend', default=server.CACHE_BACKEND, choices=['file','sqlite'], help=f"Where cached responses are stored: file (one file per response) or sqlite (a single database limited by --cachemaxsize) - default {server.CACHE_BACKEND}" )
+    parser.add_argument('--cachecompression', default=server.CACHE_COMPRESSION, choices=httpcache.COMPRESSION_CODECS, help="Compress cached responses using zlib or zstd (zstd needs the zstandard package) - already-cached responses are still readable whatever this setting - default no compression" )
+    parser.add_argument('--cachemaxsize', default=server.CACHE_MAX_SIZE//(1024*1024), type=int, help=f"With --cachebackend sqlite, the maximum size of the cache in MB - the least-recently used responses are removed when it's exceeded - default {server.CACHE_MAX_SIZE//(1024*1024)}" )
 
     # saved credentials
     parser.add_argument('-0', '--savecreds', default=None, help="Save obfuscated credentials file for use with readcreds, then exit - this stores jazzurl, jts, appstring, username and password")
@@ -137,6 +150,9 @@ def do_oslc_query(inputargs=None):
         credspassword = "N0tSecretAtAll"
 
     if args.readcreds:
+        # only imported when needed because it's slow to import
+        import cryptography.exceptions
+        import cryptography.fernet
 #        if args.secret is None:
 #            raise Exception( "You MUST specify a secret using -3 or --secret if using -0/--readcreads" )
         try:
@@ -169,8 +185,8 @@ def do_oslc_query(inputargs=None):
             serverport=80
         else:
             raise Exception( "Unknown scheme in jazzurl {args.jazzurl}" )
-    # now try to connect
-    if not server.tcp_can_connect_to_url(serverhost, serverport, timeout=2.0):
+    # now try to connect - unless the server is reached through a proxy from the environment, when a direct connection may not be possible
+    if not server.environment_proxies(args.jazzurl) and not server.tcp_can_connect_to_url(serverhost, serverport, timeout=2.0):
         raise Exception( f"Server not contactable {args.jazzurl}" )
 
     # setup logging
@@ -181,6 +197,7 @@ def do_oslc_query(inputargs=None):
         if -1 in levels:
             raise Exception( f'Logging level {args.loglevel} not valid - should be comma-separated one or two values from DEBUG, INFO, WARNING, ERROR, CRITICAL, OFF' )
         utils.setup_logging(consolelevel=levels[0],filelevel=levels[1])
+    httpops.set_wire_tracing(sample=args.tracesample, slow=args.traceslow)
 
     logger = logging.getLogger(__name__)
 
@@ -216,7 +233,12 @@ def do_oslc_query(inputargs=None):
     cachefolder = ".web_cache"
 
     # create our "server"
-    theserver = server.JazzTeamServer(args.jazzurl, args.username, args.password, verifysslcerts=args.certs, jtsappstring=f"jts:{approots['jts']}", cachingcontrol=args.cachecontrol, cachefolder=cachefolder )
+    theserver = server.JazzTeamServer(args.jazzurl, args.username, args.password, verifysslcerts=args.certs, jtsappstring=f"jts:{approots['jts']}", cachingcontrol=args.cachecontrol, cachefolder=cachefolder, cachebackend=args.cachebackend, cachemaxsize=args.cachemaxsize*1024*1024, cachecompression=args.cachecompression, revalidate=args.revalidate, ratelimit=args.ratelimit, burst=args.burst )
+    if args.metrics:
+        # save the metrics however the query finishes
+        atexit.register( theserver.get_metrics().save, args.metrics )
+    # log how effective the in-memory cache of parsed responses was
+    atexit.register( lambda: logger.info( f"Parsed XML cache {theserver.get_xml_cache_stats()} response cache {theserver.get_cache_stats()}" ) )
 
     # create all our apps (there will be a main app, the main reason for allowing more than one is when gc is needed)
     for appdom,approot in approots.items():
@@ -440,6 +462,8 @@ def do_oslc_query(inputargs=None):
                     ,maxresults=args.maxresults
                     ,delaybetweenpages=args.delaybetweenpages
                     ,pagesize=args.pagesize
+                    ,pageworkers=args.pagejobs
+                    ,adaptivepaging=args.adaptive
                     )
 
     if args.debugprint:
@@ -594,23 +618,14 @@ def do_oslc_query(inputargs=None):
             os.makedirs( outputpath, exist_ok=True)
     
         # basically for RM: retrieve all the result resources (as RDF-XML) and store to one file per resource
+        # the resources are retrieved concurrently
         unknownid = 1
-        retrieved = {}
-        for k in results.keys():
-            if k in retrieved:
-                logger.info( f"Already retrieved {k}" )
-                continue
-            logger.info( f"Retrieving XML for {k}" )
-            retrieved[k]=True
-            # get the resource from uri k
-            params = {}
-            try:
-                xml1 = queryon.execute_get_rdf_xml(k, params=params)
-            except AttributeError:
-                try:
-                    xml1 = queryon.execute_get_rdf_xml(k, params=params)
-                except:
-                    raise
+        params = {}
+        shapefiles = []
+        for k, xml1 in queryon.execute_get_rdf_xml_many(list(dict.fromkeys(results.keys())), params=params, max_workers=args.xmljobs, ordered=True, adaptive=args.adaptive):
+            logger.info( f"Retrieved XML for {k}" )
+            if isinstance(xml1, Exception):
+                raise xml1
             # save to filename based on identifier
             if app.identifier_name in results[k] or app.identifier_uri in results[k]:
                 fname = args.xmloutputfile + "_" + str((results[k].get(app.identifier_name) or results[k].get(app.identifier_uri)))
@@ -628,17 +643,17 @@ def do_oslc_query(inputargs=None):
             open(fname + ".xml", "wb").write(ET.tostring(xml1.getroot()))
             isuri = rdfxml.xml_find_element(xml1, ".//oslc:instanceShape")
             if isuri is not None:
-                logger.info( f"Retrieving instanceshape {isuri}" )
                 isuri = isuri.get("{%s}resource" % rdfxml.RDF_DEFAULT_PREFIX['rdf'])
-                # now download it
-                try:
-                    xml2 = queryon.execute_get_rdf_xml(isuri, params=params)
-                except AttributeError:
-                    try:
-                        xml2 = queryon.execute_get_rdf_xml(isuri, params=params)
-                    except:
-                        raise
-                open(fname + "_shape.xml", "wb").write(ET.tostring(xml2.getroot()))
+                shapefiles.append( (fname, isuri) )
+        # now download the instanceshapes - many resources share the same shape so each is only retrieved once
+        shapes = {}
+        for isuri, xml2 in queryon.execute_get_rdf_xml_many(list(dict.fromkeys([isuri for fname, isuri in shapefiles])), params=params, max_workers=args.xmljobs, adaptive=args.adaptive):
+            logger.info( f"Retrieved instanceshape {isuri}" )
+            if isinstance(xml2, Exception):
+                raise xml2
+            shapes[isuri] = xml2
+        for fname, isuri in shapefiles:
+            open(fname + "_shape.xml", "wb").write(ET.tostring(shapes[isuri].getroot()))
     return 0
 
 def main():
@@ -20,16 +20,19 @@
 import os
 import argparse
 import collections
+import concurrent.futures
 import datetime
+import glob
 import logging
 import re
 import socket
 import time
+import webbrowser
 
 import lxml.etree as ET
 import requests
-import requests_toolbelt
 
+import elmclient.httpops as httpops
 import elmclient.rdfxml as rdfxml
 import elmclient.server as server
 import elmclient._app as _app
@@ -61,7 +64,7 @@ def reqif_main():
     # general settings
     parser.add_argument('-A', '--appstrings', default=APPSTRINGS,help=f'Defaults to "rm,jts" - Must be comma-separated list of used domains or domain:contextroot, the FIRST one must be rm. If using nonstandard context roots for just rm like /rrc then specify "rm:rrc,jts" NOTE if jts is not on /jts then e.g. for /myjts use e.g. "rm:rn1,jts:myjts". Default can be set using environment variable QUERY_APPSTRINGS')
     parser.add_argument('-C', '--component', help='The local component (optional, if used you *have* to specify the local configuration using -F)')
-    parser.add_argument('-D', '--delaybetween', type=float,default=0.0, help="Delay in seconds between each import/export - use this to reduce overall server load")
+    parser.add_argument('-D', '--delaybetween', type=float,default=0.0, help="Delay in seconds between each import/export (with import -j, between starting each import) - use this and/or --ratelimit to reduce overall server load")
     parser.add_argument('-F', '--configuration', default=None, help='Scope: Name of local config - you need to provide the project - defaults to the "Initial Stream" or "Initial Development" +same name as the project')
     parser.add_argument("-J", "--jazzurl", default=JAZZURL, help="jazz server url (without the /jts!) default {JAZZURL} Default can be set using environment variable QUERY_JAZZURL - defaults to https://jazz.ibm.com:9443 which DOESN'T EXIST")
     parser.add_argument('-L', '--loglevel', default=LOGLEVEL,help=f'Set logging on console and (if providing a , and a second level) to file to one of DEBUG, INFO, WARNING, ERROR, CRITICAL, OFF - default is {LOGLEVEL} - can be set by environment variable QUERY_LOGLEVEL')
@@ -69,6 +72,8 @@ def reqif_main():
     parser.add_argument('-T', '--certs', action="store_true", help="Verify SSL certificates")
     parser.add_argument("-U", "--username", default=USER, help="User id - can be set using environment variable QUERY_USER")
     parser.add_argument('-W', '--cachecontrol', action='count', default=0, help="Used once -W erases cache then continues with caching enabled. Used twice -WW wipes cache and disables caching. Otherwise caching is continued from previous run(s).")
+    parser.add_argument('--ratelimit', default=None, type=float, help="Maximum requests per second to the server - default no limit")
+    parser.add_argument('--burst', default=None, type=int, help="With --ratelimit, the number of requests which can be sent at once after being idle - default same as --ratelimit")
     parser.add_argument('-Z', '--proxyport', default=8888, type=int, help='Port for proxy default is 8888 - used if found to be active - set to 0 to disable')
 
     # saved credentials
@@ -96,6 +101,7 @@ def reqif_main():
     parser_import.add_argument( 'ifiles',nargs="*", default=[], help='one or more reqif files or file patterns (e.g. *.reqifz) to import')
     parser_import.add_argument('-I', '--inputdirectory',default='',help='Input directory for all imported files')
     parser_import.add_argument('-O', '--outputdirectory',default=None,help='Output directory for all exported files')
+    parser_import.add_argument('-j', '--jobs', type=int, default=1, help='Number of files to import concurrently (default 1)')
 
     parser_create.add_argument('definitionname',help='The reqif definition name to create')
     parser_create.add_argument('-a', '--allcores', action="store_true", help="Add all core artifacts (not modules/collections) from the project/component")
@@ -191,7 +197,7 @@ def reqif_main():
         approots['jts']='jts'
 
     # create our "server"
-    theserver = server.JazzTeamServer(args.jazzurl, args.username, args.password, verifysslcerts=args.certs,appstring=f"jts:{approots['jts']}",cachingcontrol=args.cachecontrol)
+    theserver = server.JazzTeamServer(args.jazzurl, args.username, args.password, verifysslcerts=args.certs,appstring=f"jts:{approots['jts']}",cachingcontrol=args.cachecontrol, ratelimit=args.ratelimit, burst=args.burst)
 
     # create all our apps
     for appdom,approot in approots.items():
@@ -361,22 +367,25 @@ def reqif_main():
                         logger.debug( f"{pkg_x=}" )
                         # get the content and its filename
                         content_u =  rdfxml.xmlrdf_get_resource_uri( pkg_x, ".//dng_reqif:content" )
-                        response = queryon.execute_get_binary( content_un )
-                        fname = response.headers.get('Content-Disposition').split( '"', 2 )[1]
-                        if fname is None:
-                            raise Exception( "No content-disposition!" )
-                        if args.timestamp:
-                            fname = os.path.splitext(fname)[0]+f".{datetimestamp}.reqifz"
-                        if args.outputdirectory:
-                            fname = os.path.join( os.getcwd(), args.outputdirectory, fname )
+                        # the filename to save to comes from the response
+                        def reqif_filename( response ):
+                            if response.headers.get('Content-Disposition') is None:
+                                raise Exception( "No content-disposition!" )
+                            fname = response.headers.get('Content-Disposition').split( '"', 2 )[1]
+                            if args.timestamp:
+                                fname = os.path.splitext(fname)[0]+f".{datetimestamp}.reqifz"
+                            if args.outputdirectory:
+                                fname = os.path.join( os.getcwd(), args.outputdirectory, fname )
+                            return fname
+                        # stream the (possibly very large) reqifz straight to the file
+                        response = queryon.execute_download( content_u, reqif_filename, progress=True )
+                        fname = reqif_filename( response )
                         print( f"Reqif saved to {fname}" )
-                        open( fname, "wb" ).write( response.content )
 
                         report_u = rdfxml.xmlrdf_get_resource_uri( pkg_x, ".//dng_reqif:report" )
-                        response =  queryon.execute_get_binary( report_u )
                         htmlfile = fname+".html"
+                        queryon.execute_download( report_u, htmlfile )
                         print( f"Report saved to {htmlfile}" )
-                        open( htmlfile, "wb" ).write( response.content )
 
                         # display the report
                         url = f'file://{os.path.abspath(htmlfile)}'
@@ -406,19 +415,21 @@ def reqif_main():
                 ifiles = [ifile]
             filenames.extend( ifiles )
 
-        for ifile in filenames:
+        # when importing several files concurrently the per-file progress bars would be interleaved so aren't shown
+        showprogress = args.jobs <= 1
+        httpops.set_upload_concurrency(args.jobs)
+
+        def import_one( ifile ):
             print( f"Creating upload package for {ifile}" )
-            # construct multi-part body containing the file content
+            # construct multi-part body containing the file content - the file is streamed from disk during the upload
             multipart_form_data = collections.OrderedDict(
-                    [('upload', (os.path.basename(ifile), open(os.path.normpath(ifile), 'rb'),'application/octet-stream'))
+                    [('upload', (os.path.basename(ifile), os.path.normpath(ifile),'application/octet-stream'))
                     ,('userMimeType','application/zip')]
                 )
-            multipartencoder = requests_toolbelt.MultipartEncoder(multipart_form_data,boundary='---------------------------1336032510420201357832076537')
-            content_type, body = multipartencoder.content_type, multipartencoder.to_string()
 
             # execute post content
-            logger.info('Uploading package {ifile}...')
-            response = queryon.execute_post_content(pkg_factory_u, data=body, headers={'Content-Type': content_type, 'userMimeType': 'application/zip', 'DNT': '1', 'filename':os.path.basename(ifile),'Accept': '*/*','X-Requested-With': None,'Origin': 'https://jazz.ibm.com:9443'})
+            logger.info( f'Uploading package {ifile}...' )
+            response = queryon.execute_post_multipart(pkg_factory_u, multipart_form_data, boundary='---------------------------1336032510420201357832076537', progress=showprogress, headers={'userMimeType': 'application/zip', 'DNT': '1', 'filename':os.path.basename(ifile),'Accept': '*/*','X-Requested-With': None,'Origin': 'https://jazz.ibm.com:9443'})
 
             print( f"Triggering import for {os.path.basename(ifile)}" )
 
@@ -427,7 +438,7 @@ def reqif_main():
                 pass
             elif response.status_code == 202 and location is not None:
                 # wait for the tracker to finished
-                result = queryon.wait_for_tracker( location, interval=1.0, progressbar=True, msg=f"Exporting {match[reqif_def]['dcterms:title']}")
+                result = queryon.wait_for_tracker( location, interval=1.0, progressbar=showprogress, msg=f"Uploading {os.path.basename(ifile)}")
                 time.sleep( 1.0 )
                 if result is None:
                     raise Exception( f"No result from tracker!" )
@@ -448,25 +459,46 @@ xmlns:dng_reqif="http://jazz.net/ns/rm/dng/reqif#">
             location = response.headers.get('Location')
             if response.status_code == 202 and location is not None:
                 # wait for the tracker to finished
-                result = queryon.wait_for_tracker( location, interval=1.0, progressbar=True, msg=f"Importing {os.path.basename(ifile)}")
+                result = queryon.wait_for_tracker( location, interval=1.0, progressbar=showprogress, msg=f"Importing {os.path.basename(ifile)}")
                 time.sleep( 1.0 )
                 if result is not None:
                     # get the result
                     report_u = rdfxml.xmlrdf_get_resource_uri( result, ".//dcterms:references" )
                     logger.debug( f"{report_u=}" )
-                    response =  queryon.execute_get_binary( report_u )
                     htmlfile = ifile+".html"
+                    queryon.execute_download( report_u, htmlfile )
                     print( f"Report saved to {htmlfile}" )
-                    open( htmlfile, "wb" ).write( response.content )
 
                     # display the report
                     url = f'file://{os.path.abspath(htmlfile)}'
                     webbrowser.open(url, new=2)  # open in new tab
             else:
                 raise Exception( "Odd response to export command, no 202" )
-            if args.delaybetween>0:
-                print( "Delaying between imports" )
-                time.sleep(args.delaybetween)
+
+        if args.jobs <= 1:
+            for i,ifile in enumerate(filenames):
+                if i>0 and args.delaybetween>0:
+                    print( "Delaying between imports" )
+                    time.sleep(args.delaybetween)
+                import_one( ifile )
+        else:
+            # import several files at once - a failure of one import doesn't stop the others
+            # the delay is between starting each import (a delay in the workers would only hold up the pool threads)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+                futures = {}
+                for i,ifile in enumerate(filenames):
+                    if i>0 and args.delaybetween>0:
+                        time.sleep(args.delaybetween)
+                    futures[executor.submit( import_one, ifile )] = ifile
+                failures = []
+                for future in concurrent.futures.as_completed( futures ):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print( f"Import of {futures[future]} failed {e}" )
+                        failures.append( futures[future] )
+                if failures:
+                    raise Exception( f"{len(failures)} import(s) failed: {failures}" )
 
     elif args.subparser_name=='create':
         #################################################################################
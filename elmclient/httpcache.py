@@ -0,0 +1,536 @@
+##
+## © Copyright 2021- IBM Inc. All rights reserved
+# SPDX-License-Identifier: MIT
+##
+
+# caches for HTTP responses
+# SQLiteCache is an alternative backend for the CacheControl HTTP response cache: all responses are stored in a single SQLite file
+# with a maximum total size - when it's exceeded the least-recently used entries are evicted
+# the database uses WAL mode and a busy timeout so several processes (e.g. parallel batchquery runs) can use it at once
+# ParsedXMLCache is an in-memory cache of parsed XML responses in front of the CacheControl cache
+# NamespacedFileCache is the CacheControl FileCache with the entries for a url kept together so they can be invalidated
+# both SQLiteCache and CompressedFileCache can compress the stored responses
+
+import atexit
+import bisect
+import collections
+import copy
+import heapq
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import urllib.parse
+import zlib
+
+import cachecontrol.cache
+import cachecontrol.caches.file_cache
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+SQLITE_CACHE_FILE = "webcache.sqlite"
+
+# default maximum size of the cache in bytes
+CACHE_MAX_SIZE = 2*1024*1024*1024
+
+# when the cache is over its maximum size, entries are evicted until it's below this fraction of the maximum
+EVICT_TO = 0.9
+
+# to avoid a write for every read, the hit counts and last access times of entries are kept in memory and written
+# to the database when this many have accumulated (and before evicting, when getting stats and on exit)
+HIT_FLUSH_COUNT = 100
+
+# the age bands (in days) used by SQLiteCache.inspect()
+AGE_BANDS = [1/24, 1, 7, 30, 90]
+
+# how SQLiteCache.inspect() can group entries - pattern is the url path with ids replaced by {id}
+INSPECT_GROUPS = ['app', 'pattern', 'server', 'user', 'config']
+
+# compression of cached responses: None, 'zlib' or 'zstd' (needs the zstandard package)
+# each compressed entry starts with a marker giving the codec so entries written with a different (or no) compression
+# setting can still be read - an uncompressed entry from CacheControl never starts with a zero byte
+COMPRESSION_CODECS = ['zlib', 'zstd']
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+_CODEC_MARKER = b"\0elmc:"
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception( "zstd cache compression needs the zstandard package - install it using pip install zstandard" )
+    return zstandard
+
+def check_compression(codec):
+    if codec is not None and codec not in COMPRESSION_CODECS:
+        raise Exception( f"Cache compression must be one of {COMPRESSION_CODECS} not '{codec}'" )
+    if codec == 'zstd':
+        _zstandard()
+
+def compress_entry(value, codec):
+    if codec is None:
+        return value
+    if codec == 'zlib':
+        return _CODEC_MARKER + b"zlib:" + zlib.compress(value, ZLIB_LEVEL)
+    if codec == 'zstd':
+        return _CODEC_MARKER + b"zstd:" + _zstandard().ZstdCompressor(level=ZSTD_LEVEL).compress(value)
+    raise Exception( f"Unknown cache compression {codec}" )
+
+def decompress_entry(value):
+    if value is None or not value.startswith(_CODEC_MARKER):
+        return value
+    codec, data = value[len(_CODEC_MARKER):].split(b":", 1)
+    if codec == b'zlib':
+        return zlib.decompress(data)
+    if codec == b'zstd':
+        return _zstandard().ZstdDecompressor().decompress(data)
+    raise Exception( f"Unknown cache compression {codec} in cache entry" )
+
+# cache keys are namespaced by user and configuration context: user, config and url separated by tabs (which can't be in a url)
+def make_cache_key(url, user=None, config=None):
+    return f"{user or ''}\t{config or ''}\t{url}"
+
+# return (user, config, url) from a cache key
+def split_cache_key(key):
+    parts = key.split("\t", 2)
+    if len(parts) != 3:
+        return ("", "", key)
+    return tuple(parts)
+
+# the configuration context of a request - from the Configuration-Context/vvc.configuration header or the oslc_config.context/vvc.configuration parameter
+def config_of(url, headers=None):
+    if headers is not None:
+        config = headers.get('Configuration-Context') or headers.get('vvc.configuration')
+        if config:
+            return config
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+    for param in ('oslc_config.context', 'vvc.configuration'):
+        if query.get(param):
+            return query[param][0]
+    return None
+
+# the namespace columns for a cache key: server is scheme://host:port and app is the context root, e.g. rm
+def _namespace_of(key):
+    user, config, url = split_cache_key(key)
+    parsed = urllib.parse.urlparse(url)
+    server = f"{parsed.scheme}://{parsed.netloc}" if parsed.netloc else ""
+    app = parsed.path.lstrip("/").split("/")[0]
+    return (server, user, config, app, url)
+
+class SQLiteCache(cachecontrol.cache.BaseCache):
+    def __init__(self, filename, maxsize=CACHE_MAX_SIZE, timeout=30, compression=None):
+        check_compression(compression)
+        self.filename = filename
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.compression = compression
+        # sqlite connections can't be shared between threads, so each thread gets its own
+        self._local = threading.local()
+        # key: [hits, last_access] not yet written
+        self._pending = {}
+        self._pendinglock = threading.Lock()
+        dirname = os.path.dirname(filename)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        conn = self._conn()
+        with conn:
+            # server, user, config, app and url come from the key so entries can be invalidated selectively
+            columns = [ row[1] for row in conn.execute( "PRAGMA table_info(cache)" ) ]
+            if columns and 'url' not in columns:
+                # created before entries were namespaced - those keys are no longer used
+                logger.info( "Replacing cache created by an older version" )
+                conn.execute( "DROP TABLE cache" )
+                conn.execute( "DROP TABLE IF EXISTS meta" )
+            if columns and 'url' in columns and 'rawsize' not in columns:
+                # created before entries could be compressed - all uncompressed
+                conn.execute( "ALTER TABLE cache ADD COLUMN rawsize INTEGER NOT NULL DEFAULT 0" )
+                conn.execute( "UPDATE cache SET rawsize=size" )
+            if columns and 'url' in columns and 'hits' not in columns:
+                conn.execute( "ALTER TABLE cache ADD COLUMN hits INTEGER NOT NULL DEFAULT 0" )
+            # size is the stored (possibly compressed) size and rawsize the size of the response
+            # hits is the number of times the entry has been read since it was stored
+            conn.execute( "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, created REAL NOT NULL, last_access REAL NOT NULL"
+                            ", server TEXT NOT NULL, user TEXT NOT NULL, config TEXT NOT NULL, app TEXT NOT NULL, url TEXT NOT NULL, rawsize INTEGER NOT NULL DEFAULT 0, hits INTEGER NOT NULL DEFAULT 0)" )
+            conn.execute( "CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)" )
+            conn.execute( "CREATE INDEX IF NOT EXISTS cache_config ON cache (config)" )
+            conn.execute( "CREATE INDEX IF NOT EXISTS cache_url ON cache (url)" )
+            # the total size is kept here so it doesn't have to be summed for every set
+            conn.execute( "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)" )
+            conn.execute( "INSERT OR IGNORE INTO meta (name, value) VALUES ('totalsize', 0)" )
+        atexit.register(self.flush)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level None means transactions are controlled explicitly with BEGIN
+            conn = sqlite3.connect(self.filename, timeout=self.timeout, isolation_level=None)
+            conn.execute( "PRAGMA journal_mode=WAL" )
+            conn.execute( f"PRAGMA busy_timeout={int(self.timeout*1000)}" )
+            conn.execute( "PRAGMA synchronous=NORMAL" )
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._conn()
+        row = conn.execute( "SELECT value FROM cache WHERE key=?", (key,) ).fetchone()
+        if row is None:
+            return None
+        with self._pendinglock:
+            pending = self._pending.setdefault(key, [0, 0.0])
+            pending[0] += 1
+            pending[1] = time.time()
+            npending = len(self._pending)
+        if npending >= HIT_FLUSH_COUNT:
+            self.flush()
+        return decompress_entry(row[0])
+
+    # write the pending hit counts and access times to the database
+    def flush(self):
+        with self._pendinglock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            conn = self._conn()
+            with conn:
+                conn.executemany( "UPDATE cache SET hits=hits+?, last_access=max(last_access,?) WHERE key=?", [ (hits, last_access, key) for key, (hits, last_access) in pending.items() ] )
+        except sqlite3.Error as e:
+            # not important enough to fail a request
+            logger.info( f"Failed to update cache hits {e}" )
+
+    def set(self, key, value):
+        conn = self._conn()
+        now = time.time()
+        rawsize = len(value)
+        value = compress_entry(value, self.compression)
+        size = len(value)
+        if self.maxsize is not None and self._pending:
+            # so the least-recently used entries are correct if any have to be evicted
+            self.flush()
+        conn.execute( "BEGIN IMMEDIATE" )
+        try:
+            row = conn.execute( "SELECT size FROM cache WHERE key=?", (key,) ).fetchone()
+            oldsize = row[0] if row is not None else 0
+            conn.execute( "INSERT INTO cache (key, value, size, created, last_access, server, user, config, app, url, rawsize) VALUES (?,?,?,?,?,?,?,?,?,?,?)"
+                            " ON CONFLICT(key) DO UPDATE SET value=excluded.value, size=excluded.size, created=excluded.created, last_access=excluded.last_access, rawsize=excluded.rawsize, hits=0"
+                            , (key, value, size, now, now, *_namespace_of(key), rawsize) )
+            conn.execute( "UPDATE meta SET value=value+? WHERE name='totalsize'", (size-oldsize,) )
+            totalsize = conn.execute( "SELECT value FROM meta WHERE name='totalsize'" ).fetchone()[0]
+            if self.maxsize is not None and totalsize > self.maxsize:
+                self._evict(conn, totalsize)
+            conn.execute( "COMMIT" )
+        except:
+            conn.execute( "ROLLBACK" )
+            raise
+
+    # remove least-recently used entries until the total size is below target (default EVICT_TO * maxsize) - must be called in a transaction
+    def _evict(self, conn, totalsize, target=None):
+        target = self.maxsize * EVICT_TO if target is None else target
+        nevicted = 0
+        while totalsize > target:
+            rows = conn.execute( "SELECT key, size FROM cache ORDER BY last_access LIMIT 100" ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                conn.execute( "DELETE FROM cache WHERE key=?", (key,) )
+                totalsize -= size
+                nevicted += 1
+                if totalsize <= target:
+                    break
+        conn.execute( "UPDATE meta SET value=? WHERE name='totalsize'", (max(0, totalsize),) )
+        logger.info( f"Evicted {nevicted} cache entries" )
+
+    def delete(self, key):
+        conn = self._conn()
+        conn.execute( "BEGIN IMMEDIATE" )
+        try:
+            row = conn.execute( "SELECT size FROM cache WHERE key=?", (key,) ).fetchone()
+            if row is not None:
+                conn.execute( "DELETE FROM cache WHERE key=?", (key,) )
+                conn.execute( "UPDATE meta SET value=value-? WHERE name='totalsize'", (row[0],) )
+            conn.execute( "COMMIT" )
+        except:
+            conn.execute( "ROLLBACK" )
+            raise
+
+    # remove all entries - a single transaction so other processes see either the old or the empty cache
+    def clear(self):
+        conn = self._conn()
+        conn.execute( "BEGIN IMMEDIATE" )
+        try:
+            conn.execute( "DELETE FROM cache" )
+            conn.execute( "UPDATE meta SET value=0 WHERE name='totalsize'" )
+            conn.execute( "COMMIT" )
+        except:
+            conn.execute( "ROLLBACK" )
+            raise
+        logger.info( "Cache cleared" )
+
+    # remove the entries matching all the criteria given, returning the number removed - with no criteria everything is removed
+    # url is an exact url, urlprefix matches the start of the url and urlpattern is a glob pattern e.g. */types/*
+    # server is e.g. https://jazz.ibm.com:9443, app is the context root e.g. rm and config is the configuration URI
+    def invalidate(self, *, server=None, user=None, config=None, app=None, url=None, urlprefix=None, urlpattern=None):
+        conditions = []
+        values = []
+        for column, value in (('server', server), ('user', user), ('config', config), ('app', app), ('url', url)):
+            if value is not None:
+                conditions.append( f"{column}=?" )
+                values.append(value)
+        if urlprefix is not None:
+            conditions.append( "substr(url,1,?)=?" )
+            values.extend( [len(urlprefix), urlprefix] )
+        if urlpattern is not None:
+            conditions.append( "url GLOB ?" )
+            values.append(urlpattern)
+        if not conditions:
+            count = self._conn().execute( "SELECT COUNT(*) FROM cache" ).fetchone()[0]
+            self.clear()
+            return count
+        where = " AND ".join(conditions)
+        conn = self._conn()
+        conn.execute( "BEGIN IMMEDIATE" )
+        try:
+            count, size = conn.execute( f"SELECT COUNT(*), COALESCE(SUM(size),0) FROM cache WHERE {where}", values ).fetchone()
+            conn.execute( f"DELETE FROM cache WHERE {where}", values )
+            conn.execute( "UPDATE meta SET value=value-? WHERE name='totalsize'", (size,) )
+            conn.execute( "COMMIT" )
+        except:
+            conn.execute( "ROLLBACK" )
+            raise
+        logger.info( f"Invalidated {count} cache entries where {where} {values}" )
+        return count
+
+    def get_size(self):
+        return self._conn().execute( "SELECT value FROM meta WHERE name='totalsize'" ).fetchone()[0]
+
+    # size is the stored size and rawsize the size before compression, so ratio is how many times smaller the cache is
+    def get_stats(self):
+        conn = self._conn()
+        entries, rawsize = conn.execute( "SELECT COUNT(*), COALESCE(SUM(rawsize),0) FROM cache" ).fetchone()
+        size = self.get_size()
+        return {'backend': 'sqlite', 'filename': self.filename, 'compression': self.compression, 'entries': entries, 'size': size, 'rawsize': rawsize
+                    , 'ratio': rawsize/size if size else 1.0, 'maxsize': self.maxsize}
+
+    # return details of the cache contents: totals, entries by age (since stored), entries older than staleafter seconds,
+    # totals for each group (see INSPECT_GROUPS) and the top largest entries
+    # hits are reads of an entry since it was stored, unused entries have never been read, and the hit ratio is hits/(hits+entries)
+    # i.e. assuming one miss stored each entry
+    def inspect(self, *, groupby='app', top=10, staleafter=None):
+        if groupby not in INSPECT_GROUPS:
+            raise Exception( f"groupby must be one of {INSPECT_GROUPS} not '{groupby}'" )
+        self.flush()
+        now = time.time()
+        bandlimits = [ days*86400 for days in AGE_BANDS ]
+        ages = [0]*(len(AGE_BANDS)+1)
+        def newtotals():
+            return {'entries': 0, 'size': 0, 'rawsize': 0, 'hits': 0, 'unused': 0}
+        totals = newtotals()
+        groups = {}
+        stale = {'after_seconds': staleafter, 'entries': 0, 'size': 0}
+        largest = []
+        rows = self._conn().execute( "SELECT server, user, config, app, url, size, rawsize, hits, created FROM cache" )
+        for server, user, config, app, url, size, rawsize, hits, created in rows:
+            age = now - created
+            ages[bisect.bisect_left(bandlimits, age)] += 1
+            if staleafter is not None and age > staleafter:
+                stale['entries'] += 1
+                stale['size'] += size
+            name = {'app': app, 'pattern': metrics.endpoint_path(url), 'server': server, 'user': user, 'config': config}[groupby]
+            for t in (totals, groups.setdefault(name, newtotals())):
+                t['entries'] += 1
+                t['size'] += size
+                t['rawsize'] += rawsize
+                t['hits'] += hits
+                if hits == 0:
+                    t['unused'] += 1
+            entry = (size, url, hits, age)
+            if len(largest) < top:
+                heapq.heappush(largest, entry)
+            elif top > 0:
+                heapq.heappushpop(largest, entry)
+        for t in [totals]+list(groups.values()):
+            t['hit_ratio'] = t['hits']/(t['hits']+t['entries']) if t['entries'] else 0.0
+        agelabels = [ f"<{_days_text(days)}" for days in AGE_BANDS ] + [ f">={_days_text(AGE_BANDS[-1])}" ]
+        return {
+            'totals': totals
+            ,'ages': dict(zip(agelabels, ages))
+            ,'stale': stale
+            ,'groupby': groupby
+            ,'groups': dict(sorted(groups.items(), key=lambda item: -item[1]['size']))
+            ,'largest': [ {'url': url, 'size': size, 'hits': hits, 'age_seconds': age} for size, url, hits, age in sorted(largest, reverse=True) ]
+        }
+
+    # remove entries stored more than maxage seconds ago (only those never read if unused is True), then if the cache is
+    # bigger than maxsize bytes the least-recently used entries. Returns the number of entries removed
+    def prune(self, *, maxage=None, maxsize=None, unused=False):
+        self.flush()
+        conn = self._conn()
+        conn.execute( "BEGIN IMMEDIATE" )
+        try:
+            removed = 0
+            totalsize = conn.execute( "SELECT value FROM meta WHERE name='totalsize'" ).fetchone()[0]
+            if maxage is not None:
+                where = "created<?" + (" AND hits=0" if unused else "")
+                values = (time.time()-maxage,)
+                count, size = conn.execute( f"SELECT COUNT(*), COALESCE(SUM(size),0) FROM cache WHERE {where}", values ).fetchone()
+                conn.execute( f"DELETE FROM cache WHERE {where}", values )
+                totalsize -= size
+                removed += count
+                conn.execute( "UPDATE meta SET value=? WHERE name='totalsize'", (max(0, totalsize),) )
+            if maxsize is not None and totalsize > maxsize:
+                before = conn.execute( "SELECT COUNT(*) FROM cache" ).fetchone()[0]
+                self._evict(conn, totalsize, target=maxsize)
+                removed += before - conn.execute( "SELECT COUNT(*) FROM cache" ).fetchone()[0]
+            conn.execute( "COMMIT" )
+        except:
+            conn.execute( "ROLLBACK" )
+            raise
+        logger.info( f"Pruned {removed} cache entries" )
+        return removed
+
+    def close(self):
+        self.flush()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+def _days_text(days):
+    return f"{round(days*24)}h" if days < 1 else f"{days:g}d"
+
+# the folder in a NamespacedFileCache which has the entries - FileCache's own layout is directly in the cache folder so
+# entries written before they were namespaced are never found (until the cache is wiped)
+FILE_CACHE_URLS_FOLDER = "urls"
+
+# CacheControl's FileCache with all the entries for a url (i.e. for every user and configuration) in one folder, so when
+# the url is PUT or DELETEd they can all be removed - otherwise the entries for other users would be stale until they expire
+class NamespacedFileCache(cachecontrol.caches.file_cache.FileCache):
+    def _url_folder(self, url):
+        hashed = self.encode(url)
+        return os.path.join(self.directory, FILE_CACHE_URLS_FOLDER, *hashed[:5], hashed)
+
+    def _fn(self, name):
+        user, config, url = split_cache_key(name)
+        return os.path.join(self._url_folder(url), self.encode(name))
+
+    # remove everything
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.is_dir():
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+
+    # the same as SQLiteCache.invalidate() but only an exact url (for all users and configs), or everything, is possible
+    # returns the number of entries removed, or None when removing everything
+    def invalidate(self, *, url=None, **criteria):
+        if any( v is not None for v in criteria.values() ):
+            raise Exception( "Selective cache invalidation other than by url needs the sqlite cache backend" )
+        if url is None:
+            self.clear()
+            return None
+        folder = self._url_folder(url)
+        if not os.path.isdir(folder):
+            return 0
+        count = len( [name for name in os.listdir(folder) if not name.endswith('.lock')] )
+        shutil.rmtree(folder, ignore_errors=True)
+        logger.info( f"Invalidated {count} cache entries for {url}" )
+        return count
+
+# NamespacedFileCache with compressed entries - the compression ratio is only known for the entries written by this process
+class CompressedFileCache(NamespacedFileCache):
+    def __init__(self, directory, *args, compression='zlib', **kwargs):
+        check_compression(compression)
+        super().__init__(directory, *args, **kwargs)
+        self.compression = compression
+        self._lock = threading.Lock()
+        self.written = 0
+        self.rawsize = 0
+        self.size = 0
+
+    def get(self, key):
+        return decompress_entry(super().get(key))
+
+    def set(self, key, value, *args, **kwargs):
+        stored = compress_entry(value, self.compression)
+        with self._lock:
+            self.written += 1
+            self.rawsize += len(value)
+            self.size += len(stored)
+        return super().set(key, stored, *args, **kwargs)
+
+    def get_stats(self):
+        with self._lock:
+            return {'backend': 'file', 'directory': self.directory, 'compression': self.compression, 'written': self.written, 'size': self.size, 'rawsize': self.rawsize
+                        , 'ratio': self.rawsize/self.size if self.size else 1.0}
+
+# default maximum total size (of the XML source) of the parsed responses kept in memory
+XML_CACHE_MAX_SIZE = 64*1024*1024
+
+# process-local cache of parsed XML responses, in front of the CacheControl cache, so repeated GETs of the same
+# rootservices, services, shapes etc. don't have to read the cache and parse the XML again
+# the key is (url, accept, configuration context) - see httpops.HttpRequest.get_cache_key()
+# hits return a copy so the caller can modify it. maxage (seconds) is used when revalidating so a parsed response
+# isn't used for longer than a cached one would be without being revalidated
+class ParsedXMLCache():
+    def __init__(self, maxsize=XML_CACHE_MAX_SIZE, maxage=None):
+        self.maxsize = maxsize
+        self.maxage = maxage
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.maxage is not None and time.monotonic() - entry[0] > self.maxage:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return copy.deepcopy(entry[1])
+
+    # size is the length of the XML the tree was parsed from
+    def set(self, key, tree, size):
+        if size > self.maxsize:
+            return
+        tree = copy.deepcopy(tree)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic(), tree, size)
+            self._size += size
+            while self._size > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._size -= entry[2]
+
+    # remove the entries for url (ignoring any query) or all entries if url is None
+    def invalidate(self, url=None):
+        with self._lock:
+            if url is None:
+                self._entries.clear()
+                self._size = 0
+                return
+            url = url.split("?")[0]
+            for key in [ k for k in self._entries.keys() if k[0].split("?")[0] == url ]:
+                self._remove(key)
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries), 'size': self._size, 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses
+                        , 'hit_ratio': self.hits/lookups if lookups else 0.0, 'evictions': self.evictions}
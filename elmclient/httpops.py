@@ -5,18 +5,71 @@
 
 
 import codecs
+import collections
+import concurrent.futures
+import email.utils
+import functools
 import http
 import inspect
+import itertools
+import json
 import logging
 import lxml.etree as ET
+import os
+import random
 import re
+import threading
 import time
 import urllib
 
 import requests
 
+from . import rdfxml
+from . import throttle
+from . import utils
+
+# these are only loaded when first used - asyncio for the aexecute_* coroutines, requests_toolbelt for multipart uploads
+asyncio = utils.lazy_import('asyncio')
+requests_toolbelt = utils.lazy_import('requests_toolbelt')
+tqdm = utils.lazy_import('tqdm')
+
 logger = logging.getLogger(__name__)
 
+# maximum number of blocking HTTP requests run concurrently on behalf of the aexecute_* coroutines - this is a ceiling on the
+# requests in flight however many coroutines are awaiting, change it using set_async_concurrency()
+# NOTE if this is more than the server's pool_maxsize then connections above that number aren't kept for reuse
+ASYNC_MAX_WORKERS = 32
+
+# default number of concurrent requests for the execute_*_many bulk methods
+BULK_MAX_WORKERS = 8
+
+# size of chunks read/written by execute_download, and how many times an interrupted download is resumed
+DOWNLOAD_CHUNK_SIZE = 1024*1024
+DOWNLOAD_RESUME_ATTEMPTS = 5
+
+# maximum number of streaming uploads (execute_post_multipart) in progress at once across all threads
+UPLOAD_MAX_CONCURRENT = 2
+
+_upload_semaphore = threading.BoundedSemaphore(UPLOAD_MAX_CONCURRENT)
+
+def set_upload_concurrency(maxconcurrent):
+    global UPLOAD_MAX_CONCURRENT, _upload_semaphore
+    UPLOAD_MAX_CONCURRENT = max(1, maxconcurrent)
+    _upload_semaphore = threading.BoundedSemaphore(UPLOAD_MAX_CONCURRENT)
+
+# WIRE tracing of requests/responses at TRACE level - nothing is formatted unless TRACE is enabled
+# WIRE_TRACE_SAMPLE: trace only 1 in this number of requests (1 traces all)
+# WIRE_TRACE_SLOW: if not None, trace only requests which take at least this many seconds
+WIRE_TRACE_SAMPLE = 1
+WIRE_TRACE_SLOW = None
+
+_wire_trace_counter = itertools.count()
+
+def set_wire_tracing(sample=1, slow=None):
+    global WIRE_TRACE_SAMPLE, WIRE_TRACE_SLOW
+    WIRE_TRACE_SAMPLE = max(1, sample)
+    WIRE_TRACE_SLOW = slow
+
 
 ##############################################################################################
 # utilities for text<>binary and encoding handling
@@ -88,6 +141,216 @@ def to_binary(text, encoding=None, errors='strict'):
     return result
 
 
+##############################################################################################
+# support for the asyncio aexecute_* methods
+# these are executor-backed, not non-blocking I/O: the requests are run on a shared thread pool of ASYNC_MAX_WORKERS threads
+# using the same (synchronous) session, so the cookies, login handling (Jazz form, JSA/OIDC, auth redirect) and retries are
+# exactly the same as for the execute_* methods - at most ASYNC_MAX_WORKERS requests are in flight at once
+
+_async_executor = None
+_async_executor_lock = threading.Lock()
+
+def _get_async_executor():
+    global _async_executor
+    with _async_executor_lock:
+        if _async_executor is None:
+            _async_executor = concurrent.futures.ThreadPoolExecutor(max_workers=ASYNC_MAX_WORKERS, thread_name_prefix="elmclient-http")
+    return _async_executor
+
+# set the maximum number of requests in flight for the aexecute_* methods, e.g. for hundreds at once use set_async_concurrency(200)
+# (and create the JazzTeamServer with a pool_maxsize to match) - requests already running finish on the previous pool
+def set_async_concurrency(maxworkers):
+    global ASYNC_MAX_WORKERS, _async_executor
+    with _async_executor_lock:
+        ASYNC_MAX_WORKERS = max(1, maxworkers)
+        previous, _async_executor = _async_executor, None
+    if previous is not None:
+        previous.shutdown(wait=False)
+
+# run a blocking function on the shared thread pool and await its result
+async def _run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_async_executor(), functools.partial(func, *args, **kwargs))
+
+
+##############################################################################################
+# support for execute_download - writes the chunks to the target, handles restarts and checks the length
+
+# a partial download is only resumed using If-Range with the validator (a strong ETag, or Last-Modified) of the response which
+# started it, so if the resource has changed the server sends all of it again. For a file the validator is saved in
+# filename.part.validator so the download can be resumed by a later run; a .part file without one isn't resumed
+def _get_validator(response):
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+class _Download():
+    def __init__(self, target, *, progress=False, resume=True):
+        self.target = target
+        self.filename = None
+        self.sink = None
+        self.done = 0
+        self.total = None
+        self.validator = None
+        self.pbar = None
+        self.progress = progress
+        if isinstance(target, (str, bytes, os.PathLike)):
+            self._set_filename(target, resume)
+
+    def _set_filename(self, filename, resume):
+        self.filename = os.fspath(filename)
+        self.partfilename = self.filename+".part"
+        self.validatorfilename = self.partfilename+".validator"
+        if resume and os.path.isfile(self.partfilename) and os.path.isfile(self.validatorfilename):
+            with open(self.validatorfilename, "r") as f:
+                self.validator = f.read().strip() or None
+        if self.validator is not None:
+            self.done = os.path.getsize(self.partfilename)
+            logger.info( f"Resuming download to {self.filename} from {self.done} bytes if unchanged since {self.validator}" )
+            self.sink = open(self.partfilename, "ab")
+        else:
+            self.sink = open(self.partfilename, "wb")
+
+    # the headers to add to the request to resume the download, or {} to get the whole resource
+    def get_range_headers(self):
+        if self.done > 0 and self.validator is None:
+            logger.info( "Can't resume download because the response had no ETag or Last-Modified - restarting" )
+            self.restart()
+        if self.done == 0:
+            return {}
+        return {'Range': f"bytes={self.done}-", 'If-Range': self.validator}
+
+    # called with each response before its content is read
+    def start(self, response):
+        if self.sink is None:
+            # the target is either a file-like object or a function giving the target
+            target = self.target(response) if callable(self.target) else self.target
+            if isinstance(target, (str, bytes, os.PathLike)):
+                self._set_filename(target, resume=False)
+            else:
+                self.sink = target
+        if response.status_code == http.client.PARTIAL_CONTENT:
+            # check the range returned starts where it was requested, e.g. Content-Range: bytes 1000-1999/2000
+            m = re.match(r"bytes\s+(\d+)-(\d+)/(\d+|\*)", response.headers.get('Content-Range', ''))
+            if not m or int(m.group(1)) != self.done:
+                raise Exception( f"Unexpected Content-Range {response.headers.get('Content-Range')} when resuming from {self.done}" )
+            if response.headers.get('ETag') and self.validator.startswith('"') and response.headers['ETag'] != self.validator:
+                raise Exception( f"Server ignored If-Range - resource ETag {response.headers['ETag']} isn't {self.validator}" )
+            self.total = int(m.group(3)) if m.group(3) != '*' else None
+        else:
+            if self.done > 0:
+                # server has sent the whole resource (it has changed, or doesn't support Range) so start again
+                logger.info( "Resource changed or server doesn't support resuming download - restarting" )
+                self.restart()
+            self.total = int(response.headers['Content-Length']) if 'Content-Length' in response.headers else None
+            self.validator = _get_validator(response)
+            if self.filename is not None:
+                if self.validator is not None:
+                    with open(self.validatorfilename, "w") as f:
+                        f.write(self.validator)
+                elif os.path.isfile(self.validatorfilename):
+                    os.remove(self.validatorfilename)
+        if self.progress:
+            if callable(self.progress):
+                self.progress(self.done, self.total)
+            elif self.pbar is None:
+                self.pbar = tqdm.tqdm(initial=self.done, total=self.total, unit="B", unit_scale=True, desc="Downloading")
+
+    def write(self, chunk):
+        self.sink.write(chunk)
+        self.done += len(chunk)
+        if self.pbar is not None:
+            self.pbar.update(len(chunk))
+        elif callable(self.progress):
+            self.progress(self.done, self.total)
+
+    def restart(self):
+        if self.done > 0:
+            if self.filename is not None:
+                self.sink.close()
+                self.sink = open(self.partfilename, "wb")
+            elif hasattr(self.sink, 'seek') and hasattr(self.sink, 'truncate'):
+                self.sink.seek(0)
+                self.sink.truncate()
+            else:
+                raise Exception( "Can't restart download because the target isn't seekable" )
+        self.done = 0
+        if self.pbar is not None:
+            self.pbar.reset(total=self.total)
+
+    def finish(self):
+        if self.total is not None and self.done != self.total:
+            raise Exception( f"Download incomplete - received {self.done} bytes but expected {self.total}" )
+        if self.filename is not None:
+            self.sink.close()
+            os.replace(self.partfilename, self.filename)
+            if os.path.isfile(self.validatorfilename):
+                os.remove(self.validatorfilename)
+
+    def close(self):
+        if self.pbar is not None:
+            self.pbar.close()
+        if self.filename is not None and not self.sink.closed:
+            # leave the .part file so the download can be resumed
+            self.sink.close()
+
+##############################################################################################
+# support for the bulk execute_*_many methods
+
+# run func(uri, itemheaders) for each item on a bounded thread pool, yielding (uri, result-or-exception) - an item is a uri,
+# a tuple (uri, itemheaders) or any other object (e.g. an app, see JazzTeamServer.load_rootservices) which is passed as uri
+# only a limited number of items are submitted ahead, so a very long (or lazy) iterable of items isn't all queued up at once
+# adaptive is False for a fixed max_workers concurrency, True to use a throttle.AdaptiveConcurrency with maximum max_workers,
+#   or a throttle.AdaptiveConcurrency (e.g. shared between several calls)
+def execute_many(func, items, *, max_workers=BULK_MAX_WORKERS, ordered=False, adaptive=False):
+    max_workers = max(1, max_workers)
+    if adaptive is True:
+        adaptive = throttle.AdaptiveConcurrency(initial=min(4, max_workers), maximum=max_workers)
+    if adaptive:
+        max_workers = adaptive.maximum
+        innerfunc = func
+        # the latency of each HTTP request sent and overload responses are given to the controller by HttpRequest (see _adaptive_local)
+        def func(uri, itemheaders):
+            adaptive.acquire()
+            _adaptive_local.controller = adaptive
+            try:
+                return innerfunc(uri, itemheaders)
+            finally:
+                _adaptive_local.controller = None
+                adaptive.release()
+    inflight = collections.deque()
+    def result_of(uri, future):
+        try:
+            return (uri, future.result())
+        except Exception as e:
+            logger.info( f"Bulk request for {uri} failed {e}" )
+            return (uri, e)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="elmclient-bulk") as executor:
+        for item in items:
+            if isinstance(item, tuple):
+                uri, itemheaders = item
+            else:
+                uri, itemheaders = item, None
+            inflight.append((uri, executor.submit(func, uri, itemheaders)))
+            if len(inflight) >= max_workers * 2:
+                if ordered:
+                    yield result_of(*inflight.popleft())
+                else:
+                    # wait for any one to finish, then yield everything which has finished
+                    concurrent.futures.wait([f for u, f in inflight], return_when=concurrent.futures.FIRST_COMPLETED)
+                    for done in [(u, f) for u, f in inflight if f.done()]:
+                        inflight.remove(done)
+                        yield result_of(*done)
+        if ordered:
+            while inflight:
+                yield result_of(*inflight.popleft())
+        else:
+            futures = {f: u for u, f in inflight}
+            for future in concurrent.futures.as_completed(futures):
+                yield result_of(futures[future], future)
+
+
 class HttpOperations_Mixin():
     ############################################################################
     # methods for HTTP operations
@@ -100,9 +363,7 @@ class HttpOperations_Mixin():
         if headers is not None:
             reqheaders.update(headers)
         request = self._get_get_request(reluri=reluri, params=params, headers=reqheaders)
-        response = request.execute(cacheable=cacheable)
-        result = ET.ElementTree(ET.fromstring(response.content))
-        return result
+        return self._execute_get_parsed(request, cacheable)
 
     def execute_get_rdf_xml(self, reluri, *, params=None, headers=None,cacheable=True):
         if params is None:
@@ -111,10 +372,45 @@ class HttpOperations_Mixin():
         if headers is not None:
             reqheaders.update(headers)
         request = self._get_get_request(reluri=reluri, params=params, headers=reqheaders)
+        return self._execute_get_parsed(request, cacheable)
+
+    # GET and parse XML, using the session's in-memory cache of parsed responses (if any) for cacheable requests
+    def _execute_get_parsed(self, request, cacheable):
+        xmlcache = getattr(request._session, 'xmlcache', None) if cacheable else None
+        if xmlcache is not None:
+            key = request.get_cache_key()
+            result = xmlcache.get(key)
+            if result is not None:
+                return result
         response = request.execute(cacheable=cacheable)
         result = ET.ElementTree(ET.fromstring(response.content))
+        if xmlcache is not None:
+            xmlcache.set(key, result, len(response.content))
         return result
 
+    # bulk version of execute_get_rdf_xml: GET each of reluris using up to max_workers concurrent requests
+    # each item in reluris is either a uri or a tuple (uri, headers) where headers are added for just that request
+    # this is a generator yielding (uri, result) where result is the ElementTree or, if that request failed, the exception
+    # i.e. one failure doesn't abort the batch - the caller must check each result
+    # results are yielded as they complete, or in the order of reluris if ordered=True
+    # adaptive=True varies the concurrency up to max_workers according to the server's latency and overload responses (see throttle.AdaptiveConcurrency)
+    def execute_get_rdf_xml_many(self, reluris, *, params=None, headers=None, cacheable=True, max_workers=BULK_MAX_WORKERS, ordered=False, adaptive=False):
+        def getone(uri, itemheaders):
+            reqheaders = dict(headers) if headers is not None else {}
+            if itemheaders is not None:
+                reqheaders.update(itemheaders)
+            return self.execute_get_rdf_xml(uri, params=params, headers=reqheaders, cacheable=cacheable)
+        yield from execute_many(getone, reluris, max_workers=max_workers, ordered=ordered, adaptive=adaptive)
+
+    # bulk version of execute_get_xml - see execute_get_rdf_xml_many
+    def execute_get_xml_many(self, reluris, *, params=None, headers=None, cacheable=True, max_workers=BULK_MAX_WORKERS, ordered=False, adaptive=False):
+        def getone(uri, itemheaders):
+            reqheaders = dict(headers) if headers is not None else {}
+            if itemheaders is not None:
+                reqheaders.update(itemheaders)
+            return self.execute_get_xml(uri, params=params, headers=reqheaders, cacheable=cacheable)
+        yield from execute_many(getone, reluris, max_workers=max_workers, ordered=ordered, adaptive=adaptive)
+
     def execute_post_rdf_xml(self, reluri, *, data=None, params=None, headers=None, cacheable=True, put=False):
         reqheaders = {'Accept': 'application/xml', 'Content-Type': 'application/rdf+xml'}
         if headers is not None:
@@ -127,8 +423,8 @@ class HttpOperations_Mixin():
         reqheaders = {'Accept': 'application/xml', 'Content-Type': 'application/rdf+xml'}
         if headers is not None:
             reqheaders.update(headers)
-        request = self.get_delete_request(reluri=reluri, params=params, headers=reqheaders)
-        response = request.execute(cacheable=cacheable)
+        request = self._get_delete_request(reluri=reluri, params=params, headers=reqheaders)
+        response = request.execute(cacheable=False)
         return response
 
     def execute_get_json(self, reluri, *, params=None, headers=None,cacheable=True):
@@ -148,6 +444,110 @@ class HttpOperations_Mixin():
         response = request.execute(cacheable=cacheable)
         return response
 
+    # stream the response body for reluri to target without holding it in memory, returning the response (the body has been consumed)
+    # target is a filename, or a writable file-like object, or a function which is called with the response and returns a filename or file-like object
+    #   (e.g. so the filename can come from the Content-Disposition header)
+    # a file is first written as filename.part and renamed when complete; if resume is True and a .part file already exists
+    #   (with its .part.validator) the download continues from its end using a Range request with If-Range, so if the resource
+    #   has changed or the server doesn't support ranges the download restarts
+    # if the connection fails part way the download is resumed up to DOWNLOAD_RESUME_ATTEMPTS times
+    # the length received is checked against Content-Length/Content-Range
+    # progress is True to show a progress bar, or a function called with (bytes so far, total bytes or None)
+    def execute_download(self, reluri, target, *, params=None, headers=None, progress=False, resume=True, chunksize=DOWNLOAD_CHUNK_SIZE):
+        download = _Download(target, progress=progress, resume=resume)
+        attempts = 0
+        try:
+            while True:
+                reqheaders = {'Accept-Encoding': 'identity'} # so the length received can be checked against Content-Length
+                if headers is not None:
+                    reqheaders.update(headers)
+                reqheaders.update(download.get_range_headers())
+                request = self._get_get_request(reluri=reluri, params=params, headers=reqheaders)
+                try:
+                    response = request.execute(cacheable=False, stream=True, no_error_log=download.done > 0)
+                except requests.HTTPError as e:
+                    if e.response.status_code == http.client.REQUESTED_RANGE_NOT_SATISFIABLE and download.done > 0 and attempts < DOWNLOAD_RESUME_ATTEMPTS:
+                        # the partial download doesn't match the resource - start again
+                        logger.info( f"Range not satisfiable - restarting download of {reluri}" )
+                        download.restart()
+                        attempts += 1
+                        continue
+                    raise
+                try:
+                    download.start(response)
+                    for chunk in response.iter_content(chunk_size=chunksize):
+                        download.write(chunk)
+                    if download.total is not None and download.done < download.total:
+                        # the connection closed early without an error
+                        raise requests.exceptions.ChunkedEncodingError( f"Connection closed after {download.done} of {download.total} bytes" )
+                except (requests.exceptions.ChunkedEncodingError, requests.ConnectionError, requests.exceptions.ContentDecodingError) as e:
+                    attempts += 1
+                    if attempts > DOWNLOAD_RESUME_ATTEMPTS:
+                        raise
+                    logger.warning( f"Download of {reluri} interrupted after {download.done} bytes - resuming {e}" )
+                    continue
+                finally:
+                    response.close()
+                download.finish()
+                return response
+        finally:
+            download.close()
+
+    # POST (or PUT) a multipart/form-data body which is streamed from disk in chunks rather than built in memory
+    # fields is a dict/OrderedDict or list of (name, value) in requests_toolbelt.MultipartEncoder format - a file is given
+    #   as a tuple (filename, path, content_type) where path is the file to read (it's reopened if the request has to be resent after login or a retry)
+    # the body is never logged. Uploads are limited to UPLOAD_MAX_CONCURRENT at once (see set_upload_concurrency())
+    # progress is True to show a progress bar, or a function called with (bytes sent, total bytes)
+    def execute_post_multipart(self, uri, fields, *, params=None, headers=None, progress=False, boundary=None, put=False):
+        if isinstance(fields, dict):
+            fields = list(fields.items())
+        pbar = None
+        openfiles = []
+        # a new body is needed each time the request is sent
+        def makebody():
+            nonlocal pbar
+            for f in openfiles:
+                f.close()
+            openfiles.clear()
+            bodyfields = []
+            for name, value in fields:
+                if isinstance(value, tuple) and isinstance(value[1], (str, os.PathLike)):
+                    f = open(value[1], 'rb')
+                    openfiles.append(f)
+                    value = (value[0], f) + tuple(value[2:])
+                bodyfields.append((name, value))
+            encoder = requests_toolbelt.MultipartEncoder(bodyfields, boundary=boundary)
+            if not progress:
+                return encoder
+            if progress is True:
+                if pbar is not None:
+                    pbar.close()
+                pbar = tqdm.tqdm(initial=0, total=encoder.len, unit="B", unit_scale=True, desc="Uploading")
+                lastsent = 0
+                def callback(monitor):
+                    nonlocal lastsent
+                    pbar.update(monitor.bytes_read-lastsent)
+                    lastsent = monitor.bytes_read
+            else:
+                def callback(monitor):
+                    progress(monitor.bytes_read, monitor.len)
+            return requests_toolbelt.MultipartEncoderMonitor(encoder, callback)
+
+        reqheaders = {}
+        if headers is not None:
+            reqheaders.update(headers)
+        request = self._get_post_request(str(uri), params=params, headers=reqheaders, put=put)
+        request.set_body_factory(makebody, content_type=lambda body: body.content_type)
+        try:
+            with _upload_semaphore:
+                response = request.execute(cacheable=False)
+        finally:
+            for f in openfiles:
+                f.close()
+            if pbar is not None:
+                pbar.close()
+        return response
+
     def execute_post_content( self, uri, *, params=None, data=None, headers={}, put=False, cacheable=True):
         data = data if data is not None else ""
         reqheaders = {}
@@ -196,6 +596,39 @@ class HttpOperations_Mixin():
             return response_x
         return None
 
+    ###########################################################################
+    # awaitable versions of the execute_* methods for use from an asyncio event loop
+    # e.g. results = await asyncio.gather( *[ proj.aexecute_get_rdf_xml( uri ) for uri in uris ] )
+    # each runs the blocking execute_* method on a thread pool, so no more than ASYNC_MAX_WORKERS (default 32) requests are
+    # in flight at once however many are awaited - see set_async_concurrency()
+
+    async def aexecute_get_xml(self, reluri, *, params=None, headers=None, cacheable=True):
+        return await _run_blocking(self.execute_get_xml, reluri, params=params, headers=headers, cacheable=cacheable)
+
+    async def aexecute_get_rdf_xml(self, reluri, *, params=None, headers=None, cacheable=True):
+        return await _run_blocking(self.execute_get_rdf_xml, reluri, params=params, headers=headers, cacheable=cacheable)
+
+    async def aexecute_post_rdf_xml(self, reluri, *, data=None, params=None, headers=None, cacheable=True, put=False):
+        return await _run_blocking(self.execute_post_rdf_xml, reluri, data=data, params=params, headers=headers, cacheable=cacheable, put=put)
+
+    async def aexecute_delete(self, reluri, *, params=None, headers=None):
+        return await _run_blocking(self.execute_delete, reluri, params=params, headers=headers)
+
+    async def aexecute_get_json(self, reluri, *, params=None, headers=None, cacheable=True):
+        return await _run_blocking(self.execute_get_json, reluri, params=params, headers=headers, cacheable=cacheable)
+
+    async def aexecute_get_binary(self, reluri, *, params=None, headers=None, cacheable=True):
+        return await _run_blocking(self.execute_get_binary, reluri, params=params, headers=headers, cacheable=cacheable)
+
+    async def aexecute_post_content(self, uri, *, params=None, data=None, headers={}, put=False, cacheable=True):
+        return await _run_blocking(self.execute_post_content, uri, params=params, data=data, headers=headers, put=put, cacheable=cacheable)
+
+    async def aexecute_get(self, reluri, *, params=None, headers=None, cacheable=True):
+        return await _run_blocking(self.execute_get, reluri, params=params, headers=headers, cacheable=cacheable)
+
+    async def aexecute_get_raw(self, reluri, *, params=None, headers=None, cacheable=True):
+        return await _run_blocking(self.execute_get_raw, reluri, params=params, headers=headers, cacheable=cacheable)
+
     ###########################################################################
     # below here is internal implementation
 
@@ -211,34 +644,258 @@ class HttpOperations_Mixin():
         return self._get_request('DELETE', reluri, params=params, headers=headers)
 
 
+##############################################################################################
+# retry policy for HttpRequest - a policy is attached to the session (see JazzTeamServer) as session.retrypolicy
+
+# default per-status rules: the maximum number of attempts (including the first) for a response with this status
+# a status not listed isn't retried. NOTE 400 Bad Request isn't retried because repeating it can't help
+DEFAULT_RETRY_STATUS_RULES = {
+    http.client.REQUEST_TIMEOUT: 4,
+    http.client.LOCKED: 4,
+    http.client.TOO_MANY_REQUESTS: 6,
+    http.client.INTERNAL_SERVER_ERROR: 3,
+    http.client.BAD_GATEWAY: 4,
+    http.client.SERVICE_UNAVAILABLE: 6,
+    http.client.GATEWAY_TIMEOUT: 4,
+}
+
+# statuses where the server's Retry-After header is honoured
+RETRY_AFTER_STATUSES = [ http.client.TOO_MANY_REQUESTS, http.client.SERVICE_UNAVAILABLE ]
+
+class RetryPolicy():
+    # max_attempts: overall limit on attempts (including the first) for one request
+    # base_delay/cap_delay: seconds - the delay before retry n is chosen randomly between 0 and min(cap_delay, base_delay*2**(n-1)) ("full jitter")
+    #   so that many clients don't all retry at the same moment
+    # deadline: if not None, the maximum total seconds for a request including retries - a retry which would end after the deadline isn't done
+    # status_rules: dict of status code to maximum attempts for that status, default DEFAULT_RETRY_STATUS_RULES
+    # retry_connection_errors: retry when the connection fails or times out (the server didn't respond)
+    def __init__(self, *, max_attempts=4, base_delay=1.0, cap_delay=30.0, deadline=None, status_rules=None, retry_connection_errors=True):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.cap_delay = cap_delay
+        self.deadline = deadline
+        self.status_rules = dict(DEFAULT_RETRY_STATUS_RULES if status_rules is None else status_rules)
+        self.retry_connection_errors = retry_connection_errors
+        # totals across all requests using this policy
+        self._lock = threading.Lock()
+        self.total_retries = 0
+        self.total_retry_seconds = 0.0
+
+    def is_retryable_status(self, status_code, attempt=1):
+        return attempt < min(self.max_attempts, self.status_rules.get(status_code, 0))
+
+    def is_retryable_exception(self, e, attempt=1):
+        if e.response is not None:
+            return self.is_retryable_status(e.response.status_code, attempt)
+        if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+            return self.retry_connection_errors and attempt < self.max_attempts
+        return False
+
+    # return the seconds to wait before the next attempt, after attempt number attempt (1 is the first) failed with response
+    def get_delay(self, attempt, response=None):
+        if response is not None and response.status_code in RETRY_AFTER_STATUSES:
+            retryafter = self._parse_retry_after(response.headers.get('Retry-After'))
+            if retryafter is not None:
+                return retryafter
+        return random.uniform(0, min(self.cap_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    # Retry-After is either a number of seconds or an HTTP date
+    def _parse_retry_after(self, value):
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if when is None:
+            return None
+        return max(0.0, when.timestamp() - time.time())
+
+    def record_retry(self, seconds):
+        with self._lock:
+            self.total_retries += 1
+            self.total_retry_seconds += seconds
+
+    def get_stats(self):
+        with self._lock:
+            return {'retries': self.total_retries, 'retry_seconds': self.total_retry_seconds}
+
+# used if the session doesn't have a policy
+_default_retrypolicy = RetryPolicy()
+
+# responses which show the server is overloaded - used to reduce the concurrency in adaptive mode
+OVERLOAD_STATUSES = [ http.client.TOO_MANY_REQUESTS, http.client.BAD_GATEWAY, http.client.SERVICE_UNAVAILABLE, http.client.GATEWAY_TIMEOUT ]
+
+def is_overload_error(e):
+    if e.response is not None:
+        return e.response.status_code in OVERLOAD_STATUSES
+    return isinstance(e, requests.Timeout)
+
+# the throttle.AdaptiveConcurrency controlling the current thread's requests (if any) - set by execute_many in adaptive mode
+# _send_traced gives it the latency of each request and _execute_request reports each overload response (once per attempt)
+_adaptive_local = threading.local()
+
+
+##############################################################################################
+# single-flight login: when a shared session needs to (re)login only one request does the login, concurrent
+# requests which need login wait for it to finish and then replay using the new cookies
+
+class _LoginCoordinator():
+    def __init__(self):
+        self._lock = threading.RLock()
+        # incremented each time a login is completed
+        self.generation = 0
+
+    # call loginfunc unless a login has completed since the request was sent (when it saw generation)
+    # returns (True, result of loginfunc) if the login was done, or (False, None) if it wasn't needed
+    def login(self, generation, loginfunc):
+        with self._lock:
+            if self.generation != generation:
+                logger.info( "Login already done by another request - not logging in again" )
+                return (False, None)
+            try:
+                return (True, loginfunc())
+            finally:
+                # even if the login failed, requests which were waiting should retry rather than all trying to login again
+                self.generation += 1
+
+_login_coordinator_lock = threading.Lock()
+
+def _get_login_coordinator(session):
+    with _login_coordinator_lock:
+        if getattr(session, '_logincoordinator', None) is None:
+            session._logincoordinator = _LoginCoordinator()
+        return session._logincoordinator
+
+
 class HttpRequest():
     def __init__(self, session, verb, uri, *, params=None, headers=None, data=None):
         self._req = requests.Request(verb,uri, params=params, headers=headers, data=data)
         self._session = session
+        # if set, a function giving a new (streamed) body each time the request is sent - the body isn't logged
+        self._body_factory = None
+        self._body_content_type = None
+        # number of retries and the time spent waiting to retry for this request
+        self.retries = 0
+        self.retry_seconds = 0.0
 
     def get_user_password(self, url=None):
         return (self._session.username, self._session.password)
 
-    def execute( self, no_error_log=False, close=False, cacheable=True ):
-        return self._execute_request( no_error_log=no_error_log, close=close, cacheable=cacheable )
-
-    # execute the request, retrying with increasing delays (login isn't handled at this level but at lower level)
-    def _execute_request(self, *, no_error_log=False, close=False, cacheable=True ):
-        for wait_dur in [2, 5, 10, 0]:
+    # use a function to provide the body - needed for a streamed body (i.e. a file-like object) because once sent it can't be sent again
+    # content_type is a function given the body which returns the Content-Type header
+    def set_body_factory(self, body_factory, content_type=None):
+        self._body_factory = body_factory
+        self._body_content_type = content_type
+
+    def _prepare_request(self):
+        if self._body_factory is not None:
+            self._req.data = self._body_factory()
+            if self._body_content_type is not None:
+                self._req.headers['Content-Type'] = self._body_content_type(self._req.data)
+        return self._session.prepare_request(self._req)
+
+    # stream=True returns the response before its body is read - the caller must consume the body e.g. using response.iter_content() and then close the response
+    def execute( self, no_error_log=False, close=False, cacheable=True, stream=False ):
+        return self._execute_request( no_error_log=no_error_log, close=close, cacheable=cacheable, stream=stream )
+
+    # the key for the in-memory cache of parsed responses: the full url including parameters, Accept and configuration context headers
+    def get_cache_key(self):
+        prepped = requests.PreparedRequest()
+        prepped.prepare_url(self._req.url, self._req.params)
+        headers = requests.structures.CaseInsensitiveDict(self._req.headers or {})
+        # the fragment isn't sent to the server so isn't part of the key
+        return (prepped.url.split('#')[0], headers.get('Accept'), headers.get('Configuration-Context'), headers.get('vvc.configuration'))
+
+    def _get_retrypolicy(self):
+        return getattr(self._session, 'retrypolicy', None) or _default_retrypolicy
+
+    # execute the request, retrying with increasing randomised delays according to the session's retry policy (login isn't handled at this level but at lower level)
+    def _execute_request(self, *, no_error_log=False, close=False, cacheable=True, stream=False ):
+        policy = self._get_retrypolicy()
+        starttime = time.monotonic()
+        attempt = 1
+        while True:
             try:
                 if not cacheable:
                     # add a parameter so the full URL is different each time
 #                    request.params["CachePrevention"]=str(int(time.time()*1000))
                     self._req.headers['Cache-Control'] = "no-store, max-age=0"
-                result = self._execute_one_request_with_login( no_error_log=no_error_log, close=close)
+                result = self._execute_one_request_with_login( no_error_log=no_error_log, close=close, stream=stream)
+                if self._req.method not in ('GET', 'HEAD') and getattr(self._session, 'xmlcache', None) is not None:
+                    # the resource may have changed so don't use a parsed copy of it
+                    self._session.xmlcache.invalidate(self._req.url)
                 return result
             except requests.RequestException as e:
-                if wait_dur == 0 or not self._is_retryable_error(e):
+                controller = getattr(_adaptive_local, 'controller', None)
+                if controller is not None and is_overload_error(e):
+                    controller.overload( f"response {e.response.status_code if e.response is not None else e}" )
+                if not self._is_retryable_error(e, attempt):
                     raise
-                logger.info( f"Got error on HTTP request. URL: {self._req.url}, {e.response.status_code}, {e.response.text}")
-                logger.warning( f'RETRY: Retry after {wait_dur} seconds... URL: {self._req.url}' )
+                wait_dur = policy.get_delay(attempt, e.response)
+                if policy.deadline is not None and time.monotonic() + wait_dur - starttime > policy.deadline:
+                    logger.warning( f"RETRY: Not retrying because the deadline of {policy.deadline} seconds would be exceeded. URL: {self._req.url}" )
+                    raise
+                if e.response is not None:
+                    logger.info( f"Got error on HTTP request. URL: {self._req.url}, {e.response.status_code}, {e.response.text}")
+                else:
+                    logger.info( f"Got error on HTTP request. URL: {self._req.url}, {e}")
+                logger.warning( f'RETRY: Retry {attempt} after {wait_dur:.1f} seconds... URL: {self._req.url}' )
                 time.sleep(wait_dur)
-        raise Exception('programming error this point should never be reached')
+                self.retries += 1
+                self.retry_seconds += wait_dur
+                policy.record_retry(wait_dur)
+                if getattr(self._session, 'metrics', None) is not None:
+                    self._session.metrics.record_retry(self._req.method, self._req.url, wait_dur)
+                attempt += 1
+
+    # decide (once per request) whether this request is WIRE traced
+    def _is_wire_traced(self):
+        if not logger.isEnabledFor(logging.TRACE):
+            return False
+        if not hasattr(self, '_wire_traced'):
+            self._wire_traced = next(_wire_trace_counter) % WIRE_TRACE_SAMPLE == 0
+        return self._wire_traced
+
+    # send the prepared request, WIRE tracing the request and response if enabled
+    # when only tracing slow requests the request is logged after the response is received
+    # with stream=True the response body isn't traced, because that would read it
+    # latencysample=False for login requests, which shouldn't affect adaptive concurrency
+    def _send_traced(self, prepped, label, donotlogbody=False, stream=False, latencysample=True):
+        traced = self._is_wire_traced()
+        if traced and WIRE_TRACE_SLOW is None:
+            logger.trace( f"\nWIRE: {label} request +++++ {prepped.method} {prepped.url}\n\n{self._log_request(prepped,donotlogbody=donotlogbody)}" )
+        # apply the server-wide rate limit
+        ratelimiter = getattr(self._session, 'ratelimiter', None)
+        if ratelimiter is not None:
+            ratelimiter.acquire()
+        metrics = getattr(self._session, 'metrics', None)
+        if metrics is not None:
+            metrics.before_request(prepped)
+        starttime = time.perf_counter()
+        try:
+            response = self._session.send(prepped, stream=stream)
+        except requests.RequestException:
+            if metrics is not None:
+                metrics.after_request(prepped, None, time.perf_counter() - starttime, stream=stream)
+            raise
+        elapsed = time.perf_counter() - starttime
+        if metrics is not None:
+            metrics.after_request(prepped, response, elapsed, stream=stream)
+        # in adaptive mode the latency of each request sent to the server is a sample - a response from the cache isn't
+        controller = getattr(_adaptive_local, 'controller', None)
+        if latencysample and controller is not None and not getattr(response, 'from_cache', False):
+            controller.observe(elapsed)
+        if traced:
+            if WIRE_TRACE_SLOW is None:
+                logger.trace( f"\nWIRE: {label} response ----- {response.status_code} {elapsed:.3f}s\n\n{self._log_response(response,nobody=stream)}" )
+            elif elapsed >= WIRE_TRACE_SLOW:
+                logger.trace( f"\nWIRE: {label} SLOW request +++++ {prepped.method} {prepped.url}\n\n{self._log_request(prepped,donotlogbody=donotlogbody)}" )
+                logger.trace( f"\nWIRE: {label} SLOW response ----- {response.status_code} {elapsed:.3f}s\n\n{self._log_response(response,nobody=stream)}" )
+        return response
 
     # generate a string for logging of a http request with a stacktrace of the collers and showing URL, headers and any data
     def _log_request(self, request,donotlogbody=False):
@@ -278,7 +935,7 @@ class HttpRequest():
         return callers
 
     # generate a string for logging of a http response showing response code, headers and any data
-    def _log_response(self, response):
+    def _log_response(self, response, nobody=False):
         logtext = ""
         for k in sorted(response.headers.keys()):
             logtext += " " + k + ": " + response.headers[k] + "\n"
@@ -287,7 +944,9 @@ class HttpRequest():
             for k in sorted(cjd.keys()):
                 logtext += " Cookie " + k + ": " + cjd[k] + "\n"
         # add the body
-        if response.content is not None:
+        if nobody:
+            logtext += "\nSTREAMED BODY NOT SHOWN\n"
+        elif response.content is not None:
             if len(response.content) > 1000000:
                 rawtext = "LONG LONG CONTENT..."
             else:
@@ -300,25 +959,20 @@ class HttpRequest():
 
         return logtext
 
-    # categorize a Requests .send() exception e as to whether is retriable
-    def _is_retryable_error(self, e):
+    # categorize a Requests .send() exception e as to whether is retriable after attempt number attempt failed
+    def _is_retryable_error(self, e, attempt=1):
         if self._session.auto_retry:
-            if e.response.status_code in [
-                                                http.client.REQUEST_TIMEOUT,
-                                                http.client.LOCKED, 
-                                                http.client.INTERNAL_SERVER_ERROR,
-                                                http.client.SERVICE_UNAVAILABLE,
-                                                http.client.BAD_REQUEST
-                                        ]:
-                return True
+            return self._get_retrypolicy().is_retryable_exception(e, attempt)
         return False
 
     # execute a request once, except:
     #  1. if the response indicates login is required then login and try the request again
     #  2. if request is rejected for various reasons retry with the CSRF header applied
     # supports Jazz Form authorization and Jazz Authorization Server login
-    def _execute_one_request_with_login(self, *, no_error_log=False, close=False, donotlogbody=False):
+    def _execute_one_request_with_login(self, *, no_error_log=False, close=False, donotlogbody=False, stream=False):
         retry_after_login_needed = False
+        # True if this request did a login (rather than waiting for another request to do it)
+        did_login = False
 
         request = self._req
 
@@ -333,12 +987,14 @@ class HttpRequest():
         else:
             request.headers['Connection'] = 'keep-alive'
 
+        # remember the login generation so if login is needed we can tell whether another request has already done it
+        logincoordinator = _get_login_coordinator(self._session)
+        logingeneration = logincoordinator.generation
+
         # actually (try to) do the request
         try:
-            prepped = self._session.prepare_request(request)
-            logger.trace( f"\nWIRE: do_execute request +++++ {request.method} {request.url}\n\n{self._log_request(prepped)}")
-            response = self._session.send(prepped )
-            logger.trace(f"\nWIRE: do_execute response ----- {response.status_code}\n\n{self._log_response(response)}")
+            prepped = self._prepare_request()
+            response = self._send_traced(prepped, "do_execute", donotlogbody=donotlogbody or self._body_factory is not None, stream=stream)
 
             response.raise_for_status()
 
@@ -347,9 +1003,12 @@ class HttpRequest():
             if 'X-com-ibm-team-repository-web-auth-msg' in response.headers:
                 if response.headers['X-com-ibm-team-repository-web-auth-msg'] == 'authrequired':
                     logger.trace("WIRE: auth required")
-                    self._session.is_authenticated = False
-                    response = self._jazz_form_authorize(request.url, request, response)
-                    self._session.is_authenticated = True
+                    def formlogin(authresponse=response):
+                        self._session.is_authenticated = False
+                        result = self._jazz_form_authorize(request.url, request, authresponse)
+                        self._session.is_authenticated = True
+                        return result
+                    did_login, response = logincoordinator.login(logingeneration, formlogin)
                     logger.trace("WIRE: auth done - retrying")
                     retry_after_login_needed = True
 
@@ -358,9 +1017,11 @@ class HttpRequest():
                 logger.trace( f"HTTPError {e}" )
             if e.response.status_code == 401 and 'X-jazz-web-oauth-url' in e.response.headers:
                 logger.trace("WIRE: need non-JAS login")
-                self._session.is_authenticated = False
                 auth_url = e.response.headers['X-jazz-web-oauth-url']
-                login_response = self._login(auth_url)
+                def oauthlogin():
+                    self._session.is_authenticated = False
+                    return self._login(auth_url)
+                did_login, login_response = logincoordinator.login(logingeneration, oauthlogin)
                 if login_response:
                     logger.trace("WIRE: NOT retrying")
                     response = login_response
@@ -376,10 +1037,13 @@ class HttpRequest():
                     if e.response.headers['WWW-Authenticate'].find("JSA") < 0:
                         raise Exception( f"Non-JSA authentication not supported - WWW-Authenticate is '{e.response.headers['WWW-Authenticate']}'")
 
-                self._session.is_authenticated = False
                 auth_url = e.response.headers['X-JSA-AUTHORIZATION-REDIRECT']
-                login_response = self._jsa_login(auth_url)
-                self._session.is_authenticated = True
+                def jsalogin():
+                    self._session.is_authenticated = False
+                    result = self._jsa_login(auth_url)
+                    self._session.is_authenticated = True
+                    return result
+                did_login, login_response = logincoordinator.login(logingeneration, jsalogin)
                 if login_response:
                     logger.trace("WIRE: Response received after JAS login")
                     response = login_response
@@ -399,9 +1063,11 @@ class HttpRequest():
                 json_object = json_string and json.loads(json_string)
                 auth_url = json_object and json_object.get('redirect')
                 if auth_url:
-                    self._session.is_authenticated = False
-                    self._login(auth_url)
-                    self._session.is_authenticated = True
+                    def redirectlogin():
+                        self._session.is_authenticated = False
+                        self._login(auth_url)
+                        self._session.is_authenticated = True
+                    did_login, _ = logincoordinator.login(logingeneration, redirectlogin)
                     retry_after_login_needed = True
                     logger.trace( "Retry needed" )
                     logger.trace( f"Auth completed (in theory) result - 4" )
@@ -415,25 +1081,28 @@ class HttpRequest():
                     raise
 
         if retry_after_login_needed:
-#            # completed login - save cookies! When run again, we try picking up these cookies, perhaps we'll avoid having to re-login
-#            # from https://stackoverflow.com/questions/13030095/how-to-save-requests-python-cookies-to-a-file
-#            if caching_save_creds(self.cachingcontrol):
-#                os.makedirs(self.cachefolder, exist_ok=True)
-#                with open(os.path.join(self.cachefolder,COOKIE_SAVE_FILE), 'wb') as f:
-#                    pickle.dump(self._session.cookies, f)
             # now retry
             try:
                 # have to build a new request which will get the (new) auth cookies
                 # make sure this request isn't satisfied from cache!
                 request.headers.update({'Cache-Control': 'no-cache'})
-                prepped = self._session.prepare_request(request)
-                logger.trace( f"\nWIRE: do_execute request  RETRY +++++ {request.method} {request.url}\n\n{self._log_request(prepped)}" )
-                response = self._session.send(prepped)
-                logger.trace( f"\nWIRE: do_execute response RETRY ----- {response.status_code}\n\n{self._log_response(response)}" )
+                prepped = self._prepare_request()
+                response = self._send_traced(prepped, "do_execute RETRY", donotlogbody=donotlogbody or self._body_factory is not None, stream=stream)
                 response.raise_for_status()
             except requests.HTTPError as e:
                 logger.error( f"Exception on retrying request. URL: {request.url}, {e.response.status_code}, {e.response.text}")
                 raise
+        if did_login and getattr(self._session, 'metrics', None) is not None:
+            self._session.metrics.record_login()
+        # completed login - save cookies! When run again, we try picking up these cookies, perhaps we'll avoid having to re-login
+        if did_login and 'X-com-ibm-team-repository-web-auth-msg' not in response.headers:
+            cookiestores = [store for store in (getattr(self._session, 'cookiestores', None) or {}).values() if store is not None]
+            for cookiestore in cookiestores:
+                if cookiestore.matches(request.url):
+                    try:
+                        cookiestore.save(self._session.cookies, others=[store for store in cookiestores if store is not cookiestore])
+                    except Exception as e:
+                        logger.warning( f"Failed to save cookies {e}" )
         if 'X-com-ibm-team-repository-web-auth-msg' in response.headers:
             username, password = self.get_user_password(request.url)
             logger.error( f"Authorization Failure. Check user ID {username} and password for URL [{request.url}]" )
@@ -511,9 +1180,7 @@ class HttpRequest():
             request = requests.Request("GET",str(auth_url), headers=headers, data=data)
             prepped = self._session.prepare_request(request)
 
-            logger.trace( f"\nWIRE: __authorize request +++++= {request.method} {request.url}\n\n{self._log_request(prepped,donotlogbody=True)}" )
-            response = self._session.send(prepped)
-            logger.trace( f"\nWIRE: __authorize response ----- {response.status_code}\n\n{self._log_response(response)}")
+            response = self._send_traced(prepped, "__authorize", donotlogbody=True, latencysample=False)
 
             response.raise_for_status()
             if 'X-com-ibm-team-repository-web-auth-msg' in response.headers:
@@ -540,7 +1207,8 @@ class HttpRequest():
 
             response = self._session.get(auth_url)
 
-            logger.trace( f"\nWIRE: __jazz_form_authorize response ----- {response.status_code}\n\n{self._log_response(response)}" )
+            if logger.isEnabledFor(logging.TRACE):
+                logger.trace( f"\nWIRE: __jazz_form_authorize response ----- {response.status_code}\n\n{self._log_response(response)}" )
         except requests.HTTPError as e:
             logger.info( f"Failed to jazz_authorize with auth URL {auth_url} with exception {e}" )  # was logger.error despite subsequent authentication success
             raise Exception("Jazz FORM authorize not possible!")
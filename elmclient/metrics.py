@@ -0,0 +1,237 @@
+##
+## © Copyright 2021- IBM Inc. All rights reserved
+# SPDX-License-Identifier: MIT
+##
+
+# request metrics - a RequestMetrics is attached to each session (see JazzTeamServer.get_metrics()) and
+# httpops.HttpRequest records every request sent, so you can see which endpoints the time is spent on
+
+import json
+import logging
+import math
+import re
+import threading
+import time
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf]
+
+# a path segment which looks like an id (e.g. TX_SRBoRdd8EeqV5_5cfWW9rw, _IZCsIRuREeyjc_YwJfTLJA, 1234) is replaced by {id}
+# so all requests for the same kind of resource are counted together
+_id_re = re.compile( r"^(?:[A-Z]{2,3}_|_)[A-Za-z0-9_-]{8,}$|^\d+$|^[0-9a-fA-F-]{16,}$" )
+
+# return the path of url with ids replaced by {id}, e.g. "/rm/resources/{id}"
+def endpoint_path(url):
+    path = urllib.parse.urlparse(url).path
+    segments = [ "{id}" if _id_re.match(seg) else seg for seg in path.split("/") ]
+    return "/".join(segments)
+
+# return the endpoint name used to accumulate metrics for a request, e.g. "GET /rm/resources/{id}"
+def endpoint_name(method, url):
+    return f"{method} {endpoint_path(url)}"
+
+class _EndpointStats():
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0]*len(LATENCY_BUCKETS)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.bytes_from_cache = 0
+        self.retries = 0
+        self.retry_seconds = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.revalidations = 0
+        self.statuses = {}
+
+    def as_dict(self):
+        return {
+            'count': self.count
+            ,'errors': self.errors
+            ,'total_seconds': self.total_seconds
+            ,'mean_seconds': self.total_seconds/self.count if self.count else 0.0
+            ,'max_seconds': self.max_seconds
+            ,'histogram': { ("+Inf" if math.isinf(b) else str(b)): n for b, n in zip(LATENCY_BUCKETS, self.buckets) }
+            ,'bytes_in': self.bytes_in
+            ,'bytes_out': self.bytes_out
+            ,'bytes_from_cache': self.bytes_from_cache
+            ,'retries': self.retries
+            ,'retry_seconds': self.retry_seconds
+            ,'cache_hits': self.cache_hits
+            ,'cache_misses': self.cache_misses
+            ,'revalidations': self.revalidations
+            ,'statuses': dict(self.statuses)
+        }
+
+class RequestMetrics():
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pre_hooks = []
+        self._post_hooks = []
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+            self.logins = 0
+            self.started = time.time()
+
+    # hooks are called for every request sent (including login requests)
+    # a pre hook is called as func(prepared_request) before the request is sent
+    # a post hook is called as func(prepared_request, response, elapsed_seconds) - response is None if the request failed without a response
+    # an exception from a hook is logged and otherwise ignored
+    def add_pre_request_hook(self, func):
+        self._pre_hooks.append(func)
+
+    def add_post_request_hook(self, func):
+        self._post_hooks.append(func)
+
+    def remove_hook(self, func):
+        if func in self._pre_hooks:
+            self._pre_hooks.remove(func)
+        if func in self._post_hooks:
+            self._post_hooks.remove(func)
+
+    def _call_hooks(self, hooks, *args):
+        for hook in list(hooks):
+            try:
+                hook(*args)
+            except Exception as e:
+                logger.warning( f"Request hook {hook} failed {e}" )
+
+    def _get_endpoint(self, method, url):
+        name = endpoint_name(method, url)
+        if name not in self._endpoints:
+            self._endpoints[name] = _EndpointStats()
+        return self._endpoints[name]
+
+    def before_request(self, prepped):
+        self._call_hooks(self._pre_hooks, prepped)
+
+    # record a request which has been sent - response is None if it failed without a response (e.g. connection error)
+    # for a streamed response the body hasn't been read so the size is taken from Content-Length
+    # bytes_in only counts responses received from the server - the size of a response from the cache (including one
+    # revalidated with a 304) is counted in bytes_from_cache
+    def after_request(self, prepped, response, elapsed, stream=False):
+        bytes_out = _body_length(prepped.body)
+        if response is None:
+            bytes_in = 0
+        elif stream:
+            bytes_in = int(response.headers.get('Content-Length', 0) or 0)
+        else:
+            bytes_in = len(response.content or b'')
+        with self._lock:
+            stats = self._get_endpoint(prepped.method, prepped.url)
+            stats.count += 1
+            stats.total_seconds += elapsed
+            stats.max_seconds = max(stats.max_seconds, elapsed)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if elapsed <= bound:
+                    stats.buckets[i] += 1
+                    break
+            if getattr(response, 'from_cache', False):
+                stats.bytes_from_cache += bytes_in
+            else:
+                stats.bytes_in += bytes_in
+            stats.bytes_out += bytes_out
+            if response is None or response.status_code >= 400:
+                stats.errors += 1
+            if response is not None:
+                stats.statuses[response.status_code] = stats.statuses.get(response.status_code, 0) + 1
+                # from_cache is only present when the session is caching
+                if hasattr(response, 'from_cache'):
+                    if response.from_cache:
+                        stats.cache_hits += 1
+                    else:
+                        stats.cache_misses += 1
+                    # a cache hit which needed a 304 from the server
+                    if getattr(response, 'revalidated', False):
+                        stats.revalidations += 1
+        self._call_hooks(self._post_hooks, prepped, response, elapsed)
+
+    def record_retry(self, method, url, seconds):
+        with self._lock:
+            stats = self._get_endpoint(method, url)
+            stats.retries += 1
+            stats.retry_seconds += seconds
+
+    def record_login(self):
+        with self._lock:
+            self.logins += 1
+
+    # return a dict with totals and per-endpoint stats
+    def get_stats(self):
+        with self._lock:
+            endpoints = { name: stats.as_dict() for name, stats in self._endpoints.items() }
+            logins = self.logins
+            started = self.started
+        totals = {'requests': 0, 'errors': 0, 'total_seconds': 0.0, 'bytes_in': 0, 'bytes_out': 0, 'bytes_from_cache': 0, 'retries': 0, 'retry_seconds': 0.0, 'cache_hits': 0, 'cache_misses': 0, 'revalidations': 0}
+        for stats in endpoints.values():
+            totals['requests'] += stats['count']
+            for k in totals.keys():
+                if k != 'requests':
+                    totals[k] += stats[k]
+        totals['logins'] = logins
+        totals['elapsed_seconds'] = time.time() - started
+        return {'totals': totals, 'endpoints': endpoints}
+
+    def to_json(self, indent=2):
+        return json.dumps(self.get_stats(), indent=indent)
+
+    # return the metrics in the Prometheus text exposition format
+    def to_prometheus(self, prefix="elmclient"):
+        stats = self.get_stats()
+        lines = []
+        def add(name, kind, helptext, samples):
+            lines.append( f"# HELP {prefix}_{name} {helptext}" )
+            lines.append( f"# TYPE {prefix}_{name} {kind}" )
+            for labels, value in samples:
+                labeltext = ",".join( f'{k}="{_escape_label(v)}"' for k, v in labels.items() )
+                lines.append( f"{prefix}_{name}{{{labeltext}}} {value}" if labeltext else f"{prefix}_{name} {value}" )
+        endpoints = sorted(stats['endpoints'].items())
+        histsamples = []
+        for name, ep in endpoints:
+            cumulative = 0
+            for bound, n in ep['histogram'].items():
+                cumulative += n
+                histsamples.append( ({'endpoint': name, 'le': bound}, cumulative) )
+        lines.append( f"# HELP {prefix}_request_duration_seconds Request latency by endpoint" )
+        lines.append( f"# TYPE {prefix}_request_duration_seconds histogram" )
+        for labels, value in histsamples:
+            lines.append( f'{prefix}_request_duration_seconds_bucket{{endpoint="{_escape_label(labels["endpoint"])}",le="{labels["le"]}"}} {value}' )
+        for name, ep in endpoints:
+            lines.append( f'{prefix}_request_duration_seconds_sum{{endpoint="{_escape_label(name)}"}} {ep["total_seconds"]}' )
+            lines.append( f'{prefix}_request_duration_seconds_count{{endpoint="{_escape_label(name)}"}} {ep["count"]}' )
+        add("request_errors_total", "counter", "Requests which failed or returned an error status", [ ({'endpoint': name}, ep['errors']) for name, ep in endpoints ])
+        add("response_bytes_total", "counter", "Bytes received from the server", [ ({'endpoint': name}, ep['bytes_in']) for name, ep in endpoints ])
+        add("request_bytes_total", "counter", "Bytes sent", [ ({'endpoint': name}, ep['bytes_out']) for name, ep in endpoints ])
+        add("cache_bytes_total", "counter", "Bytes of responses from the cache", [ ({'endpoint': name}, ep['bytes_from_cache']) for name, ep in endpoints ])
+        add("retries_total", "counter", "Retries", [ ({'endpoint': name}, ep['retries']) for name, ep in endpoints ])
+        add("retry_seconds_total", "counter", "Seconds spent waiting to retry", [ ({'endpoint': name}, ep['retry_seconds']) for name, ep in endpoints ])
+        add("cache_hits_total", "counter", "Responses from the cache", [ ({'endpoint': name}, ep['cache_hits']) for name, ep in endpoints ])
+        add("cache_misses_total", "counter", "Responses not from the cache", [ ({'endpoint': name}, ep['cache_misses']) for name, ep in endpoints ])
+        add("cache_revalidations_total", "counter", "Cached responses revalidated with a 304 from the server", [ ({'endpoint': name}, ep['revalidations']) for name, ep in endpoints ])
+        add("logins_total", "counter", "Logins performed", [ ({}, stats['totals']['logins']) ])
+        return "\n".join(lines)+"\n"
+
+    # save to a file - Prometheus text if the filename ends .prom, otherwise JSON
+    def save(self, filename):
+        with open(filename, "w") as f:
+            f.write(self.to_prometheus() if filename.endswith(".prom") else self.to_json())
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# the size of a request body - for a streamed body this is the size if known
+def _body_length(body):
+    if body is None:
+        return 0
+    if isinstance(body, (bytes, bytearray, str)):
+        return len(body)
+    return getattr(body, 'len', 0) or 0
@@ -9,21 +9,26 @@ import re
 import time
 import urllib
 
-import colorama
-import lark
 import lxml.etree as ET
-import tqdm
 
-from . import _queryparser
 from . import httpops
 from . import rdfxml
 from . import server
 from . import utils
 
+# these are only loaded when first used - the query parser (and lark) are only needed to parse a query
+tqdm = utils.lazy_import('tqdm')
+_queryparser = utils.lazy_import(f'{__package__}._queryparser')
+
 logger = logging.getLogger(__name__)
 
 OSLC_PAGESIZE = 200
 
+# the default number of pages of query results retrieved concurrently - 1 follows oslc:nextPage one page at a time.
+# With more than 1, when the first page gives the total number of results and the next page URL is one of the known
+# forms (page=/pageNum= or _startIndex=) the URLs of all the pages are generated and retrieved concurrently
+PAGE_WORKERS = 1
+
 # this is used to capture the series of query URLs (likely only the first one will be later used)
 # (couldn't find any easy way to return these to the caller for optional display to user)
 # (maybe need to return a dictionary or object for results which includes these raw query URL(s))
@@ -39,10 +44,11 @@ try:
 except ImportError:
     # UNIX
     import sys
-    import tty
-    import termios
     import atexit
     import select
+    # the terminal is only used if a query is running long enough to check for a key being pressed
+    tty = utils.lazy_import('tty')
+    termios = utils.lazy_import('termios')
 
     def getch():
         fd = sys.stdin.fileno()
@@ -66,6 +72,152 @@ except ImportError:
         termios.tcsetattr(fd, termios.TCSAFLUSH, old_term)
         return dr != []
 
+##############################################################################################
+# support for parallel paging
+
+# return the total number of results from a page of query results, or None if not found
+def _query_total(result_xml):
+    # work out how many total to retrieve (ccm has many occurrences of totalCount so just choose the first)
+    totalel = rdfxml.xml_find_elements(result_xml, './rdf:Description/oslc:totalCount')
+    if totalel:
+        return int(totalel[0].text)
+    # 6.x: <dcterms:title>Query Results: 40220</dcterms:title>
+    totaltext = rdfxml.xmlrdf_get_resource_text(result_xml, './oslc:ResponseInfo/dcterms:title')
+    if totaltext is not None:
+        ttm = re.search(r"(\d+)$", totaltext)
+        if ttm is not None:
+            return int(ttm.group(1))
+    return None
+
+# given the URL of the second page of query results (the oslc:nextPage of the first page) return (makeurl, perpage) where
+# makeurl(n) returns the URL of page n (the first page is 1) and perpage is the number of results on each page,
+# or None if the URL isn't one of the known forms:
+#   6.x page=/pageNum= with the page number - the results per page are oslc.pageSize (or pagesize if that isn't in the URL)
+#   7.x _startIndex= with the index of the first result on the page, which for the second page is the results per page
+def _page_url_maker(nextpageurl, pagesize):
+    rematch = re.search(r"([?&](?:page|pageNum)=)(\d+)", nextpageurl)
+    if rematch is not None:
+        secondpage = int(rematch.group(2))
+        psm = re.search(r"[?&]oslc.pageSize=(\d+)", nextpageurl)
+        perpage = int(psm.group(1)) if psm is not None else pagesize
+        def makeurl(n):
+            return nextpageurl[:rematch.start(2)] + str(secondpage + n - 2) + nextpageurl[rematch.end(2):]
+    else:
+        rematch = re.search(r"([?&]_startIndex=)(\d+)", nextpageurl)
+        if rematch is None:
+            return None
+        perpage = int(rematch.group(2))
+        def makeurl(n):
+            return nextpageurl[:rematch.start(2)] + str(perpage * (n - 1)) + nextpageurl[rematch.end(2):]
+    if perpage <= 0:
+        return None
+    return makeurl, perpage
+
+##############################################################################################
+
+# A query which has been parsed, with its names resolved, once by _OSLCOperations_Mixin.prepare_query() in a context
+# (e.g. a project/component with its configuration) - execute() can then be called repeatedly with different values for
+# the ?name parameters, without parsing or resolving names again
+class PreparedQuery():
+    def __init__(self, context, querycapabilityuri, querysteps, uri_to_name_mapping, select, orderbys, prefixes):
+        self.context = context
+        self.querycapabilityuri = querycapabilityuri
+        self.querysteps = querysteps
+        self.uri_to_name_mapping = uri_to_name_mapping
+        self.select = select
+        self.orderbys = orderbys
+        self.prefixes = prefixes
+        # the QueryParameter(s) for each parameter name - a name can be used more than once
+        self.parameters = {}
+        self._find_parameters(querysteps)
+        # whether each property compared with a parameter has enumerations, so a string value is an enumeration name
+        self._enumproperties = {}
+        for params in self.parameters.values():
+            for param in params:
+                if param.identifier not in self._enumproperties:
+                    self._enumproperties[param.identifier] = self._has_enums(param.identifier)
+        # ids already turned into core artifact URIs for ~?name
+        self._reqids = {}
+
+    def _find_parameters(self, item):
+        if isinstance(item, list):
+            for x in item:
+                self._find_parameters(x)
+        elif isinstance(item, _queryparser.QueryParameter):
+            self.parameters.setdefault(item.name, []).append(item)
+
+    def _has_enums(self, identifier):
+        properties = getattr(self.context, 'properties', None)
+        if not properties or not identifier or identifier == '*':
+            return False
+        uri = identifier if identifier.startswith('http://') or identifier.startswith('https://') else rdfxml.tag_to_uri(identifier, noexception=True)
+        return bool(properties.get(uri, {}).get('enums'))
+
+    # return the query steps with the values substituted for the parameters - values is a dict with a value for each parameter name
+    # a value is converted to what it would be if written in the query:
+    #   True/False and numbers are used as they are, a string '<...>' is a URI reference
+    #   any other string is the name of an enumeration value if the property has enumerations, otherwise a string literal (it's quoted)
+    #   for ~?name the value is an id, for in ?name the value is a list of values
+    def bind(self, values=None):
+        values = values or {}
+        missing = [name for name in self.parameters if name not in values]
+        if missing:
+            raise Exception( f"No value given for query parameter(s) {missing}" )
+        unknown = [name for name in values if name not in self.parameters]
+        if unknown:
+            raise Exception( f"Query has no parameter(s) {unknown} - parameters are {list(self.parameters)}" )
+        return self._substitute(self.querysteps, values)
+
+    def _substitute(self, item, values):
+        if isinstance(item, list):
+            result = []
+            for x in item:
+                if isinstance(x, _queryparser.QueryParameter) and x.islist:
+                    vals = values[x.name]
+                    if not isinstance(vals, (list, tuple, set)):
+                        raise Exception( f"Query parameter {x.name} must be a list of values" )
+                    result.extend( self._bind_value(x, v) for v in vals )
+                else:
+                    result.append(self._substitute(x, values))
+            return result
+        if isinstance(item, _queryparser.QueryParameter):
+            return self._bind_value(item, values[item.name])
+        return item
+
+    def _bind_value(self, param, value):
+        if value is None:
+            raise Exception( f"Query parameter {param.name} can't be None" )
+        if param.reqid:
+            value = str(value)
+            if value not in self._reqids:
+                requri = self.context.resolve_reqid_to_core_uri(value)
+                if requri is None:
+                    raise Exception( f"ID {value} not found!" )
+                self._reqids[value] = "<"+requri+">"
+            return self._reqids[value]
+        if isinstance(value, (bool, int, float)):
+            return value
+        value = str(value)
+        if value.startswith('<') and value.endswith('>'):
+            return value
+        if self._enumproperties.get(param.identifier):
+            # same as a valueidentifier in the query (see _queryparser._ParseTreeToOSLCQuery.term())
+            result = self.context.resolve_enum_name_to_uri(value, param.identifier)
+            if result is None:
+                raise Exception( f"Value {value} for query parameter {param.name} not resolved in context {param.identifier}" )
+            if result.startswith("http:") or result.startswith("https:"):
+                return "<" + result + ">"
+            return '"'+result+'"'
+        return '"' + value.replace('\\','\\\\').replace('"','\\"') + '"'
+
+    # run the query with values for the parameters (see bind()) - the other arguments and the result are the same as for do_complex_query()
+    def execute(self, values=None, *, searchterms=None, isnulls=None, isnotnulls=None, show_progress=False, verbose=False, maxresults=None, delaybetweenpages=0.0, pagesize=200, pageworkers=None, adaptivepaging=False):
+        querysteps = self.bind(values)
+        return self.context._execute_query_steps(self.querycapabilityuri, querysteps, self.uri_to_name_mapping, self.select, self.orderbys, self.prefixes
+                                                    , searchterms=searchterms, isnulls=isnulls, isnotnulls=isnotnulls, show_progress=show_progress, verbose=verbose
+                                                    , maxresults=maxresults, delaybetweenpages=delaybetweenpages, pagesize=pagesize
+                                                    , pageworkers=pageworkers, adaptivepaging=adaptivepaging)
+
 ##############################################################################################
 
 # This class provides OSLC Query capability for use by any app
@@ -87,16 +239,31 @@ class _OSLCOperations_Mixin:
     # OR, set up your OSLC query to do the first biggest query first and refine it entirely locally - but this isn't implemented here
     #
     # sortby is a list of attribute URIs (e.g. dcterms:identifier
+    # pageworkers is the number of pages of results to retrieve concurrently (default PAGE_WORKERS), with adaptivepaging=True to vary this up to pageworkers according to the server's latency and overload responses
     # sortorder default is + for ascending alphabetic sort, use'-' to get descending alphabetic sorting - use '>' to get increasing numeric sorting of the first item in sortby, or < to get decreasing numeric sort (if any value doesn't convert to integer it is assumed to be 0 so will sort first/last)
     def do_complex_query(self,queryresource, querystring='', searchterms=None, select='', orderby='', properties=None, isnulls=None
                         ,isnotnulls=None, enhanced=True, show_progress=True
                         ,show_info=False, verbose=False, maxresults=None, delaybetweenpages=0.0
-                        , pagesize=200
+                        , pagesize=200, pageworkers=None, adaptivepaging=False
                      ):
         if searchterms and querystring:
                 raise Exception( "Can't use query and search terms together!" )
+        prepared = self.prepare_query(queryresource, querystring, select=select, orderby=orderby, show_progress=show_progress)
+        return prepared.execute(searchterms=searchterms, isnulls=isnulls, isnotnulls=isnotnulls, show_progress=show_progress, verbose=verbose
+                                , maxresults=maxresults, delaybetweenpages=delaybetweenpages, pagesize=pagesize, pageworkers=pageworkers, adaptivepaging=adaptivepaging)
+
+    # Parse a query (and select and orderby) and resolve the names in it once, returning a PreparedQuery which can be executed
+    # repeatedly without parsing or resolving again. In the querystring ?name is a parameter for a value which is given when
+    # executing the query, e.g.
+    #   prepared = project.prepare_query( 'oslc_rm:Requirement', "'Status'=?status and Identifier>?minid", select='Identifier,Title' )
+    #   results = prepared.execute( {'status': 'Approved', 'minid': 1000} )
+    # ~?name is a parameter for an id which is turned into the URI of the core artifact (like ~123),
+    # and in ?name is a parameter for a list of values (like in [1,2,3]). See PreparedQuery.bind() for how values are converted
+    def prepare_query(self, queryresource, querystring='', *, select='', orderby='', enhanced=True, show_progress=False):
         if querystring is None:
             querystring=''
+        select = select or ''
+        orderby = orderby or ''
         logger.debug( f"{querystring=}" )
         logger.debug( f"{queryresource=}" )
         # find the query capability
@@ -106,11 +273,6 @@ class _OSLCOperations_Mixin:
             raise Exception( f"No query capability for resource type {queryresource} found!" )
         logger.debug( f"{querycapabilityuri=}" )
 
-        properties = properties or []
-        isnulls = isnulls or []
-        isnotnulls = isnotnulls or []
-        searchterms = searchterms or []
-
         if show_progress:
             print( "Preparing Query" )
 
@@ -138,13 +300,24 @@ class _OSLCOperations_Mixin:
             uri_to_name_mapping = {}
         else:
             try:
-                (querysteps, uri_to_name_mapping) = self._parse_oslc_query(querystring)
+                (querysteps, uri_to_name_mapping) = self._parse_oslc_query(querystring, enhanced=enhanced)
 #            except lark.exceptions.VisitError as e:
             except Exception as e:
                 raise Exception( "Error parsing query" )
             logger.info( f"{querysteps=}" )
             logger.info( f"{uri_to_name_mapping=}" )
 
+        return PreparedQuery(self, querycapabilityuri, querysteps, uri_to_name_mapping, parsedselect, parsedorderby, prefixes)
+
+    # run the (bound) steps of a prepared query and tidy up the results - see PreparedQuery.execute()
+    def _execute_query_steps(self, querycapabilityuri, querysteps, uri_to_name_mapping, parsedselect, parsedorderby, prefixes
+                                ,searchterms=None, isnulls=None, isnotnulls=None, show_progress=True, verbose=False
+                                , maxresults=None, delaybetweenpages=0.0, pagesize=200, pageworkers=None, adaptivepaging=False
+                            ):
+        isnulls = isnulls or []
+        isnotnulls = isnotnulls or []
+        searchterms = searchterms or []
+
         if verbose:
             if querysteps:
                 for i,querystep in enumerate(querysteps):
@@ -158,7 +331,7 @@ class _OSLCOperations_Mixin:
         resultstack = self._evaluate_steps(querycapabilityuri,querysteps, select=parsedselect, prefixes=prefixes
                                             , orderbys=parsedorderby, searchterms=searchterms, show_progress=show_progress
                                             , verbose=verbose, maxresults=maxresults,delaybetweenpages=delaybetweenpages
-                                            , pagesize=pagesize)
+                                            , pagesize=pagesize, pageworkers=pageworkers, adaptivepaging=adaptivepaging)
 
         if len(resultstack) != 1:
             raise Exception(f"Something went horribly wrong and there isn't exactly one result left on the query stack! {len(resultstack)} {resultstack}")
@@ -177,6 +350,14 @@ class _OSLCOperations_Mixin:
             total = len(originalresults.items())
             pbar = tqdm.tqdm(initial=0, total=total,smoothing=1,unit=" results",desc="Processing       ")
 
+        # if the app can, retrieve the names of resources referenced in the results in bulk rather than one at a time in the loop below
+        if hasattr(self, 'prefetch_resource_ids'):
+            valueuris = []
+            for v in originalresults.values():
+                for vattr in v.values():
+                    valueuris.extend(vattr if isinstance(vattr, list) else [vattr])
+            self.prefetch_resource_ids(valueuris)
+
         # convert uris to human-friendly names
         for kuri, v in originalresults.items():
             logger.info( f"post-processing result {kuri} {v}" )
@@ -254,7 +435,7 @@ class _OSLCOperations_Mixin:
 
     # for a query which has been parsed to steps, execute the steps, recursing if there is more than one compount_term
     # a query with two logicalor terms looks like: [[['dcterms:identifier', 'in', [3949]]], [['dcterms:identifier', 'in', [3950]]], 'logicalor']
-    def _evaluate_steps(self, querycapabilityuri,querysteps,resultstack=None, select=None, prefixes=None, orderbys=None, searchterms=None, show_progress=False, verbose=False, maxresults=None, delaybetweenpages=0.0, pagesize=200):
+    def _evaluate_steps(self, querycapabilityuri,querysteps,resultstack=None, select=None, prefixes=None, orderbys=None, searchterms=None, show_progress=False, verbose=False, maxresults=None, delaybetweenpages=0.0, pagesize=200, pageworkers=None, adaptivepaging=False):
         logger.info( f"_evaluate_steps {querysteps}" )
         resultstack = resultstack if resultstack is not None else []
         orderbys = orderbys or []
@@ -272,11 +453,11 @@ class _OSLCOperations_Mixin:
                 if len(step)>0 and isinstance(step[0],list):
                     # handle anded terms
                     # iterate, recursing
-                    resultstack = self._evaluate_steps( querycapabilityuri,step,resultstack=resultstack, select=select, prefixes=prefixes, orderbys=orderbys, searchterms=searchterms, show_progress=show_progress, verbose=verbose, maxresults=maxresults, delaybetweenpages=delaybetweenpages)
+                    resultstack = self._evaluate_steps( querycapabilityuri,step,resultstack=resultstack, select=select, prefixes=prefixes, orderbys=orderbys, searchterms=searchterms, show_progress=show_progress, verbose=verbose, maxresults=maxresults, delaybetweenpages=delaybetweenpages, pagesize=pagesize, pageworkers=pageworkers, adaptivepaging=adaptivepaging)
 #                    raise Exception( f"Very strange parse result! {step}" )
                 else:
                     # do an actual query
-                    results = self.execute_oslc_query(querycapabilityuri,whereterms=[step], select=select, prefixes=prefixes, orderbys=orderbys, searchterms=searchterms, show_progress=show_progress, maxresults=maxresults, delaybetweenpages=delaybetweenpages, pagesize=pagesize)
+                    results = self.execute_oslc_query(querycapabilityuri,whereterms=[step], select=select, prefixes=prefixes, orderbys=orderbys, searchterms=searchterms, show_progress=show_progress, maxresults=maxresults, delaybetweenpages=delaybetweenpages, pagesize=pagesize, pageworkers=pageworkers, adaptivepaging=adaptivepaging)
                     if isinstance(results, list):
                         resultlist = {}
                         for result in results:
@@ -326,7 +507,7 @@ class _OSLCOperations_Mixin:
     # the whereterms can be created using create_query_operator_string
     # NOTE that prefixes is keyed by URL and the value is the prefix!
     # NOTE that whereterms should be a list of lists (the oslc terms) - each of these nested lists is ['attribute',operator',value'] - if more than one and'd term, the first entry must be 'and'!
-    def execute_oslc_query(self, querycapabilityuri, whereterms=None, select=None, prefixes=None, orderbys=None, searchterms=None, show_progress=False, verbose=False, maxresults=None, delaybetweenpages=0.0, pagesize=200):
+    def execute_oslc_query(self, querycapabilityuri, whereterms=None, select=None, prefixes=None, orderbys=None, searchterms=None, show_progress=False, verbose=False, maxresults=None, delaybetweenpages=0.0, pagesize=200, pageworkers=None, adaptivepaging=False):
         if select is None:
             select = []
         prefixes = prefixes or {}
@@ -343,7 +524,7 @@ class _OSLCOperations_Mixin:
             query_params1 = self.hooks[0](query_params)
         else:
              query_params1 = query_params
-        results = self._execute_vanilla_oslc_query(querycapabilityuri,query_params1, select=select, prefixes=prefixes, show_progress=show_progress, verbose=verbose, maxresults=maxresults, delaybetweenpages=delaybetweenpages, pagesize=pagesize)
+        results = self._execute_vanilla_oslc_query(querycapabilityuri,query_params1, select=select, prefixes=prefixes, show_progress=show_progress, verbose=verbose, maxresults=maxresults, delaybetweenpages=delaybetweenpages, pagesize=pagesize, pageworkers=pageworkers, adaptivepaging=adaptivepaging)
         return results
 
     # convert whereterms (which is a list of OSLC and terms) into a corresponding oslc.where string
@@ -450,11 +631,68 @@ class _OSLCOperations_Mixin:
     # select is used to build the returned dictionary containing only the selected values
     #
 
-    def _execute_vanilla_oslc_query(self, querycapabilityuri, query_params, orderby=None, searchterms=None, select=None, prefixes=None, show_progress=False, pagesize=200, verbose=False, maxresults=None, delaybetweenpages=0.0):
+    # check for keys pressed while a query is running - returns True if Esc has been pressed (or terminate was already True)
+    def _check_terminate_key(self, terminate=False):
+        while kbhit():
+            ch = getch()
+            if ch == b'\x1b':
+                print("\nUser pressed escape, terminating query with current results")
+                terminate=True
+            else:
+                # only print note about Esc if not already going to terminate
+                if not terminate:
+                    print( "\nOnly pressing Esc terminates the query - keypress ignored")
+        return terminate
+
+    # retrieve the pages after the first one concurrently, using URLs generated from the second page's URL (see _page_url_maker)
+    # returns (pages, nextpageurl) where nextpageurl is None if all the pages have been retrieved, otherwise the remaining pages
+    # have to be retrieved one at a time starting from it - this happens if the total or the paging scheme isn't known, if a
+    # page links to a different next page than the generated one, or if the results have grown since the first page
+    # onpage is called after each page is received, in order, and can return False to stop
+    def _get_pages_in_parallel(self, firstpage_xml, nextpageurl, headers, *, pagesize, maxresults, pageworkers, adaptive=False, onpage=None):
+        total = _query_total(firstpage_xml)
+        scheme = _page_url_maker(nextpageurl, pagesize)
+        if total is None or scheme is None:
+            logger.info( f"Total results or paging scheme not known {total=} {nextpageurl} - retrieving pages sequentially" )
+            return [], nextpageurl
+        makeurl, perpage = scheme
+        npages = -(-total // perpage)
+        capped = False
+        if maxresults is not None and pagesize > 0 and -(-maxresults // pagesize) < npages:
+            # same number of pages as retrieving sequentially until maxresults is reached
+            npages = -(-maxresults // pagesize)
+            capped = True
+        urls = [makeurl(n) for n in range(2, npages+1)]
+        logger.info( f"Retrieving {len(urls)} pages of {total} results concurrently with {pageworkers} workers" )
+        pages = []
+        expected = nextpageurl
+        for url, result in self.execute_get_rdf_xml_many(urls, headers=headers, cacheable=False, max_workers=pageworkers, ordered=True, adaptive=adaptive):
+            if url != expected:
+                # the previous page doesn't link to this one so the generated URLs can't be used - continue sequentially from the real next page
+                logger.info( f"Page {len(pages)+2} URL {url} isn't the next page {expected} - retrieving the remaining pages sequentially" )
+                return pages, expected
+            if isinstance(result, Exception):
+                raise result
+            queryurls.append(url)
+            pages.append(result)
+            if rdfxml.xml_find_element( result, ".//oslc:nextPage") is None:
+                expected = None
+            else:
+                expected = rdfxml.xmlrdf_get_resource_uri( result, ".//oslc:nextPage")
+            if onpage is not None and onpage(len(pages)) is False:
+                return pages, None
+        if capped:
+            return pages, None
+        if expected is not None:
+            logger.info( "More results than expected - retrieving the remaining pages sequentially" )
+        return pages, expected
+
+    def _execute_vanilla_oslc_query(self, querycapabilityuri, query_params, orderby=None, searchterms=None, select=None, prefixes=None, show_progress=False, pagesize=200, verbose=False, maxresults=None, delaybetweenpages=0.0, pageworkers=None, adaptivepaging=False):
         select = select or []
         orderby = orderby or []
         searchterms = searchterms or []
         prefixes = prefixes or {}
+        pageworkers = PAGE_WORKERS if pageworkers is None else pageworkers
         logger.debug( f"{prefixes=}" )
         headers = {}
 
@@ -526,21 +764,10 @@ class _OSLCOperations_Mixin:
                 # 6.x: <dcterms:title>Query Results: 40220</dcterms:title>
                 # <oslc:nextPage rdf:resource="url...&amp;page=3" />
 
-                # work out how many total to retrieve (ccm has many occurrences of totalCount so just choose the first)
-                totalel = rdfxml.xml_find_elements(this_result_xml, './rdf:Description/oslc:totalCount')
-                totalel = None if not totalel else totalel[0]
-                if totalel is not None:
-                    total = int(totalel.text)
-                else:
-                    totaltext = rdfxml.xmlrdf_get_resource_text(this_result_xml, './oslc:ResponseInfo/dcterms:title')
-                    if totaltext is not None:
-                        ttm = re.search("(\d+)$", totaltext)
-                        if ttm is not None:
-                            total = int(ttm.group(1))
-                        else:
-                            raise Exception( "Something very odd happened - total not found" )
-                    else:
-                        raise Exception( "Something very odd happened - total text not found" )
+                # work out how many total to retrieve
+                total = _query_total(this_result_xml)
+                if total is None:
+                    raise Exception( "Something very odd happened - total not found" )
 
                 # work out how many already retrieved
                 rematch = re.search("(page|pageNum)=(\d+)", query_url)
@@ -566,15 +793,27 @@ class _OSLCOperations_Mixin:
                     pbar.update(donesofar-donelasttime)
                 donelasttime = donesofar
 
-            while kbhit():
-                ch = getch()
-                if ch == b'\x1b':
-                    print("\nUser pressed escape, terminating query with current results")
-                    terminate=True
-                else:
-                    # only print note about Esc if not already going to terminate
-                    if not terminate:
-                        print( "\nOnly pressing Esc terminates the query - keypress ignored")
+            # after the first page, get the rest concurrently if possible - a delay between pages means the load on the server is to be kept low so don't
+            if pageworkers > 1 and len(result_xmls) == 1 and delaybetweenpages <= 0.0:
+                def onpage(n):
+                    nonlocal donelasttime, terminate
+                    if show_progress and pbar is not None:
+                        donesofar = min(total, (n+1)*pagesize)
+                        pbar.update(donesofar-donelasttime)
+                        donelasttime = donesofar
+                    terminate = self._check_terminate_key(terminate)
+                    return not terminate
+                pages, query_url = self._get_pages_in_parallel(this_result_xml, query_url, headers, pagesize=pagesize, maxresults=maxresults, pageworkers=pageworkers, adaptive=adaptivepaging, onpage=onpage)
+                result_xmls.extend(pages)
+                if query_url is None or terminate:
+                    break
+                if pages:
+                    # continue sequentially from the last page retrieved
+                    if maxresults is not None and len(result_xmls)*pagesize>=maxresults:
+                        break
+                    continue
+
+            terminate = self._check_terminate_key(terminate)
             if terminate:
                 break
             if delaybetweenpages>0.0:
@@ -757,10 +996,7 @@ class _OSLCOperations_Mixin:
     # the combination is by matching keys in the returned/stacked query results
     #
     def _parse_oslc_query(self, querystring, enhanced=True, verbose=False):
-        if enhanced:
-            parser = lark.Lark(_queryparser._enhanced_oslc3_query_grammar, start='where_expression', debug=False)
-        else:
-            parser = lark.Lark(_basic_oslc3_query_grammar, start='where_expression', debug=False)
+        parser = _queryparser.get_parser('enhanced' if enhanced else 'basic')
         tree = parser.parse(querystring)
         xformer = _queryparser._ParseTreeToOSLCQuery( resolverobject=self )
         querysteps = xformer.transform(tree)
@@ -772,7 +1008,7 @@ class _OSLCOperations_Mixin:
     #
     def _parse_orderby(self, orderbystring, verbose=False):
         logger.debug( f"{orderbystring=}" )
-        parser = lark.Lark(_queryparser._orderby_grammar, start='sort_terms', debug=False)
+        parser = _queryparser.get_parser('orderby')
         tree = parser.parse(orderbystring)
         xformer = _queryparser._ParseTreeToOSLCOrderBySelect( resolverobject=self)
         orderbys = xformer.transform(tree)
@@ -784,7 +1020,7 @@ class _OSLCOperations_Mixin:
     #
     def _parse_select(self, selectstring, verbose=False):
         logger.info( f"{selectstring=}" )
-        parser = lark.Lark(_queryparser._select_grammar, start='select_terms', debug=False)
+        parser = _queryparser.get_parser('select')
         tree = parser.parse(selectstring)
         xformer = _queryparser._ParseTreeToOSLCOrderBySelect( resolverobject=self )
         selects = xformer.transform(tree)
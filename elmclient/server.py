@@ -5,39 +5,85 @@
 
 
 import collections
+import contextlib
 import datetime
+import functools
+import hashlib
 import html.parser
+import json
 import logging
 import os.path
-import pickle
 import requests
 import socket
 import shutil
+import threading
 import time
 import urllib
 import urllib3
 
+import requests.adapters
+
 from . import _app
 from . import utils
+from . import httpcache
 from . import httpops
+from . import metrics
+from . import throttle
 
 logger = logging.getLogger(__name__)
 
 CACHE_FOLDER = '.web_cache'
 COOKIE_SAVE_FILE = ".cookies"
+# saved login cookies older than this (in seconds) aren't used - the server will probably have expired the session anyway
+COOKIE_MAX_AGE = 8*60*60
 WEB_SAVE_FOLDER = "cache"
 
+# the cache backend used when caching responses: 'file' uses a httpcache.NamespacedFileCache (one file per response) in WEB_SAVE_FOLDER,
+# 'sqlite' uses a single httpcache.SQLiteCache database which is limited in size (CACHE_MAX_SIZE bytes) by evicting
+# the least-recently used responses, and can be wiped instantly
+CACHE_BACKEND = 'file'
+CACHE_MAX_SIZE = httpcache.CACHE_MAX_SIZE
+# compression of cached responses with either backend: None, 'zlib' or 'zstd' - entries already cached stay readable if this is changed
+CACHE_COMPRESSION = None
+
+# the maximum total size (of the XML) of parsed responses kept in memory for a session, 0 to disable
+XML_CACHE_MAX_SIZE = httpcache.XML_CACHE_MAX_SIZE
+
 # The number of days to locally cache responses (can be extended by commandline, or disabled completely)
 CACHEDAYS = 7
 
+# revalidation mode: rather than using cached responses for CACHEDAYS without checking, a cached response older than
+# REVALIDATE_AFTER seconds is revalidated with a conditional request (If-None-Match/If-Modified-Since) and the cached
+# body is reused when the server responds 304 Not Modified - so data is never more than this old and unchanged
+# resources (shapes, rootservices, catalogs, services documents) still don't have to be transferred again.
+# A stale cached response without an ETag can't be revalidated so it is fetched again
+REVALIDATE_AFTER = 60
+
 # this port will be checked for a proxy - if it is there, it will be used for all requests
 # (The default proxy port for Telerik Fiddler is 8888)
 PROXY_PORT = 8888
+# seconds to wait when checking for a proxy on PROXY_PORT - a local proxy accepts (and a closed port refuses) immediately
+PROXY_PROBE_TIMEOUT = 0.25
+# the standard environment variables which configure a proxy - if any of these are set they are used (respecting no_proxy) and there is no check for a local proxy
+PROXY_ENVIRONMENT_VARIABLES = ['https_proxy', 'http_proxy', 'all_proxy']
 
 # this is the default proxy dictionary for Requests - this must be configured
 # by the application code
 proxydict = None
 
+# default HTTP connection pool settings for a server session (these can be overridden when creating a JazzTeamServer)
+# POOL_CONNECTIONS is the number of per-host pools kept, POOL_MAXSIZE the number of connections kept open to each host
+# POOL_BLOCK=True makes a request wait for a free connection when POOL_MAXSIZE are in use, rather than opening a throwaway one
+# POOL_IDLE_TIMEOUT is in seconds - after the session has been idle this long pooled connections are discarded rather than reused
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 10
+POOL_BLOCK = False
+POOL_IDLE_TIMEOUT = None
+
+# apps retrieve their rootservices when first used - with eager initialisation (eager_init=True when creating a JazzTeamServer)
+# the rootservices for all the apps are retrieved concurrently when the server is created
+EAGER_INIT = False
+
 # Disable the InsecureRequestWarning so we can quietly control SSL certificate validation
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -46,9 +92,10 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 import cachecontrol as CC
 import calendar
+import cachecontrol.adapter
+import cachecontrol.controller
 import cachecontrol.heuristics
 import email.utils
-import cachecontrol.caches.file_cache
 
 class _AddDaysHeuristic(cachecontrol.heuristics.BaseHeuristic):
     def __init__(self,days):
@@ -67,11 +114,156 @@ class _AddDaysHeuristic(cachecontrol.heuristics.BaseHeuristic):
         msg = 'Automatically cached! Response is Stale.'
         return '110 - "%s"' % msg
 
+##############################################################################################
+# connection pooling
+
+# mixin for a requests HTTPAdapter which applies an idle timeout to the pooled connections and keeps count
+# of requests made and connections opened, so the pool can be sized for the load
+class _PoolingAdapterMixin():
+    def __init__(self, *args, pool_idle_timeout=None, **kwargs):
+        self.pool_idle_timeout = pool_idle_timeout
+        self._lastused = time.monotonic()
+        # totals from pools which have been closed (idle timeout, or evicted because there are more hosts than pool_connections)
+        self._retired_requests = 0
+        self._retired_connections = 0
+        self._statslock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pools.dispose_func = self._dispose_pool
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        manager.pools.dispose_func = self._dispose_pool
+        return manager
+
+    # remember the counts from a pool before closing it
+    def _dispose_pool(self, pool):
+        with self._statslock:
+            self._retired_requests += pool.num_requests
+            self._retired_connections += pool.num_connections
+        pool.close()
+
+    def _all_managers(self):
+        return [self.poolmanager]+list(self.proxy_manager.values())
+
+    def send(self, request, **kwargs):
+        if self.pool_idle_timeout is not None and time.monotonic()-self._lastused > self.pool_idle_timeout:
+            # the server has probably closed the idle keep-alive connections, so don't try to reuse them
+            logger.info( f"Connection pool idle for more than {self.pool_idle_timeout}s - discarding pooled connections" )
+            for manager in self._all_managers():
+                manager.clear()
+        try:
+            return super().send(request, **kwargs)
+        finally:
+            self._lastused = time.monotonic()
+
+    def pool_stats(self):
+        with self._statslock:
+            stats = {'pools': 0, 'requests': self._retired_requests, 'connections_opened': self._retired_connections, 'idle_connections': 0}
+        for manager in self._all_managers():
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                stats['pools'] += 1
+                stats['requests'] += pool.num_requests
+                stats['connections_opened'] += pool.num_connections
+                if pool.pool is not None:
+                    # the pool queue is pre-filled with None placeholders for connections not yet opened
+                    stats['idle_connections'] += len([conn for conn in list(pool.pool.queue) if conn is not None])
+        # every request which didn't need a new connection reused an existing one
+        stats['connections_reused'] = max(0,stats['requests']-stats['connections_opened'])
+        return stats
+
+class _PooledHTTPAdapter(_PoolingAdapterMixin, requests.adapters.HTTPAdapter):
+    pass
+
+# cached responses are namespaced by user and configuration context (the server and app are part of the url) so
+# users don't share entries and a url used in different configurations has one entry per configuration - see
+# httpcache.make_cache_key(). The request being handled is held per thread while CacheControl calculates cache keys
+# when revalidating, the freshness of every cached response is capped at revalidate_after seconds (whatever expiry
+# the heuristic gave it when it was cached) using a request max-age, which is only present while the cache is checked
+# so it isn't sent to the server. Requests which already have a Cache-Control header (e.g. not cacheable) are unchanged
+class _NamespacedCacheController(cachecontrol.controller.CacheController):
+    def __init__(self, *args, user=None, revalidate_after=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user = user
+        self.revalidate_after = revalidate_after
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def handling(self, request):
+        previous = getattr(self._local, 'request', None)
+        self._local.request = request
+        try:
+            yield
+        finally:
+            self._local.request = previous
+
+    def cache_url(self, uri):
+        url = super().cache_url(uri)
+        request = getattr(self._local, 'request', None)
+        if request is None:
+            return url
+        return httpcache.make_cache_key(url, self.user, httpcache.config_of(url, request.headers))
+
+    def cached_request(self, request):
+        with self.handling(request):
+            if not self.revalidate_after or 'cache-control' in request.headers:
+                return super().cached_request(request)
+            request.headers['Cache-Control'] = f"max-age={int(self.revalidate_after)}"
+            try:
+                return super().cached_request(request)
+            finally:
+                del request.headers['Cache-Control']
+
+    def conditional_headers(self, request):
+        with self.handling(request):
+            return super().conditional_headers(request)
+
+    def cache_response(self, request, response, body=None, status_codes=None):
+        with self.handling(request):
+            return super().cache_response(request, response, body=body, status_codes=status_codes)
+
+    def update_cached_response(self, request, response):
+        with self.handling(request):
+            return super().update_cached_response(request, response)
+
+class _PooledCacheControlAdapter(_PoolingAdapterMixin, cachecontrol.adapter.CacheControlAdapter):
+    def __init__(self, *args, **kwargs):
+        self._streaming = threading.local()
+        super().__init__(*args, **kwargs)
+
+    # streamed responses (large downloads) aren't cached - CacheControl would otherwise keep a copy of the whole body in memory
+    def send(self, request, stream=False, **kw):
+        self._streaming.active = stream
+        try:
+            return super().send(request, stream=stream, **kw)
+        finally:
+            self._streaming.active = False
+
+    def build_response(self, request, response, from_cache=False, cacheable_methods=None):
+        # a 304 is always passed to CacheControl so it's replaced by the cached response
+        if getattr(self._streaming, 'active', False) and not from_cache and response.status != 304:
+            resp = requests.adapters.HTTPAdapter.build_response(self, request, response)
+            resp.from_cache = False
+            return resp
+        revalidated = not from_cache and response.status == 304
+        with self.controller.handling(request):
+            resp = super().build_response(request, response, from_cache=from_cache, cacheable_methods=cacheable_methods)
+        if request.method in self.invalidating_methods and resp.ok:
+            # the entry for the request's user/config has been deleted - also remove it for other users and configs
+            self.cache.invalidate(url=cachecontrol.controller.CacheController.cache_url(request.url))
+        # note when the cached response was revalidated by the server (for the metrics)
+        resp.revalidated = revalidated and resp.from_cache
+        return resp
+
 ##############################################################################################
 
 def caching_save_creds(cachingcontrol):
-#    return ( cachingcontrol < 2 )
-    return False
+    return ( cachingcontrol < 2 )
 
 def caching_save_data(cachingcontrol):
     return ( cachingcontrol < 2 )
@@ -80,6 +272,81 @@ def caching_wipe_cache(cachingcontrol):
     return ( cachingcontrol > 0 )
 
 
+##############################################################################################
+# persistent login cookies - after a login the session cookies are saved encrypted (using the user's password) to a file
+# specific to the server and user, so the next run can reuse them and avoid the login round trips
+# if the saved cookies are no longer valid the server asks for login as usual, so there's no need to check them up-front
+# a session is shared by all the servers using the same user/password, so it has a store for each server (session.cookiestores)
+# and after a login the store for the server logged in to saves the cookies, except for those belonging to the other servers
+
+class _CookieStore():
+    def __init__(self, cachefolder, serverhostport, username, password, maxage=COOKIE_MAX_AGE):
+        # the filename doesn't reveal the server or user
+        keyhash = hashlib.sha256(f"{serverhostport}\n{username}".encode()).hexdigest()[:16]
+        self.filename = os.path.join(cachefolder, f"{COOKIE_SAVE_FILE}_{keyhash}")
+        parsed = urllib.parse.urlparse(serverhostport)
+        self.server = (parsed.scheme.lower(), parsed.netloc.lower())
+        self.host = (parsed.hostname or '').lower()
+        self._password = password
+        self.maxage = maxage
+
+    # True if url is on this store's server
+    def matches(self, url):
+        parsed = urllib.parse.urlparse(url)
+        return (parsed.scheme.lower(), parsed.netloc.lower()) == self.server
+
+    # True if a cookie for domain would be sent to this store's server
+    def matches_domain(self, domain):
+        domain = domain.lower().lstrip('.')
+        return self.host == domain or self.host.endswith('.'+domain)
+
+    # load saved cookies into cookiejar, returning the number of cookies loaded - any problem means nothing is loaded
+    def load(self, cookiejar):
+        if not os.path.isfile(self.filename):
+            return 0
+        try:
+            with open(self.filename, 'rb') as f:
+                saved = json.loads(utils.fernet_decrypt(f.read(), self._password))
+        except Exception as e:
+            logger.info( f"Saved cookies not usable {e}" )
+            self.remove()
+            return 0
+        if time.time() - saved['saved'] > self.maxage:
+            logger.info( "Saved cookies are too old to use" )
+            self.remove()
+            return 0
+        nloaded = 0
+        for c in saved['cookies']:
+            if c['expires'] is not None and c['expires'] < time.time():
+                continue
+            rest = {'HttpOnly': None} if c.get('httponly') else {}
+            cookiejar.set_cookie(requests.cookies.create_cookie(c['name'], c['value'], domain=c['domain'], path=c['path'], secure=c['secure'], expires=c['expires'], rest=rest))
+            nloaded += 1
+        logger.info( f"Loaded {nloaded} saved cookies" )
+        return nloaded
+
+    # others is the stores for the other servers using the same session - their cookies aren't saved
+    def save(self, cookiejar, others=()):
+        cookies = []
+        for c in cookiejar:
+            if not self.matches_domain(c.domain) and any( other.matches_domain(c.domain) for other in others ):
+                continue
+            cookies.append({'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path, 'secure': c.secure, 'expires': c.expires, 'httponly': c.has_nonstandard_attr('HttpOnly')})
+        token = utils.fernet_encrypt(json.dumps({'saved': time.time(), 'cookies': cookies}).encode(), self._password)
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        # write then rename so a concurrent reader never sees a partial file - the file is only readable by the user
+        tmpfilename = f"{self.filename}.{os.getpid()}"
+        if os.path.exists(tmpfilename):
+            os.remove(tmpfilename)
+        with os.fdopen(os.open(tmpfilename, os.O_CREAT|os.O_EXCL|os.O_WRONLY, 0o600), 'wb') as f:
+            f.write(token)
+        os.replace(tmpfilename, self.filename)
+        logger.info( f"Saved {len(cookies)} cookies" )
+
+    def remove(self):
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
+
 ##############################################################################################
 
 class _FormParser(html.parser.HTMLParser):
@@ -106,36 +373,55 @@ class _FormParser(html.parser.HTMLParser):
 ##############################################################################################
 
 def setupproxy(url,proxyport=PROXY_PORT):
-    # If a proxy is running on proxyport, setup proxydict so requests uses the proxy
+    # If the standard proxy environment variables are set requests uses them, otherwise if a proxy is running on proxyport
+    # setup proxydict so requests uses the proxy. The check is only done once per process - returns proxydict
     global proxydict
     if proxydict is None and proxyport!=0:
+        envproxies = environment_proxies(url)
+        if envproxies is not None:
+            logger.info( f'Using proxy from environment {envproxies} for {url}' )
         # test if proxy is running
-        if tcp_can_connect_to_url('127.0.0.1', proxyport, timeout=2.0):
+        elif tcp_can_connect_to_url('127.0.0.1', proxyport, timeout=PROXY_PROBE_TIMEOUT, cached=True):
             # Fiddler is running so setup proxy
-            urlparts = urllib.parse.urlsplit(url)
-            if urlparts.port:
-                proxyurl = urlparts.scheme + "://" + urlparts.netloc[:urlparts.netloc.find(':')]
-            else:
-                proxyurl = urlparts.scheme + "://" + urlparts.netloc
             # insert the proxy dictionary
             proxydict = {
                             'https':'https://127.0.0.1:'+str(proxyport)
                             ,'http':'http://127.0.0.1:'+str(proxyport)
                         }
             logger.info( f'Setting proxy to {proxydict}' )
+    return proxydict
+
+# returns the proxies from the environment which requests will use for url (an empty dict if it is excluded by no_proxy),
+# or None if no proxy environment variables are set
+def environment_proxies(url):
+    if not any( os.environ.get(name) or os.environ.get(name.upper()) for name in PROXY_ENVIRONMENT_VARIABLES ):
+        return None
+    return { k:v for k,v in requests.utils.get_environ_proxies(url).items() if k != 'no' }
 
 ##############################################################################################
 
-# utility to see if a port is active listening for connections
-def tcp_can_connect_to_url(host, port, timeout=5):
-    # create an INET, STREAMing socket
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    # now connect to the web server on port
+# results of tcp_can_connect_to_url(..., cached=True) for this process, key (host,port)
+_connect_results = {}
+_connect_results_lock = threading.Lock()
+
+# utility to see if a port is active listening for connections, waiting at most timeout seconds
+# with cached=True the result is remembered so the check is only done once per process for each host/port
+def tcp_can_connect_to_url(host, port, timeout=5, cached=False):
+    if cached:
+        with _connect_results_lock:
+            if (host,port) in _connect_results:
+                return _connect_results[(host,port)]
     try:
-        s.connect((host, port))
-        return True
+        # create_connection applies timeout to the connect (and tries all the addresses for host, i.e. IPv4 and IPv6)
+        with socket.create_connection((host, port), timeout=timeout):
+            result = True
     except OSError:
-        return False
+        result = False
+    logger.debug( f"Connect to {host}:{port} {'succeeded' if result else 'failed'}" )
+    if cached:
+        with _connect_results_lock:
+            _connect_results[(host,port)] = result
+    return result
 
 
 #################################################################################################
@@ -151,8 +437,12 @@ def tcp_can_connect_to_url(host, port, timeout=5):
 # caching control =0 for full caching, 1 to wipe the cache then use caching, 2 to wipe cache and disable caching
 
 class JazzTeamServer( httpops.HttpOperations_Mixin ):
-    def __init__(self, serverhostport, user, password, jtsappstring='jts', verifysslcerts=True, appstring=None, cachingcontrol=0, cachefolder=CACHE_FOLDER):
-        logger.info( f"Creating server {appstring=} {jtsappstring=} {verifysslcerts=} {cachingcontrol=}" )
+    def __init__(self, serverhostport, user, password, jtsappstring='jts', verifysslcerts=True, appstring=None, cachingcontrol=0, cachefolder=CACHE_FOLDER
+                    , cachebackend=CACHE_BACKEND, cachemaxsize=CACHE_MAX_SIZE, cachecompression=CACHE_COMPRESSION, revalidate=None
+                    , pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, pool_block=POOL_BLOCK, pool_idle_timeout=POOL_IDLE_TIMEOUT
+                    , retrypolicy=None, ratelimit=None, burst=None, eager_init=EAGER_INIT
+                ):
+        logger.info( f"Creating server {appstring=} {jtsappstring=} {verifysslcerts=} {cachingcontrol=} {cachebackend=} {cachemaxsize=} {cachecompression=} {revalidate=} {pool_connections=} {pool_maxsize=} {pool_block=} {pool_idle_timeout=}" )
         self.verifysslcerts = verifysslcerts
         self.username = user
         self.password = password
@@ -164,13 +454,23 @@ class JazzTeamServer( httpops.HttpOperations_Mixin ):
         self.cachingcontrol = cachingcontrol # 0=caching, 1=wipe cache then cache, 2= no caching
         self.headers = None
         self.cachefolder = cachefolder
+        self.cachebackend = cachebackend
         self.apps = []
         self._session = None
 
-        # setup the session
-        self._session = JazzTeamServer.__get_client(user, password,cachingcontrol=cachingcontrol, cachefolder=self.cachefolder)
+        # setup the session - NOTE the session is shared by servers using the same user/password, so the pool and cache settings
+        # used are those given when the session was first created
+        # revalidate is None/0 to use cached responses for CACHEDAYS, or the number of seconds after which a cached response is revalidated
+        poolargs = {'pool_connections': pool_connections, 'pool_maxsize': pool_maxsize, 'pool_block': pool_block, 'pool_idle_timeout': pool_idle_timeout}
+        self._session = JazzTeamServer.__get_client(user, password,cachingcontrol=cachingcontrol, cachefolder=self.cachefolder, poolargs=poolargs, serverhostport=serverhostport, cachebackend=cachebackend, cachemaxsize=cachemaxsize, cachecompression=cachecompression, revalidate=revalidate)
         self._session.verify = verifysslcerts
         self._session.auto_retry = self.auto_retry
+        # the retry policy (an httpops.RetryPolicy) controls the retries, delays and deadline for failed requests
+        if retrypolicy is not None or not hasattr(self._session,'retrypolicy'):
+            self._session.retrypolicy = retrypolicy or httpops.RetryPolicy()
+        # optional limit on requests/second (with a burst allowance) across all apps and threads using the session
+        if ratelimit is not None or not hasattr(self._session,'ratelimiter'):
+            self.set_rate_limit(ratelimit, burst)
         self._session.cachingcontrol = self.cachingcontrol # 0=caching, 1=wipe cache then cache, 2= no caching
 
         if not hasattr(self._session,'is_authenticated'):
@@ -193,10 +493,86 @@ class JazzTeamServer( httpops.HttpOperations_Mixin ):
             if appstring:
                 raise Exception( f"You can't add app '{appstring}' because you haven't specified the jts appstring" )
 
+        # the other apps get their rootservices when first used, but the jts rootservices are retrieved now so a wrong
+        # server url fails here rather than on first use of an app
+        if eager_init:
+            self.load_rootservices()
+        elif self.jts is not None:
+            self.jts.load_rootservices()
+
+    # retrieve the rootservices for all the apps (which haven't already got them) concurrently - normally each app gets them on first use
+    def load_rootservices(self, max_workers=httpops.BULK_MAX_WORKERS):
+        apps = [app for app in self.apps if app._rootservices_xml is None]
+        for app, result in httpops.execute_many(lambda app, headers: app.load_rootservices(), apps, max_workers=max_workers):
+            if isinstance(result, Exception):
+                raise result
+
 
     def get_user_password(self, url=None):
         return (self.__user, self.__password)
 
+    # return the number of retries and the total seconds spent waiting to retry
+    def get_retry_stats(self):
+        return self._session.retrypolicy.get_stats()
+
+    # set the limit on requests per second to the server, burst is the number of requests which can be sent at once after being idle
+    # rate None removes the limit
+    def set_rate_limit(self, rate, burst=None):
+        logger.info( f"Setting rate limit {rate=} {burst=}" )
+        self._session.ratelimiter = throttle.RateLimiter(rate, burst) if rate else None
+
+    # return the metrics.RequestMetrics for this server's session - use get_stats(), to_json() or to_prometheus() to see the
+    # per-endpoint latency, bytes, retries, logins and cache hits, or add hooks to be called for every request
+    def get_metrics(self):
+        return self._session.metrics
+
+    # remove all cached responses - with the sqlite backend this is a single transaction so it's safe while other processes are using the cache
+    def clear_cache(self):
+        if getattr(self._session,'xmlcache',None) is not None:
+            self._session.xmlcache.invalidate()
+        webcache = getattr(self._session,'webcache',None)
+        if webcache is None:
+            return
+        webcache.clear()
+
+    # remove cached responses selectively - see httpcache.SQLiteCache.invalidate() for the criteria, e.g. config=<stream uri>
+    # to refresh everything for a stream or urlpattern='*/types/*' for type system data. Returns the number of responses removed
+    # with the file backend only removing a url or everything (no criteria) is possible. The in-memory parsed XML cache is always emptied
+    def invalidate_cache(self, **criteria):
+        if getattr(self._session,'xmlcache',None) is not None:
+            self._session.xmlcache.invalidate()
+        webcache = getattr(self._session,'webcache',None)
+        if webcache is None:
+            return 0
+        return webcache.invalidate(**criteria)
+
+    # return the size and compression ratio of the response cache, or None if not caching or the (uncompressed) file backend
+    def get_cache_stats(self):
+        webcache = getattr(self._session,'webcache',None)
+        if webcache is None or not hasattr(webcache,'get_stats'):
+            return None
+        return webcache.get_stats()
+
+    # return hit/miss stats for the in-memory cache of parsed XML responses, or None if not caching
+    def get_xml_cache_stats(self):
+        if getattr(self._session,'xmlcache',None) is None:
+            return None
+        return self._session.xmlcache.get_stats()
+
+    # return counts for the connection pool(s) used by this server's session:
+    # pools, requests, connections_opened, connections_reused, idle_connections
+    def get_pool_stats(self):
+        result = {'pools': 0, 'requests': 0, 'connections_opened': 0, 'connections_reused': 0, 'idle_connections': 0}
+        # the same adapter is usually mounted for both http:// and https://
+        adapters = []
+        for adapter in self._session.adapters.values():
+            if adapter not in adapters and hasattr(adapter,'pool_stats'):
+                adapters.append(adapter)
+        for adapter in adapters:
+            for k,v in adapter.pool_stats().items():
+                result[k] += v
+        return result
+
     def find_app(self, appstring, ok_to_create=False):
         domain,contextroot = self.get_appstring_details(appstring)
         for app in self.apps:
@@ -281,8 +657,9 @@ class JazzTeamServer( httpops.HttpOperations_Mixin ):
     __shared_client_cache = collections.OrderedDict()
 
     @staticmethod
-    def __get_client(username, password, ignorecache=False,cachingcontrol=0, cachefolder=CACHE_FOLDER):
+    def __get_client(username, password, ignorecache=False,cachingcontrol=0, cachefolder=CACHE_FOLDER, poolargs=None, serverhostport=None, cachebackend=CACHE_BACKEND, cachemaxsize=CACHE_MAX_SIZE, cachecompression=CACHE_COMPRESSION, revalidate=None):
         '''Get shared client session (one using same user/password)'''
+        poolargs = poolargs or {}
         key = (username, password)
         result = JazzTeamServer.__shared_client_cache.get(key)
 
@@ -296,6 +673,11 @@ class JazzTeamServer( httpops.HttpOperations_Mixin ):
         if result is None:
             # create a new session
 
+            if cachebackend not in ('file','sqlite'):
+                raise Exception( f"Cache backend must be 'file' or 'sqlite' not '{cachebackend}'" )
+            sqlitefile = os.path.join(cachefolder,httpcache.SQLITE_CACHE_FILE)
+            webcache = None
+
             if caching_wipe_cache(cachingcontrol):
                 # uncached data
                 # if there is an existing data cache remove it
@@ -303,31 +685,61 @@ class JazzTeamServer( httpops.HttpOperations_Mixin ):
                     logger.info( f"Erasing existing cache" )
                     shutil.rmtree(os.path.join(cachefolder,WEB_SAVE_FOLDER))
                     time.sleep(1.0)
+                if os.path.isfile(sqlitefile):
+                    # a single transaction, so no need to wait for the filesystem to catch up
+                    logger.info( "Erasing existing sqlite cache" )
+                    webcache = httpcache.SQLiteCache(sqlitefile, maxsize=cachemaxsize, compression=cachecompression)
+                    webcache.clear()
 
             if caching_save_data(cachingcontrol):
-                # cached - create folder for cache
-                webcachefolder = os.path.join(cachefolder,WEB_SAVE_FOLDER)
-                os.makedirs(webcachefolder,exist_ok=True)
-                # cache to file with the CC heuristic to make responses persist for a number of days
-                result = CC.CacheControl(requests.Session(), heuristic=_AddDaysHeuristic(cacheexpiry), cache=CC.caches.file_cache.FileCache(webcachefolder))
+                if cachebackend=='sqlite':
+                    webcache = webcache or httpcache.SQLiteCache(sqlitefile, maxsize=cachemaxsize, compression=cachecompression)
+                else:
+                    # cached - create folder for cache
+                    webcachefolder = os.path.join(cachefolder,WEB_SAVE_FOLDER)
+                    os.makedirs(webcachefolder,exist_ok=True)
+                    if cachecompression:
+                        webcache = httpcache.CompressedFileCache(webcachefolder, compression=cachecompression)
+                    else:
+                        webcache = httpcache.NamespacedFileCache(webcachefolder)
+                # cache with the CC heuristic to make responses persist for a number of days
+                controller = functools.partial(_NamespacedCacheController, user=username, revalidate_after=revalidate)
+                result = CC.CacheControl(requests.Session(), heuristic=_AddDaysHeuristic(cacheexpiry), cache=webcache, controller_class=controller, adapter_class=functools.partial(_PooledCacheControlAdapter,**poolargs))
                 # restore cookies saved after previous login, perhaps we'll avoid having to re-login
             else:
                 # use an ordinary session
                 result = requests.session()
+                adapter = _PooledHTTPAdapter(**poolargs)
+                result.mount('http://', adapter)
+                result.mount('https://', adapter)
+
+            # the saved login cookies for each server using this session - see _CookieStore
+            result.cookiestores = {}
+            # remove the unencrypted cookie file used by older versions
+            if os.path.isfile(os.path.join(cachefolder,COOKIE_SAVE_FILE)):
+                os.remove(os.path.join(cachefolder,COOKIE_SAVE_FILE))
 
+            # the response cache (None if not caching) so it can be cleared/inspected
+            result.webcache = webcache if caching_save_data(cachingcontrol) else None
+            # in-memory cache of parsed XML responses (see httpops.HttpOperations_Mixin.execute_get_xml) - only when caching
+            result.xmlcache = httpcache.ParsedXMLCache(XML_CACHE_MAX_SIZE, maxage=revalidate or None) if caching_save_data(cachingcontrol) and XML_CACHE_MAX_SIZE else None
+
+            # record metrics for all requests using this session
+            result.metrics = metrics.RequestMetrics()
+
+            JazzTeamServer.__shared_client_cache[key] = result
+
+        if serverhostport is not None and serverhostport not in result.cookiestores:
+            cookiestore = _CookieStore(cachefolder, serverhostport, username, password)
             if caching_save_creds(cachingcontrol):
-                # if credentials are being cached, load them from previous session
-                # from https://stackoverflow.com/questions/13030095/how-to-save-requests-python-cookies-to-a-file
-                os.makedirs(cachefolder,exist_ok=True)
-                if os.path.isfile(os.path.join(cachefolder,COOKIE_SAVE_FILE)):
-                    with open(os.path.join(cachefolder,COOKIE_SAVE_FILE), 'rb') as f:
-                        result.cookies.update(pickle.load(f))
+                # if credentials are being cached, load them from previous session, perhaps we'll avoid having to re-login
+                # httpops saves the cookies after each successful login
+                cookiestore.load(result.cookies)
+                result.cookiestores[serverhostport] = cookiestore
             else:
                 # remove any saved cookies from previous login
-                if os.path.isfile(os.path.join(cachefolder,COOKIE_SAVE_FILE)):
-                    os.remove(os.path.join(cachefolder,COOKIE_SAVE_FILE))
-
-            JazzTeamServer.__shared_client_cache[key] = result
+                cookiestore.remove()
+                result.cookiestores[serverhostport] = None
 
         # ensure proxies are setup
         result.proxies = proxydict
@@ -0,0 +1,129 @@
+##
+## © Copyright 2021- IBM Inc. All rights reserved
+# SPDX-License-Identifier: MIT
+##
+
+# controls on the load put on the server by a client
+# a RateLimiter is attached to the session (see JazzTeamServer ratelimit/burst) and httpops.HttpRequest
+# waits for it before sending every request, so the limit applies across all threads and all apps
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# token bucket: tokens are added at rate per second up to burst; each request takes one token, waiting until one is available
+class RateLimiter():
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise Exception( f"Rate limit must be greater than zero not {rate}" )
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        # totals of requests delayed and seconds waited
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    # wait until a request can be sent, returning the seconds waited
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # take the token now (possibly going negative) so that waiting threads are queued in order
+            self._tokens -= 1.0
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            if wait > 0:
+                self.waits += 1
+                self.wait_seconds += wait
+        if wait > 0:
+            logger.debug( f"Rate limit waiting {wait:.3f}s" )
+            time.sleep(wait)
+        return wait
+
+    def get_stats(self):
+        with self._lock:
+            return {'rate': self.rate, 'burst': self.burst, 'waits': self.waits, 'wait_seconds': self.wait_seconds}
+
+# AIMD (additive increase, multiplicative decrease) adaptive concurrency limit, used by the bulk/parallel request paths
+# when adaptive mode is requested. While latency stays near the baseline the limit grows by about one per limit's worth
+# of completed requests; on an overload response (429/502/503/504 or timeout, see httpops.is_overload_error) or a
+# latency spike the limit is multiplied by backoff. A spike is more than latency_tolerance times the baseline and at
+# least min_spike seconds more, so that very fast responses don't make normal ones look like spikes.
+# The baseline is a decaying minimum of the latency of each HTTP request sent (see httpops.HttpRequest._send_traced,
+# responses from the cache aren't samples): it drops immediately to a faster sample and moves by baseline_decay of the
+# way towards every slower one, including spikes, so an unusually fast sample (e.g. the first) only has a short-lived effect
+# Decreases within cooldown seconds of the previous one are ignored because the requests already in flight will all see the same overload
+class AdaptiveConcurrency():
+    def __init__(self, initial=4, minimum=1, maximum=32, backoff=0.5, latency_tolerance=2.0, min_spike=0.25, cooldown=1.0, baseline_decay=0.1):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.min_spike = min_spike
+        self.cooldown = cooldown
+        self.baseline_decay = baseline_decay
+        self.baseline = None
+        self.inflight = 0
+        self.increases = 0
+        self.decreases = 0
+        self._lastdecrease = None
+        self._cond = threading.Condition()
+
+    # wait for a free slot under the current limit
+    def acquire(self):
+        with self._cond:
+            while self.inflight >= int(self.limit):
+                self._cond.wait()
+            self.inflight += 1
+
+    # release a slot
+    def release(self):
+        with self._cond:
+            self.inflight -= 1
+            self._cond.notify_all()
+
+    # called with the latency of each HTTP request sent (not including waits for retry, login or the rate limiter)
+    def observe(self, latency):
+        with self._cond:
+            self._observe(latency)
+            self._cond.notify_all()
+
+    # called when a request gets an overload response
+    def overload(self, reason="overload"):
+        with self._cond:
+            self._decrease(reason)
+
+    def _observe(self, latency):
+        if self.baseline is None:
+            self.baseline = latency
+            return
+        spike = latency > self.latency_tolerance * self.baseline and latency > self.baseline + self.min_spike
+        if latency < self.baseline:
+            self.baseline = latency
+        else:
+            self.baseline += self.baseline_decay * (latency - self.baseline)
+        if spike:
+            self._decrease( f"latency {latency:.3f}s > {self.latency_tolerance} x baseline {self.baseline:.3f}s" )
+        elif self.limit < self.maximum:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self.increases += 1
+
+    def _decrease(self, reason):
+        now = time.monotonic()
+        if self._lastdecrease is not None and now - self._lastdecrease < self.cooldown:
+            return
+        self._lastdecrease = now
+        newlimit = max(self.minimum, self.limit * self.backoff)
+        if newlimit < self.limit:
+            logger.info( f"Adaptive concurrency reduced from {self.limit:.1f} to {newlimit:.1f} because {reason}" )
+            self.limit = newlimit
+            self.decreases += 1
+
+    def get_stats(self):
+        with self._cond:
+            return {'limit': self.limit, 'inflight': self.inflight, 'baseline_seconds': self.baseline, 'increases': self.increases, 'decreases': self.decreases}
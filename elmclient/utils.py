@@ -6,16 +6,31 @@
 import os
 import logging
 import datetime
+import importlib.util
 import inspect
 import base64
 import logging
+import sys
 
 from . import rdfxml
 
-import cryptography.fernet
-import cryptography.hazmat.backends
-import cryptography.hazmat.primitives
-import cryptography.hazmat.primitives.kdf.pbkdf2
+############################################################################
+# lazy import of (slow to import) modules which aren't needed by every run, to make importing elmclient quicker
+# returns the module which is actually loaded the first time one of its attributes is used, e.g.
+#   tqdm = utils.lazy_import('tqdm')
+# NOTE a lazily-imported module can't be used at import time (e.g. for a base class) because that would load it immediately
+def lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError( f"No module named '{name}'", name=name )
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
 
 ############################################################################
 # setup logging
@@ -84,18 +99,24 @@ def setup_logging(consolelevel=None, filelevel=logging.INFO):
 
 ITERATIONS = 100000
 
+# the cryptography modules are only imported when credentials files are used
 def _derive_key(password, salt, iterations = ITERATIONS):
+    import cryptography.hazmat.backends
+    import cryptography.hazmat.primitives.hashes
+    import cryptography.hazmat.primitives.kdf.pbkdf2
     kdf =  cryptography.hazmat.primitives.kdf.pbkdf2.PBKDF2HMAC(
         algorithm=cryptography.hazmat.primitives.hashes.SHA256(), length=32, salt=salt,
         iterations=iterations, backend=cryptography.hazmat.backends.default_backend())
     return base64.urlsafe_b64encode(kdf.derive(password))
 
 def fernet_encrypt(message, password, iterations = ITERATIONS):
+    import cryptography.fernet
     salt = os.urandom(16)
     key = _derive_key(password.encode(), salt, iterations)
     return base64.urlsafe_b64encode( b'%b%b%b' % ( salt, iterations.to_bytes(4, 'big'), base64.urlsafe_b64decode( cryptography.fernet.Fernet(key).encrypt(message)), ) )
 
 def fernet_decrypt(token, password):
+    import cryptography.fernet
     decoded = base64.urlsafe_b64decode(token)
     salt, iter, token = decoded[:16], decoded[16:20], base64.urlsafe_b64encode(decoded[20:])
     iterations = int.from_bytes(iter, 'big')
@@ -32,11 +32,13 @@ setup(
     packages=["elmclient", "elmclient.examples", "elmclient.examples.basic","elmclient.tests"],
     include_package_data=True,
     install_requires=['CacheControl==0.12.6','anytree==2.8.0',"colorama==0.4.4","cryptography==3.4.4",'lark_parser==0.12.0','lockfile==0.12.2','lxml==4.6.3',"openpyxl == 3.0.9","requests==2.24.0","requests_toolbelt==0.9.1",'tqdm==4.56.2','urllib3==1.25.11'],
+    extras_require={"zstd": ["zstandard==0.17.0"]},
     entry_points={
         "console_scripts": [
             "oslcquery=elmclient.examples.oslcquery:main",
             "batchquery=elmclient.examples.batchquery:main",
             "reqif_io=elmclient.examples.reqif_io:main",
+            "cacheadmin=elmclient.examples.cacheadmin:main",
         ]
     },
 )
@@ -0,0 +1,64 @@
+##
+## © Copyright 2021- IBM Inc. All rights reserved
+# SPDX-License-Identifier: MIT
+##
+
+# tests for resuming downloads (httpops._Download) - run using python -m pytest from the top folder
+
+import os
+
+from elmclient import httpops
+
+class FakeResponse():
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+
+def test_partial_file_is_resumed_with_if_range(tmp_path):
+    filename = tmp_path / "file.bin"
+    d = httpops._Download(filename)
+    d.start(FakeResponse(200, {'Content-Length': '10', 'ETag': '"v1"'}))
+    d.write(b"hello")
+    d.close()
+    # a later run
+    d = httpops._Download(filename)
+    assert d.done == 5
+    assert d.get_range_headers() == {'Range': 'bytes=5-', 'If-Range': '"v1"'}
+    d.start(FakeResponse(206, {'Content-Range': 'bytes 5-9/10', 'ETag': '"v1"'}))
+    d.write(b"world")
+    d.finish()
+    d.close()
+    assert filename.read_bytes() == b"helloworld"
+    assert not os.path.exists(str(filename)+".part.validator")
+
+def test_changed_resource_restarts(tmp_path):
+    filename = tmp_path / "file.bin"
+    d = httpops._Download(filename)
+    d.start(FakeResponse(200, {'Content-Length': '10', 'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'}))
+    d.write(b"hello")
+    d.close()
+    d = httpops._Download(filename)
+    assert d.get_range_headers()['If-Range'] == 'Mon, 01 Jan 2024 00:00:00 GMT'
+    # If-Range didn't match so the server sends the whole (new) resource
+    d.start(FakeResponse(200, {'Content-Length': '3', 'ETag': '"v2"'}))
+    d.write(b"new")
+    d.finish()
+    d.close()
+    assert filename.read_bytes() == b"new"
+
+def test_partial_file_without_validator_isnt_resumed(tmp_path):
+    filename = tmp_path / "file.bin"
+    (tmp_path / "file.bin.part").write_bytes(b"stale")
+    d = httpops._Download(filename)
+    assert d.done == 0
+    assert d.get_range_headers() == {}
+    d.close()
+
+def test_no_validator_restarts_in_process(tmp_path):
+    d = httpops._Download(tmp_path / "file.bin")
+    # weak ETags can't be used with If-Range
+    d.start(FakeResponse(200, {'Content-Length': '10', 'ETag': 'W/"v1"'}))
+    d.write(b"hello")
+    assert d.get_range_headers() == {}
+    assert d.done == 0
+    d.close()
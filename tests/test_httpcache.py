@@ -0,0 +1,167 @@
+##
+## © Copyright 2021- IBM Inc. All rights reserved
+# SPDX-License-Identifier: MIT
+##
+
+# tests for the response caches in httpcache - run using python -m pytest from the top folder
+
+import pytest
+
+from elmclient import httpcache
+
+URL1 = "https://jazz.ibm.com:9443/rm/resources/_IZCsIRuREeyjc_YwJfTLJA"
+URL2 = "https://jazz.ibm.com:9443/rm/types/_SRBoRdd8EeqV5_5cfWW9rw"
+
+def test_file_cache_invalidates_url_for_all_users_and_configs(tmp_path):
+    cache = httpcache.NamespacedFileCache(str(tmp_path))
+    keys = [httpcache.make_cache_key(URL1, "alice"), httpcache.make_cache_key(URL1, "bob", "https://jazz.ibm.com:9443/gc/configuration/1")]
+    for key in keys:
+        cache.set(key, b"v1")
+    other = httpcache.make_cache_key(URL2, "alice")
+    cache.set(other, b"v2")
+    assert cache.invalidate(url=URL1) == 2
+    assert [cache.get(key) for key in keys] == [None, None]
+    assert cache.get(other) == b"v2"
+    assert cache.invalidate(url=URL1) == 0
+
+def test_file_cache_only_invalidates_by_url(tmp_path):
+    cache = httpcache.NamespacedFileCache(str(tmp_path))
+    with pytest.raises(Exception):
+        cache.invalidate(config="https://jazz.ibm.com:9443/gc/configuration/1")
+    cache.set(httpcache.make_cache_key(URL1, "alice"), b"v1")
+    cache.invalidate(url=None, config=None)
+    assert cache.get(httpcache.make_cache_key(URL1, "alice")) is None
+
+def test_compressed_file_cache(tmp_path):
+    cache = httpcache.CompressedFileCache(str(tmp_path))
+    key = httpcache.make_cache_key(URL1, "alice")
+    cache.set(key, b"x"*1000)
+    assert cache.get(key) == b"x"*1000
+    assert cache.get_stats()['ratio'] > 1
+    assert cache.invalidate(url=URL1) == 1
+
+CONFIG = "https://jazz.ibm.com:9443/gc/configuration/1"
+
+@pytest.fixture
+def sqlitecache(tmp_path):
+    cache = httpcache.SQLiteCache(str(tmp_path / httpcache.SQLITE_CACHE_FILE), maxsize=None)
+    yield cache
+    cache.close()
+
+def test_sqlite_cache_get_set_delete(sqlitecache):
+    key = httpcache.make_cache_key(URL1, "alice", CONFIG)
+    assert sqlitecache.get(key) is None
+    sqlitecache.set(key, b"v1")
+    sqlitecache.set(key, b"v22")
+    assert sqlitecache.get(key) == b"v22"
+    assert sqlitecache.get_size() == 3
+    sqlitecache.delete(key)
+    assert sqlitecache.get(key) is None
+    assert sqlitecache.get_size() == 0
+
+def test_sqlite_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(httpcache.time, 'time', lambda: now[0])
+    cache = httpcache.SQLiteCache(str(tmp_path / httpcache.SQLITE_CACHE_FILE), maxsize=300)
+    keys = [ httpcache.make_cache_key(f"{URL1}{i}", "alice") for i in range(3) ]
+    for key in keys:
+        now[0] += 1
+        cache.set(key, b"x"*100)
+    # reading the first makes the second the least recently used
+    now[0] += 1
+    assert cache.get(keys[0]) is not None
+    now[0] += 1
+    cache.set(httpcache.make_cache_key(URL2, "alice"), b"x"*100)
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get_size() <= 300*httpcache.EVICT_TO
+    cache.close()
+
+def test_sqlite_cache_invalidate(sqlitecache):
+    sqlitecache.set(httpcache.make_cache_key(URL1, "alice", CONFIG), b"1")
+    sqlitecache.set(httpcache.make_cache_key(URL1, "bob"), b"2")
+    sqlitecache.set(httpcache.make_cache_key(URL2, "alice", CONFIG), b"3")
+    sqlitecache.set(httpcache.make_cache_key("https://jazz.ibm.com:9443/qm/x", "alice"), b"4")
+    assert sqlitecache.invalidate(url=URL1) == 2
+    assert sqlitecache.invalidate(config=CONFIG) == 1
+    assert sqlitecache.invalidate(urlpattern="*/types/*") == 0
+    assert sqlitecache.invalidate(app="qm", urlprefix="https://jazz.ibm.com:9443/") == 1
+    assert sqlitecache.get_stats()['entries'] == 0
+    assert sqlitecache.get_size() == 0
+
+def test_sqlite_cache_compression(tmp_path):
+    cache = httpcache.SQLiteCache(str(tmp_path / httpcache.SQLITE_CACHE_FILE), maxsize=None, compression='zlib')
+    key = httpcache.make_cache_key(URL1, "alice")
+    cache.set(key, b"<rdf:RDF/>"*100)
+    assert cache.get(key) == b"<rdf:RDF/>"*100
+    stats = cache.get_stats()
+    assert stats['rawsize'] == 1000 and stats['size'] < 1000
+    cache.close()
+
+def test_sqlite_cache_prune_and_inspect(sqlitecache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(httpcache.time, 'time', lambda: now[0])
+    old = httpcache.make_cache_key(URL1, "alice")
+    sqlitecache.set(old, b"1")
+    now[0] += 10*86400
+    new = httpcache.make_cache_key(URL2, "alice")
+    sqlitecache.set(new, b"2")
+    sqlitecache.get(new)
+    details = sqlitecache.inspect(groupby='pattern', staleafter=86400)
+    assert details['totals']['entries'] == 2
+    assert details['totals']['hits'] == 1
+    assert details['stale']['entries'] == 1
+    assert set(details['groups']) == {"/rm/resources/{id}", "/rm/types/{id}"}
+    assert sqlitecache.prune(maxage=86400) == 1
+    assert sqlitecache.get(old) is None
+
+def test_cache_keys():
+    key = httpcache.make_cache_key(URL1, "alice", CONFIG)
+    assert httpcache.split_cache_key(key) == ("alice", CONFIG, URL1)
+    assert httpcache.split_cache_key(URL1) == ("", "", URL1)
+    assert httpcache.config_of(URL1+"?oslc_config.context="+CONFIG) == CONFIG
+    assert httpcache.config_of(URL1, {'Configuration-Context': CONFIG}) == CONFIG
+
+def test_parsed_xml_cache_returns_copies(monkeypatch):
+    ET = pytest.importorskip("lxml.etree")
+    cache = httpcache.ParsedXMLCache(maxsize=1000)
+    key = (URL1, 'application/rdf+xml', None, None)
+    assert cache.get(key) is None
+    tree = ET.ElementTree(ET.fromstring("<a><b/></a>"))
+    cache.set(key, tree, 11)
+    # changing the tree (or a copy from the cache) doesn't change what's cached
+    tree.getroot().clear()
+    hit = cache.get(key)
+    assert len(hit.getroot()) == 1
+    hit.getroot().clear()
+    assert len(cache.get(key).getroot()) == 1
+    stats = cache.get_stats()
+    assert (stats['hits'], stats['misses'], stats['size']) == (2, 1, 11)
+
+def test_parsed_xml_cache_evicts_least_recently_used():
+    cache = httpcache.ParsedXMLCache(maxsize=300)
+    keys = [ (f"{URL1}{i}", None, None, None) for i in range(3) ]
+    for key in keys:
+        cache.set(key, "tree", 100)
+    cache.get(keys[0])
+    cache.set((URL2, None, None, None), "tree", 100)
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == "tree"
+    assert cache.get_stats()['evictions'] == 1
+    # too big to cache at all
+    cache.set((URL1, None, None, None), "bigtree", 1000)
+    assert cache.get((URL1, None, None, None)) is None
+    assert cache.get_stats()['size'] == 300
+
+def test_parsed_xml_cache_invalidate_and_maxage(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(httpcache.time, 'monotonic', lambda: now[0])
+    cache = httpcache.ParsedXMLCache(maxsize=1000, maxage=60)
+    cache.set((URL1+"?oslc.select=*", None, None, None), "tree", 10)
+    cache.set((URL1, None, "config", None), "tree", 10)
+    cache.set((URL2, None, None, None), "tree", 10)
+    cache.invalidate(URL1)
+    assert cache.get_stats()['entries'] == 1
+    now[0] += 61
+    assert cache.get((URL2, None, None, None)) is None
+    assert cache.get_stats()['size'] == 0
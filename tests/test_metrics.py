@@ -0,0 +1,36 @@
+##
+## © Copyright 2021- IBM Inc. All rights reserved
+# SPDX-License-Identifier: MIT
+##
+
+# tests for metrics.RequestMetrics - run using python -m pytest from the top folder
+
+from elmclient import metrics
+
+class FakeRequest():
+    def __init__(self, url, method="GET", body=None):
+        self.url = url
+        self.method = method
+        self.body = body
+
+class FakeResponse():
+    def __init__(self, content, from_cache):
+        self.status_code = 200
+        self.headers = {}
+        self.content = content
+        self.from_cache = from_cache
+
+def test_endpoint_name():
+    assert metrics.endpoint_name("GET", "https://jazz.ibm.com:9443/rm/resources/TX_SRBoRdd8EeqV5_5cfWW9rw?x=1") == "GET /rm/resources/{id}"
+
+def test_cached_bytes_are_counted_separately():
+    m = metrics.RequestMetrics()
+    request = FakeRequest("https://jazz.ibm.com:9443/rm/resources/_IZCsIRuREeyjc_YwJfTLJA")
+    m.after_request(request, FakeResponse(b"x"*100, from_cache=False), 0.5)
+    m.after_request(request, FakeResponse(b"x"*100, from_cache=True), 0.01)
+    totals = m.get_stats()['totals']
+    assert totals['bytes_in'] == 100
+    assert totals['bytes_from_cache'] == 100
+    assert totals['cache_hits'] == 1
+    assert totals['cache_misses'] == 1
+    assert 'elmclient_cache_bytes_total{endpoint="GET /rm/resources/{id}"} 100' in m.to_prometheus()
@@ -0,0 +1,104 @@
+##
+## © Copyright 2021- IBM Inc. All rights reserved
+# SPDX-License-Identifier: MIT
+##
+
+# tests for oslcqueryapi.PreparedQuery and parallel paging - run using python -m pytest from the top folder
+
+import pytest
+
+from elmclient import oslcqueryapi
+
+QCURI = "https://jazz.ibm.com:9443/rm/views?oslc.query=true"
+
+# a context with just enough to parse queries and bind values
+class FakeContext(oslcqueryapi._OSLCOperations_Mixin):
+    folder_nametouri_resolver = None
+    user_nametouri_resolver = None
+    resolve_modulename_to_uri = None
+    def __init__(self):
+        self.properties = {'http://ex/p/Status': {'enums': ['http://ex/e/Open']}}
+        self.reqids = []
+    def resolve_property_name_to_uri(self, name, shapeuri=None):
+        return "http://ex/p/"+name
+    def resolve_enum_name_to_uri(self, name, identifier):
+        return "http://ex/e/"+name if name != 'Unknown' else None
+    def resolve_reqid_to_core_uri(self, reqid):
+        self.reqids.append(reqid)
+        return "http://ex/r/"+reqid if reqid != '999' else None
+
+def prepare(querystring):
+    context = FakeContext()
+    querysteps, mapping = context._parse_oslc_query(querystring)
+    return oslcqueryapi.PreparedQuery(context, QCURI, querysteps, mapping, [], [], {})
+
+def test_bind_values():
+    prepared = prepare("Title=?title and Priority>?n and Status=?status")
+    assert sorted(prepared.parameters) == ['n', 'status', 'title']
+    assert prepared.bind({'title': 'say "hi"', 'n': 3, 'status': 'Open'}) == [['and'
+                                , ['http://ex/p/Title', '=', '"say \\"hi\\""']
+                                , ['http://ex/p/Priority', '>', 3]
+                                , ['http://ex/p/Status', '=', '<http://ex/e/Open>']
+                            ]]
+    # a URI reference is used as it is
+    assert prepared.bind({'title': '<http://ex/x>', 'n': 1.5, 'status': '<http://ex/e/Closed>'})[0][1][2] == '<http://ex/x>'
+
+def test_bind_in_list():
+    prepared = prepare("Status in ?statuses")
+    assert prepared.bind({'statuses': ['Open', 'Closed']}) == [['http://ex/p/Status', 'in', ['<http://ex/e/Open>', '<http://ex/e/Closed>']]]
+    with pytest.raises(Exception):
+        prepared.bind({'statuses': 'Open'})
+    with pytest.raises(Exception):
+        prepared.bind({'statuses': ['Unknown']})
+
+def test_bind_reqid_resolves_once():
+    prepared = prepare("dcterms:identifier=~?id")
+    assert prepared.bind({'id': 123}) == [['dcterms:identifier', '=', '<http://ex/r/123>']]
+    assert prepared.bind({'id': '123'}) == [['dcterms:identifier', '=', '<http://ex/r/123>']]
+    assert prepared.context.reqids == ['123']
+    with pytest.raises(Exception):
+        prepared.bind({'id': 999})
+
+def test_bind_missing_or_unknown_names():
+    prepared = prepare("Title=?title")
+    with pytest.raises(Exception):
+        prepared.bind()
+    with pytest.raises(Exception):
+        prepared.bind({'title': 'x', 'other': 'y'})
+    with pytest.raises(Exception):
+        prepared.bind({'title': None})
+    # the prepared steps aren't changed by binding
+    prepared.bind({'title': 'x'})
+    assert isinstance(prepared.querysteps[0][2], oslcqueryapi._queryparser.QueryParameter)
+
+def test_page_url_maker_page_number():
+    makeurl, perpage = oslcqueryapi._page_url_maker("https://jazz.ibm.com:9443/ccm/oslc/query?oslc.pageSize=50&page=2&x=1", 200)
+    assert perpage == 50
+    assert makeurl(2) == "https://jazz.ibm.com:9443/ccm/oslc/query?oslc.pageSize=50&page=2&x=1"
+    assert makeurl(5) == "https://jazz.ibm.com:9443/ccm/oslc/query?oslc.pageSize=50&page=5&x=1"
+    # the page size isn't in the URL
+    makeurl, perpage = oslcqueryapi._page_url_maker("https://jazz.ibm.com:9443/rm/views?pageNum=1&y=2", 200)
+    assert perpage == 200
+    assert makeurl(3) == "https://jazz.ibm.com:9443/rm/views?pageNum=2&y=2"
+
+def test_page_url_maker_start_index():
+    makeurl, perpage = oslcqueryapi._page_url_maker("https://jazz.ibm.com:9443/rm/views?_startIndex=100&a=b", 200)
+    assert perpage == 100
+    assert makeurl(2) == "https://jazz.ibm.com:9443/rm/views?_startIndex=100&a=b"
+    assert makeurl(4) == "https://jazz.ibm.com:9443/rm/views?_startIndex=300&a=b"
+    assert oslcqueryapi._page_url_maker("https://jazz.ibm.com:9443/rm/views?_startIndex=0", 200) is None
+    assert oslcqueryapi._page_url_maker("https://jazz.ibm.com:9443/rm/views?token=abc", 200) is None
+
+RESULTS_TOTALCOUNT = """<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" xmlns:oslc="http://open-services.net/ns/core#">
+    <rdf:Description rdf:about="https://jazz.ibm.com:9443/ccm/oslc/query"><oslc:totalCount>1234</oslc:totalCount></rdf:Description>
+</rdf:RDF>"""
+
+RESULTS_TITLE = """<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" xmlns:oslc="http://open-services.net/ns/core#" xmlns:dcterms="http://purl.org/dc/terms/">
+    <oslc:ResponseInfo rdf:about="https://jazz.ibm.com:9443/rm/views"><dcterms:title>Query Results: 40220</dcterms:title></oslc:ResponseInfo>
+</rdf:RDF>"""
+
+def test_query_total():
+    ET = pytest.importorskip("lxml.etree")
+    assert oslcqueryapi._query_total(ET.fromstring(RESULTS_TOTALCOUNT)) == 1234
+    assert oslcqueryapi._query_total(ET.fromstring(RESULTS_TITLE)) == 40220
+    assert oslcqueryapi._query_total(ET.fromstring("<rdf:RDF xmlns:rdf='http://www.w3.org/1999/02/22-rdf-syntax-ns#'/>")) is None
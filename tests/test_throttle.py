@@ -0,0 +1,83 @@
+##
+## © Copyright 2021- IBM Inc. All rights reserved
+# SPDX-License-Identifier: MIT
+##
+
+# tests for the AIMD state machine of throttle.AdaptiveConcurrency - run using python -m pytest from the top folder
+
+import pytest
+
+from elmclient import throttle
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(throttle.time, 'monotonic', clock)
+    return clock
+
+def test_increases_while_latency_is_steady(clock):
+    ac = throttle.AdaptiveConcurrency(initial=4, maximum=8)
+    for i in range(100):
+        ac.observe(0.5)
+    assert ac.limit == 8
+    assert ac.decreases == 0
+
+def test_fast_first_sample_doesnt_make_normal_latency_spikes(clock):
+    ac = throttle.AdaptiveConcurrency(initial=4, maximum=16)
+    # e.g. a tiny resource
+    ac.observe(0.01)
+    for i in range(200):
+        clock.now += 0.1
+        ac.observe(1.0)
+    # the baseline has caught up with the normal latency and the limit has recovered from any early decreases
+    assert ac.baseline == pytest.approx(1.0, rel=0.01)
+    assert ac.limit == 16
+
+def test_spike_decreases_then_recovers(clock):
+    ac = throttle.AdaptiveConcurrency(initial=8, maximum=8)
+    for i in range(10):
+        ac.observe(0.5)
+    ac.observe(5.0)
+    assert ac.limit == 4
+    assert ac.decreases == 1
+    for i in range(100):
+        clock.now += 0.1
+        ac.observe(0.5)
+    assert ac.limit == 8
+
+def test_overload_decreases_to_minimum(clock):
+    ac = throttle.AdaptiveConcurrency(initial=8, minimum=2, maximum=8)
+    for i in range(5):
+        clock.now += 10
+        ac.overload()
+    assert ac.limit == 2
+
+def test_cooldown(clock):
+    ac = throttle.AdaptiveConcurrency(initial=16, maximum=16, cooldown=1.0)
+    ac.overload()
+    assert ac.limit == 8
+    # requests already in flight see the same overload
+    clock.now += 0.5
+    ac.overload()
+    ac.observe(0.5)
+    ac.observe(50.0)
+    assert ac.limit == 8
+    assert ac.decreases == 1
+    clock.now += 1.0
+    ac.overload()
+    assert ac.limit == 4
+    assert ac.decreases == 2
+
+def test_acquire_is_limited(clock):
+    ac = throttle.AdaptiveConcurrency(initial=2, maximum=4)
+    ac.acquire()
+    ac.acquire()
+    assert ac.inflight == 2
+    ac.release()
+    assert ac.inflight == 1